@@ -0,0 +1,165 @@
+"""Content-addressed cache of video analysis results
+
+Results are keyed by a SHA-256 of the video content plus ANALYZER_VERSION,
+so a re-submitted or renamed file is recognised and results from older
+analyzers are never reused. Entries live in a local SQLite database with a
+time-to-live and least-recently-used eviction once the stored values
+exceed max_bytes.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+CACHE_PATH = "data/analysis_cache.sqlite"
+
+# Bump whenever an analyzer changes what it returns
+ANALYZER_VERSION = "2"
+
+# Defaults for the size limit and the time-to-live of an entry
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+CACHE_TTL_SECONDS = 30 * 24 * 3600
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path, chunk_size=HASH_CHUNK_SIZE):
+    """SHA-256 hex digest of a file, read in chunks so memory stays bounded"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _to_json(value):
+    """Fallback for numpy values inside analysis results"""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot cache value of type {type(value).__name__}")
+
+
+class AnalysisCache:
+    """SQLite store of analysis results (mood, shots, motion, audio, ...)
+
+    Each entry is one kind of result for one video. Lookups and stores are
+    safe to call from several threads.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_CACHE_BYTES, ttl=CACHE_TTL_SECONDS,
+                 version=ANALYZER_VERSION):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.version = version
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT, kind TEXT, value TEXT, size INTEGER,"
+                " created REAL, accessed REAL, PRIMARY KEY (key, kind))"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)"
+            )
+
+    def key(self, video_hash):
+        return f"{video_hash}:{self.version}"
+
+    def _count(self, name, n=1):
+        self._db.execute(
+            "INSERT INTO counters VALUES (?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+            (name, n)
+        )
+
+    def get(self, video_hash, kind):
+        """Cached result or None, counting the hit or miss"""
+        key, now = self.key(video_hash), time.time()
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT value, created FROM entries WHERE key = ? AND kind = ?", (key, kind)
+            ).fetchone()
+
+            if row is not None and now - row[1] > self.ttl:
+                self._db.execute("DELETE FROM entries WHERE key = ? AND kind = ?", (key, kind))
+                row = None
+
+            if row is None:
+                self._count('misses')
+                return None
+
+            self._db.execute(
+                "UPDATE entries SET accessed = ? WHERE key = ? AND kind = ?", (now, key, kind)
+            )
+            self._count('hits')
+        return json.loads(row[0])
+
+    def put(self, video_hash, kind, value):
+        """Store a JSON-serialisable result, evicting old entries past max_bytes"""
+        data = json.dumps(value, default=_to_json)
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (self.key(video_hash), kind, data, len(data), now, now)
+            )
+            self._db.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl,))
+            self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries until the total size fits"""
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = self._db.execute("SELECT rowid, size FROM entries ORDER BY accessed").fetchall()
+        evicted = []
+        for rowid, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((rowid,))
+            total -= size
+        self._db.executemany("DELETE FROM entries WHERE rowid = ?", evicted)
+        self._count('evictions', len(evicted))
+
+    def get_or_compute(self, video_hash, kind, compute):
+        """Cached result, or compute() stored for next time (None is not cached)"""
+        value = self.get(video_hash, kind)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.put(video_hash, kind, value)
+        return value
+
+    def stats(self):
+        """Hit/miss/eviction counters and the current size of the cache"""
+        with self._lock:
+            counters = dict(self._db.execute("SELECT name, value FROM counters"))
+            entries, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        stats = {name: counters.get(name, 0) for name in ('hits', 'misses', 'evictions')}
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        stats.update(entries=entries, bytes=size, max_bytes=self.max_bytes)
+        return stats
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM entries")
+            self._db.execute("DELETE FROM counters")
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,65 @@
+"""Arrays that grow at the end in amortized constant time per value
+
+update_catalog appends a few artists at a time to arrays the size of the
+catalog. An AppendBuffer keeps spare capacity behind the array and doubles
+it when full, so an append copies only the new values. Arrays handed out
+are views of the filled part: later appends write past their end, so
+worker copies holding an earlier view keep the values they saw.
+"""
+import numpy as np
+
+# Capacity of the smallest buffer, in rows
+MIN_CAPACITY = 1024
+
+
+class AppendBuffer:
+    """Growable storage behind an array; view() is the filled part"""
+
+    def __init__(self, array):
+        array = np.asarray(array)
+        self._size = len(array)
+        self._data = self._allocate(array.dtype, array.shape[1:], max(2 * self._size, MIN_CAPACITY),
+                                    'F' if array.ndim > 1 and array.flags.f_contiguous else 'C')
+        self._data[:self._size] = array
+
+    @staticmethod
+    def _allocate(dtype, row_shape, capacity, order):
+        return np.empty((capacity,) + row_shape, dtype=dtype, order=order)
+
+    def holds(self, array):
+        """Whether array is the latest view, which can be extended in place"""
+        return isinstance(array, np.ndarray) and array.base is self._data and len(array) == self._size
+
+    def view(self):
+        return self._data[:self._size]
+
+    def extend(self, values):
+        """Append values and return the view including them
+
+        Strings longer than the buffer holds widen it.
+        """
+        values = np.asarray(values)
+        dtype = self._data.dtype
+        if dtype.kind == 'U':
+            dtype = np.promote_types(dtype, values.dtype)
+        end = self._size + len(values)
+        if end > len(self._data) or dtype != self._data.dtype:
+            order = 'F' if self._data.ndim > 1 and self._data.flags.f_contiguous else 'C'
+            data = self._allocate(dtype, self._data.shape[1:], max(2 * end, MIN_CAPACITY), order)
+            data[:self._size] = self._data[:self._size]
+            self._data = data
+        self._data[self._size:end] = values
+        self._size = end
+        return self.view()
+
+
+def append(buffers, name, array, values):
+    """array followed by values, stored in buffers[name]
+
+    Extends the buffer in place when array is its latest view; any other
+    array (one loaded from disk, or an older view) starts a new buffer.
+    """
+    buffer = buffers.get(name)
+    if buffer is None or not buffer.holds(array):
+        buffer = buffers[name] = AppendBuffer(array)
+    return buffer.extend(values)
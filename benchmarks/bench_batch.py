@@ -0,0 +1,69 @@
+"""Throughput of recommend_batch against one recommend_songs call per query
+
+Every batch is run once to warm up, then timed --repeats times; the
+median throughput is reported.
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from synthetic import TAG_WORDS, make_recommender
+
+
+def make_queries(recommender, size, rng):
+    """Mixed mood/artist/tag queries"""
+    moods = list(recommender.mood_categories)
+    artists = recommender.artists_df['name'].to_numpy()
+    queries = []
+    for query_type in rng.choice(['mood', 'artist', 'tag'], size):
+        if query_type == 'mood':
+            queries.append(('mood', rng.choice(moods)))
+        elif query_type == 'artist':
+            queries.append(('artist', rng.choice(artists)))
+        else:
+            queries.append(('tag', rng.choice(TAG_WORDS)))
+    return queries
+
+
+def throughput(run, size, repeats):
+    """Median queries per second of run() over repeats timed calls, after one untimed call"""
+    run()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return size / np.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--songs', type=int, default=200_000)
+    parser.add_argument('--repeats', type=int, default=5, help="Timed runs per batch size")
+    args = parser.parse_args()
+
+    recommender = make_recommender(n_artists=args.songs // 9)
+    recommender.process_song_features()
+    rng = np.random.default_rng(0)
+
+    for size in (1, 10, 100, 1000):
+        queries = make_queries(recommender, size, rng)
+
+        def one_by_one():
+            for query_type, query_value in queries:
+                recommender.recommend_songs(query_type, query_value)
+
+        single = throughput(one_by_one, size, args.repeats)
+        batch = throughput(lambda: recommender.recommend_batch(queries), size, args.repeats)
+
+        print(f"batch size {size:5d}: one by one {single:8.0f} q/s, "
+              f"recommend_batch {batch:8.0f} q/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Memory of the compact song catalog against the previous wide layout
+
+The wide layout is what the catalog held before: a songs_df of object
+strings for song names, artist fields and search links, a tag list and a
+joined tag text per song, float64 features and mood scores, and a TF-IDF
+row per song. The compact layout is everything process_song_features
+leaves for queries: the artist fields stored once per artist, float32
+features, the query-index arrays (mood scores, the heads of the mood
+orders, tag postings, per-artist tags) and the per-artist TF-IDF matrix.
+
+Each layout is built in its own process and pickled; the resident set
+size is measured in a fresh process that loads it, so neither the other
+layout nor heap left over from the build is counted.
+"""
+import argparse
+import gc
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from synthetic import LASTFM_ARTISTS, make_lastfm_tables
+
+
+def rss_bytes():
+    """Current resident set size (Linux)"""
+    gc.collect()
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def matrix_bytes(matrix):
+    return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+
+
+def build(layout, n_artists, path):
+    """Pickle the catalog of one layout to path; returns (songs, bytes of its structures)"""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from recommender import ARTIST_FIELDS, INDEX_ARRAYS, MusicRecommender, SONG_COLUMNS
+
+    tables = make_lastfm_tables(n_artists=n_artists)
+    recommender = MusicRecommender(seed=0)
+    recommender.artists_df = tables['artists']
+    recommender.tags_df = tables['tags']
+    recommender.artist_tags_df = tables['user_taggedartists']
+    recommender.create_song_dataset()
+    recommender.process_song_features()
+
+    if layout == 'wide':
+        wide = recommender.songs_frame(columns=[c for c in SONG_COLUMNS if c != 'tags'])
+        # Songs of an artist shared one tag list object
+        tag_lists = np.empty(len(recommender.artist_tag_ptr) - 1, dtype=object)
+        tag_lists[:] = recommender._tag_lists(np.arange(len(tag_lists)))
+        wide['tags'] = tag_lists[recommender._song_artists(np.arange(len(wide)))]
+        wide['tag_text'] = [' '.join(tags) for tags in wide['tags']]
+        for column in ['tempo', 'energy', 'danceability', 'valence']:
+            wide[column] = wide[column].to_numpy(dtype=np.float64)
+        for j, mood in enumerate(recommender.mood_categories):
+            wide[f'mood_{mood}'] = recommender.mood_scores[:, j].astype(np.float64)
+        tfidf = TfidfVectorizer(max_features=1000, stop_words='english').fit_transform(wide['tag_text'])
+        catalog = {'songs_df': wide, 'tfidf_matrix': tfidf}
+        catalog_bytes = wide.memory_usage(deep=True).sum() + matrix_bytes(tfidf)
+    else:
+        names = INDEX_ARRAYS + list(ARTIST_FIELDS.values())
+        catalog = {name: getattr(recommender, name) for name in names}
+        catalog['tfidf_matrix'] = recommender.tfidf_matrix
+        catalog_bytes = sum(catalog[name].nbytes for name in names) + matrix_bytes(recommender.tfidf_matrix)
+
+    with open(path, 'wb') as f:
+        pickle.dump(catalog, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return recommender.n_songs, int(catalog_bytes)
+
+
+def load(path):
+    """RSS growth in bytes from loading a pickled catalog"""
+    # The modules the catalog's types come from, imported before the baseline
+    import pandas, scipy.sparse  # noqa: F401
+    before = rss_bytes()
+    with open(path, 'rb') as f:
+        catalog = pickle.load(f)
+    return rss_bytes() - before
+
+
+def run(*args):
+    output = subprocess.run(
+        [sys.executable, __file__, *args], capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--artists', type=int, default=LASTFM_ARTISTS)
+    parser.add_argument('--layout', choices=['wide', 'compact'],
+                        help="Build a single layout into --path and print its numbers as JSON")
+    parser.add_argument('--path', help="Pickled catalog to write, or to load with --load")
+    parser.add_argument('--load', action='store_true',
+                        help="Load the catalog in --path and print the RSS growth as JSON")
+    args = parser.parse_args()
+
+    if args.layout:
+        n_songs, catalog_bytes = build(args.layout, args.artists, args.path)
+        print(json.dumps({'songs': n_songs, 'catalog_bytes': catalog_bytes}))
+        return
+    if args.load:
+        print(json.dumps({'rss_bytes': load(args.path)}))
+        return
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for layout in ('wide', 'compact'):
+            path = os.path.join(tmp_dir, f'{layout}.pkl')
+            results[layout] = run('--layout', layout, '--artists', str(args.artists), '--path', path)
+            results[layout].update(run('--load', '--path', path))
+
+    print(f"Catalog: {results['compact']['songs']} songs")
+    print(f"{'layout':<10}{'catalog MB':>14}{'RSS MB':>10}")
+    for layout, numbers in results.items():
+        print(f"{layout:<10}{numbers['catalog_bytes'] / 1e6:>14.1f}{numbers['rss_bytes'] / 1e6:>10.1f}")
+    print(f"Reduction: {results['wide']['catalog_bytes'] / results['compact']['catalog_bytes']:.1f}x catalog, "
+          f"{results['wide']['rss_bytes'] / max(results['compact']['rss_bytes'], 1):.1f}x RSS")
+
+
+if __name__ == '__main__':
+    main()
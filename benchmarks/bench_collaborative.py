@@ -0,0 +1,55 @@
+"""Training time, precision@k and query latency of the collaborative model"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from synthetic import make_user_artists
+from collaborative import (CollaborativeModel, popularity_precision_at_k,
+                           precision_at_k, train_test_split)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--data', help="A user_artists.dat file (default: synthetic clustered plays)")
+    parser.add_argument('--users', type=int, default=1892)
+    parser.add_argument('--artists', type=int, default=17632)
+    parser.add_argument('--factors', type=int, default=64)
+    parser.add_argument('--iterations', type=int, default=15)
+    parser.add_argument('-k', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.data:
+        plays = pd.read_csv(args.data, sep='\t', encoding='latin-1')
+    else:
+        plays = make_user_artists(n_users=args.users, n_artists=args.artists)
+    train, test = train_test_split(plays)
+    print(f"{len(plays)} plays: {len(train)} train, {len(test)} held out "
+          f"from {test['userID'].nunique()} users")
+
+    baseline = popularity_precision_at_k(train, test, args.k)
+    print(f"popularity:  precision@{args.k} {baseline:.4f}")
+
+    for method in ('svd', 'als'):
+        model = CollaborativeModel(factors=args.factors, iterations=args.iterations, method=method)
+        model.fit(train)
+        precision, latencies = precision_at_k(model, test, args.k)
+
+        artist_timings = []
+        for artist_id in model.artist_ids[:1000]:
+            start = time.perf_counter()
+            model.similar_artists(artist_id, args.k)
+            artist_timings.append(time.perf_counter() - start)
+
+        print(f"{method:<11}  precision@{args.k} {precision:.4f}, train {model.train_seconds:.1f} s, "
+              f"user query p50 {np.percentile(latencies, 50) * 1e3:.3f} ms, "
+              f"artist query p50 {np.percentile(artist_timings, 50) * 1e3:.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
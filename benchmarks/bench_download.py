@@ -0,0 +1,133 @@
+"""Download, resume and zip parsing of the LastFM archive against a local HTTP server
+
+The server stands in for files.grouplens.org: it serves a synthetic
+archive, honours Range requests and can drop the connection part way
+through a response, or ignore Range like a server without resume support.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import lastfm_dataset
+from lastfm_dataset import download, fetch_dataset, read_table
+from synthetic import LASTFM_ARTISTS, make_lastfm_tables, write_lastfm_archive
+
+
+class RangeHandler(SimpleHTTPRequestHandler):
+    """Static files with single-range support and optional faults
+
+    The server's drop_after cuts the first response after that many bytes;
+    with ignore_range set, Range headers are ignored.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        start = 0
+        header = self.headers.get('Range')
+        if header and not self.server.ignore_range:
+            start = int(header.split('=')[1].split('-')[0])
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{size - 1}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(size - start))
+        self.end_headers()
+
+        limit = size - start
+        if self.server.drop_after is not None:
+            limit, self.server.drop_after = min(limit, self.server.drop_after), None
+        with open(path, 'rb') as f:
+            f.seek(start)
+            self.wfile.write(f.read(limit))
+        self.server.bytes_served += limit
+
+
+def serve(directory, drop_after=None, ignore_range=False):
+    """Start a RangeHandler server on a free local port, returning it"""
+    handler = lambda *args: RangeHandler(*args, directory=directory)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.drop_after = drop_after
+    server.ignore_range = ignore_range
+    server.bytes_served = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--artists', type=int, default=LASTFM_ARTISTS)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        served = os.path.join(work_dir, 'served')
+        archive = write_lastfm_archive(
+            make_lastfm_tables(n_artists=args.artists),
+            os.path.join(served, os.path.basename(lastfm_dataset.ARCHIVE_PATH))
+        )
+        size = os.path.getsize(archive)
+        print(f"Archive: {size / 1e6:.1f} MB")
+
+        scenarios = [
+            ('clean download', {}),
+            ('dropped at 40%, resumed', {'drop_after': int(size * 0.4)}),
+            ('dropped, no Range support', {'drop_after': int(size * 0.4), 'ignore_range': True}),
+        ]
+        for name, faults in scenarios:
+            server = serve(served, **faults)
+            target = os.path.join(work_dir, name.replace(' ', '_'), 'lastfm.zip')
+            url = f'http://127.0.0.1:{server.server_port}/{os.path.basename(archive)}'
+            start = time.perf_counter()
+            download(url, target)
+            seconds = time.perf_counter() - start
+            server.shutdown()
+            print(f"{name:28s} {seconds:6.2f} s  {size / seconds / 1e6:7.1f} MB/s  "
+                  f"{server.bytes_served / size:.2f}x archive size served")
+
+        # Parsing straight from the zip members against extracting first
+        start = time.perf_counter()
+        tables = {name: read_table(name, data_dir=work_dir, archive=archive)
+                  for name in ('artists.dat', 'tags.dat', 'user_taggedartists.dat', 'user_artists.dat')}
+        from_zip = time.perf_counter() - start
+
+        extracted = os.path.join(work_dir, 'extracted')
+        start = time.perf_counter()
+        with zipfile.ZipFile(archive) as zip_file:
+            zip_file.extractall(extracted)
+        extracted_tables = {name: read_table(name, data_dir=extracted) for name in tables}
+        from_files = time.perf_counter() - start
+        assert all(tables[name].equals(extracted_tables[name]) for name in tables)
+        print(f"Read from zip members: {from_zip:.2f} s, extract then read: {from_files:.2f} s")
+
+        # Offline mode with a mirror directory: used in place, nothing downloaded
+        os.environ[lastfm_dataset.MIRROR_ENV] = served
+        os.environ[lastfm_dataset.OFFLINE_ENV] = '1'
+        path = fetch_dataset(path=os.path.join(work_dir, 'missing', 'lastfm.zip'))
+        print(f"Offline mirror resolves to {os.path.relpath(path, work_dir)}")
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Latency of fused recommend_hybrid queries against the single-signal queries
+
+A fused query is also reported relative to the slowest single-signal
+query among those it combines.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from synthetic import TAG_WORDS, make_recommender, make_user_artists
+from bench_queries import latency_percentiles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--songs', type=int, default=200_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    n_artists = args.songs // 9
+    recommender = make_recommender(n_artists=n_artists)
+    recommender.user_artists_df = make_user_artists(n_artists=n_artists)
+    recommender.process_song_features()
+    with tempfile.TemporaryDirectory() as model_dir:
+        recommender.load_collaborative(model_dir)
+    print(f"Catalog: {recommender.n_songs} songs")
+
+    moods = list(recommender.mood_categories)
+    artists = [f'Artist {i}' for i in range(0, n_artists, n_artists // 10)]
+    users = list(range(1, 200, 20))
+
+    # (name, query, values, single-signal cases it combines)
+    cases = [
+        ("recommend_by_mood", recommender.recommend_by_mood, moods, []),
+        ("hybrid mood", lambda m: recommender.recommend_hybrid(mood=m), moods, ["recommend_by_mood"]),
+        ("recommend_similar_songs", recommender.recommend_similar_songs, artists, []),
+        ("hybrid artist", lambda a: recommender.recommend_hybrid(artist=a), artists, ["recommend_similar_songs"]),
+        ("hybrid mood + artist", lambda a: recommender.recommend_hybrid(mood='happy', artist=a), artists,
+         ["recommend_by_mood", "recommend_similar_songs"]),
+        ("recommend_for_user", recommender.recommend_for_user, users, []),
+        ("hybrid mood + user", lambda u: recommender.recommend_hybrid(mood='sad', user=u), users,
+         ["recommend_by_mood", "recommend_for_user"]),
+        ("recommend_by_tag", recommender.recommend_by_tag, TAG_WORDS, []),
+        ("hybrid mood + tag", lambda t: recommender.recommend_hybrid(mood='happy', tag=t), TAG_WORDS,
+         ["recommend_by_mood", "recommend_by_tag"]),
+        ("hybrid all, mmr", lambda a: recommender.recommend_hybrid(
+            mood='happy', artist=a, tag='rock', user=1, diversity='mmr'), artists,
+         ["recommend_by_mood", "recommend_similar_songs", "recommend_by_tag", "recommend_for_user"]),
+    ]
+    medians = {}
+    for name, fn, queries, singles in cases:
+        # One untimed pass, as a serving process has answered queries before
+        for query in queries:
+            fn(query)
+        p50, p99 = latency_percentiles(fn, queries, args.repeat)
+        medians[name] = p50
+        line = f"{name:<24} p50 {p50:7.3f} ms, p99 {p99:7.3f} ms"
+        if singles:
+            line += f", {p50 / max(medians[single] for single in singles):4.2f}x single-signal"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Time update_catalog for a small delta against a full catalog rebuild, as the catalog grows
+
+An update should cost its own artists and tags: the median update time
+stays flat across catalog sizes while the full build grows with them. The
+first update of a catalog also allocates the append buffers its arrays
+grow in, a one-off copy reported separately.
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import recommender as recommender_module
+from recommender import MusicRecommender
+from synthetic import LASTFM_ARTISTS, make_lastfm_tables
+
+
+def run(n_artists, args):
+    """(songs, full build seconds, first update seconds, later update seconds) for one catalog size"""
+    tables = make_lastfm_tables(n_artists=n_artists)
+    n_base = n_artists - args.updates * args.new_artists
+    recommender = MusicRecommender(seed=0, similarity=args.similarity)
+    recommender.artists_df = tables['artists'][:n_base]
+    recommender.tags_df = tables['tags']
+    recommender.artist_tags_df = tables['user_taggedartists']
+    recommender.create_song_dataset()
+
+    start = time.perf_counter()
+    recommender.process_song_features()
+    full_time = time.perf_counter() - start
+    n_songs = recommender.n_songs
+
+    new_tags = tables['user_taggedartists'].sample(args.updates * args.new_tags, random_state=0)
+    update_times = []
+    for i in range(args.updates):
+        artists = tables['artists'][n_base + i * args.new_artists:n_base + (i + 1) * args.new_artists]
+        start = time.perf_counter()
+        recommender.update_catalog(artists, new_tags[i * args.new_tags:(i + 1) * args.new_tags])
+        update_times.append(time.perf_counter() - start)
+    return n_songs, full_time, update_times[0], update_times[1:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default=f'{LASTFM_ARTISTS},{LASTFM_ARTISTS * 6},{LASTFM_ARTISTS * 18}',
+                        help="Comma-separated catalog sizes, in artists")
+    parser.add_argument('--updates', type=int, default=10, help="Updates timed per catalog size")
+    parser.add_argument('--new-artists', type=int, default=10, help="Artists added by every update")
+    parser.add_argument('--new-tags', type=int, default=100,
+                        help="Tag assignments, mostly to existing artists, added by every update")
+    parser.add_argument('--similarity', default='exact')
+    args = parser.parse_args()
+
+    # Measure the incremental path only, without the drift-triggered refit
+    recommender_module.REBUILD_DRIFT = float('inf')
+
+    print(f"{'songs':>10}{'full build s':>14}{'first update ms':>17}"
+          f"{'update ms p50':>15}{'update ms max':>15}{'speedup':>9}")
+    for n_artists in [int(size) for size in args.sizes.split(',')]:
+        n_songs, full_time, first_time, update_times = run(n_artists, args)
+        median = np.median(update_times)
+        print(f"{n_songs:>10}{full_time:>14.2f}{first_time * 1e3:>17.1f}"
+              f"{median * 1e3:>15.1f}{max(update_times) * 1e3:>15.1f}{full_time / median:>8.0f}x", flush=True)
+
+
+if __name__ == '__main__':
+    main()
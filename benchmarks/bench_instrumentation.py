@@ -0,0 +1,85 @@
+"""Overhead of the stage spans on the recommend_* hot paths
+
+Each query runs undecorated (the function under the span), with spans
+off and with spans on. Rounds alternate between the three so drift in
+machine load hits them alike; the best round of each is reported. The
+fixed cost of a span is measured on a function that does nothing.
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import numpy as np
+
+import instrumentation
+from recommender import MusicRecommender
+from synthetic import LASTFM_ARTISTS, TAG_WORDS, make_lastfm_tables
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--artists', type=int, default=LASTFM_ARTISTS)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=7)
+    args = parser.parse_args()
+
+    tables = make_lastfm_tables(n_artists=args.artists)
+    recommender = MusicRecommender(seed=0)
+    recommender.artists_df = tables['artists']
+    recommender.tags_df = tables['tags']
+    recommender.artist_tags_df = tables['user_taggedartists']
+    with contextlib.redirect_stdout(io.StringIO()):
+        recommender.create_song_dataset()
+        recommender.process_song_features()
+    print(f"Catalog: {recommender.n_songs} songs")
+
+    rng = np.random.default_rng(0)
+    workloads = {
+        'recommend_by_mood': rng.choice(list(recommender.mood_categories), args.queries),
+        'recommend_by_tag': rng.choice(TAG_WORDS, args.queries),
+    }
+    for method, values in workloads.items():
+        decorated = getattr(recommender, method)
+        variants = {
+            'undecorated': (decorated.__wrapped__.__get__(recommender), False),
+            'spans off': (decorated, False),
+            'spans on': (decorated, True),
+        }
+        best = dict.fromkeys(variants, float('inf'))
+        for _ in range(args.rounds):
+            for name, (func, on) in variants.items():
+                instrumentation.enable(on)
+                start = time.perf_counter()
+                for value in values:
+                    func(value)
+                best[name] = min(best[name], time.perf_counter() - start)
+        instrumentation.enable(False)
+
+        base = best['undecorated']
+        print(f"{method}:")
+        for name, seconds in best.items():
+            print(f"  {name:<12} {seconds / args.queries * 1e6:8.1f} us/query  {seconds / base - 1:+7.2%}")
+
+    # Fixed cost per call, measured on a function that does nothing
+    noop = instrumentation.span('noop')(lambda: None)
+    calls = 200_000
+    for on in (False, True):
+        instrumentation.enable(on)
+        start = time.perf_counter()
+        for _ in range(calls):
+            noop()
+        print(f"Span cost with spans {'on' if on else 'off'}: {(time.perf_counter() - start) / calls * 1e9:.0f} ns/call")
+    instrumentation.enable(False)
+
+    latency = instrumentation.REGISTRY.to_dict()['latency']
+    print(f"Recorded spans: { {name: hist['count'] for name, hist in latency.items()} }")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Import time, build time and query latency of the MusicCaps index at growing sizes"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(__file__))
+
+from synthetic import make_musiccaps_table
+from music_caps import MusicCapsIndex
+
+QUERIES = ['happy', 'sad', 'calm', 'energetic', 'happy, energetic', 'romantic and mellow']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='5521,55210,552100')
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'import music_caps'], cwd=ROOT, check=True)
+    print(f"python -c 'import music_caps': {time.perf_counter() - start:.3f} s (interpreter included)")
+
+    for size in map(int, args.sizes.split(',')):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_path = os.path.join(tmp_dir, 'musiccaps-public.csv')
+            make_musiccaps_table(size).to_csv(csv_path, index=False)
+
+            start = time.perf_counter()
+            MusicCapsIndex(csv_path, os.path.join(tmp_dir, 'index')).ensure_loaded()
+            build = time.perf_counter() - start
+
+            index = MusicCapsIndex(csv_path, os.path.join(tmp_dir, 'index'))
+            start = time.perf_counter()
+            index.ensure_loaded()
+            load = time.perf_counter() - start
+
+            timings = []
+            for _ in range(args.repeat):
+                for query in QUERIES:
+                    start = time.perf_counter()
+                    index.find(query)
+                    timings.append(time.perf_counter() - start)
+            p50, p99 = np.percentile(timings, [50, 99]) * 1e3
+            print(f"{size:>8} clips: build {build:.2f} s, load {load * 1e3:.1f} ms, "
+                  f"query p50 {p50:.3f} ms, p99 {p99:.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
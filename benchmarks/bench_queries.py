@@ -0,0 +1,44 @@
+"""Per-query latency of recommend_by_mood and recommend_by_tag"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from synthetic import TAG_WORDS, make_recommender
+
+
+def latency_percentiles(fn, queries, repeat):
+    """Call fn on every query `repeat` times and return (p50, p99) in ms"""
+    timings = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            fn(query)
+            timings.append(time.perf_counter() - start)
+    return np.percentile(timings, 50) * 1e3, np.percentile(timings, 99) * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--songs', type=int, default=200_000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    recommender = make_recommender(n_artists=args.songs // 9)
+    recommender.process_song_features()
+    print(f"Catalog: {recommender.n_songs} songs")
+
+    moods = list(recommender.mood_categories)
+    p50, p99 = latency_percentiles(recommender.recommend_by_mood, moods, args.repeat)
+    print(f"recommend_by_mood: p50 {p50:.3f} ms, p99 {p99:.3f} ms")
+
+    p50, p99 = latency_percentiles(recommender.recommend_by_tag, TAG_WORDS, args.repeat)
+    print(f"recommend_by_tag:  p50 {p50:.3f} ms, p99 {p99:.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Recall@k and latency of the LSH similarity backend against the exact one
+
+Sweeps the LSH tables, bits and probes and reports the fastest setting
+that reaches --min-recall next to the exact latency. Every index answers
+a few queries untimed before it is measured.
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from similarity import ExactSimilarity, LSHSimilarity
+from synthetic import make_recommender
+
+
+def run_queries(index, recommender, queries, k):
+    """Return (results, mean latency in ms) for the given reference artists, after a warm-up"""
+    for artist in queries[:10]:
+        index.search(recommender.tfidf_matrix[artist], k, exclude=artist)
+    results = []
+    start = time.perf_counter()
+    for artist in queries:
+        results.append(index.search(recommender.tfidf_matrix[artist], k, exclude=artist))
+    return results, (time.perf_counter() - start) / len(queries) * 1e3
+
+
+def recall(approximate, exact):
+    """Share of results at least as similar as the exact k-th result (tie aware)"""
+    hits, total = 0, 0
+    for (_, approx_sims), (_, exact_sims) in zip(approximate, exact):
+        if len(exact_sims) == 0:
+            continue
+        hits += min(np.sum(approx_sims >= exact_sims[-1] - 1e-9), len(exact_sims))
+        total += len(exact_sims)
+    return hits / max(total, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--songs', type=int, default=200_000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--tables', default='8,16,32', help="Comma-separated table counts")
+    parser.add_argument('--bits', default='8,10,12', help="Comma-separated bits per table")
+    parser.add_argument('--probes', default='1,2,4,8', help="Comma-separated probe counts")
+    parser.add_argument('--min-recall', type=float, default=0.9)
+    args = parser.parse_args()
+
+    recommender = make_recommender(n_artists=args.songs // 9)
+    recommender.process_song_features()
+    # The TF-IDF matrix holds one row per artist, which is what the backends search
+    tfidf = recommender.tfidf_matrix
+    queries = np.random.default_rng(0).choice(tfidf.shape[0], args.queries, replace=False)
+
+    exact = ExactSimilarity(tfidf).build()
+    exact_results, exact_ms = run_queries(exact, recommender, queries, args.k)
+    print(f"exact: {exact_ms:.2f} ms/query")
+
+    best = None
+    print(f"{'tables':>6}{'bits':>6}{'probes':>8}{'ms/query':>10}{f'recall@{args.k}':>11}")
+    for n_tables in [int(value) for value in args.tables.split(',')]:
+        for n_bits in [int(value) for value in args.bits.split(',')]:
+            lsh = LSHSimilarity(tfidf, n_tables=n_tables, n_bits=n_bits).build()
+            for n_probes in [int(value) for value in args.probes.split(',')]:
+                lsh.n_probes = n_probes
+                lsh_results, lsh_ms = run_queries(lsh, recommender, queries, args.k)
+                lsh_recall = recall(lsh_results, exact_results)
+                print(f"{n_tables:>6}{n_bits:>6}{n_probes:>8}{lsh_ms:>10.2f}{lsh_recall:>11.3f}", flush=True)
+                if lsh_recall >= args.min_recall and (best is None or lsh_ms < best[0]):
+                    best = (lsh_ms, n_tables, n_bits, n_probes)
+
+    if best is None:
+        print(f"No setting reaches recall@{args.k} {args.min_recall}")
+    else:
+        lsh_ms, n_tables, n_bits, n_probes = best
+        print(f"Fastest at recall@{args.k} >= {args.min_recall}: n_tables={n_tables} n_bits={n_bits} "
+              f"n_probes={n_probes}, {lsh_ms:.2f} ms/query, {exact_ms / lsh_ms:.2f}x exact")
+
+
+if __name__ == '__main__':
+    main()
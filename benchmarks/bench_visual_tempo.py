@@ -0,0 +1,64 @@
+"""Frames per second of analyze_visual_tempo against the original frame-by-frame loop"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from synthetic import make_video
+from visual_feature import analyze_visual_tempo
+
+
+def legacy_visual_tempo(video_path):
+    """The original loop: decode, convert, blur and threshold one frame at a time"""
+    cap = cv2.VideoCapture(video_path)
+    prev_frame = None
+    motion_frames = 0
+    while cap.isOpened():
+        ret, frame = cap.read()
+        if not ret:
+            break
+        gray = cv2.GaussianBlur(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        if prev_frame is None:
+            prev_frame = gray
+            continue
+        _, thresh = cv2.threshold(cv2.absdiff(prev_frame, gray), 30, 255, cv2.THRESH_BINARY)
+        if cv2.countNonZero(thresh) > 1000:
+            motion_frames += 1
+        prev_frame = gray
+    cap.release()
+    return motion_frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seconds', type=int, default=20)
+    parser.add_argument('--fps', type=int, default=30)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_path = make_video(os.path.join(tmp_dir, 'clip.mp4'), args.seconds, args.fps)
+        n_frames = args.seconds * args.fps
+
+        start = time.perf_counter()
+        legacy = legacy_visual_tempo(video_path)
+        elapsed = time.perf_counter() - start
+        print(f"legacy loop:                           {n_frames / elapsed:7.1f} fps, {legacy} motion frames")
+
+        for overlap in (False, True):
+            for stride, scale in ((1, 1.0), (1, 0.5), (2, 0.5), (3, 0.25)):
+                start = time.perf_counter()
+                result = analyze_visual_tempo(
+                    video_path, frame_stride=stride, scale=scale, overlap=overlap
+                )
+                elapsed = time.perf_counter() - start
+                print(f"stride {stride}, scale {scale:<4}, overlap {overlap!s:<5}: "
+                      f"{n_frames / elapsed:7.1f} fps, {result['motion_frames']} motion frames")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,287 @@
+"""Benchmark suite covering every stage of the recommender and the video pipeline
+
+Generates synthetic LastFM-shaped catalogs (10k, 100k and 1M songs by
+default), a synthetic video and a synthetic audio track, then times
+load_data, create_song_dataset, process_song_features, every recommend_*
+path, analyze_visual_tempo, detect_shots and audio feature extraction.
+Wall time, peak RSS and throughput of every stage are written as JSON.
+
+Each catalog size and the media stages run in their own process, so peak
+RSS does not carry over between them. Against a baseline file, stages
+slower or larger than the baseline by more than --tolerance are flagged
+and the exit status is 1. Everything runs offline.
+
+    python benchmarks/suite.py --output results.json --baseline baseline.json
+    python benchmarks/suite.py --sizes 10k,100k --save-baseline baseline.json
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import numpy as np
+
+from synthetic import TAG_WORDS, make_audio, make_lastfm_tables, make_video, write_lastfm_tables
+
+DEFAULT_SIZES = '10k,100k,1M'
+
+# Relative growth of wall time or peak RSS over the baseline flagged as a regression
+DEFAULT_TOLERANCE = 0.25
+
+# Wall time differences below this are timer noise, never regressions
+MIN_WALL_DIFFERENCE = 0.005
+
+
+def parse_size(size):
+    """'10k' -> 10_000, '1M' -> 1_000_000"""
+    multipliers = {'k': 1_000, 'm': 1_000_000}
+    size = size.strip().lower()
+    if size[-1] in multipliers:
+        return int(float(size[:-1]) * multipliers[size[-1]])
+    return int(size)
+
+
+def reset_peak_rss():
+    """Restart peak RSS tracking from the current RSS, where the OS allows it (Linux)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_bytes():
+    """Peak RSS since the last reset_peak_rss, or since process start"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class StageRecorder:
+    """Runs stages and records their wall time, peak RSS and throughput"""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.results = []
+
+    def measure(self, stage, fn, items=1, unit='calls'):
+        """Run fn once, its output silenced, and record it as one stage; returns its result"""
+        gc.collect()
+        reset_peak_rss()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            value = fn()
+        wall = time.perf_counter() - start
+        self.results.append({
+            'stage': f'{self.prefix}/{stage}',
+            'wall_seconds': wall,
+            'peak_rss_mb': peak_rss_bytes() / 1e6,
+            'throughput': items / wall if wall > 0 else None,
+            'unit': f'{unit}/s'
+        })
+        return value
+
+    def skip(self, stage, reason):
+        self.results.append({'stage': f'{self.prefix}/{stage}', 'skipped': reason})
+
+
+def run_catalog(n_songs, n_queries, recorder):
+    """Build a synthetic catalog of about n_songs songs and time every stage on it"""
+    from recommender import MusicRecommender, SONG_TYPES
+
+    n_artists = max(n_songs // len(SONG_TYPES), 10)
+    n_songs = n_artists * len(SONG_TYPES)
+    tables = make_lastfm_tables(n_artists=n_artists)
+    work_dir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        # load_data reads data/*.dat and writes data/index relative to the working directory
+        write_lastfm_tables(tables, os.path.join(work_dir, 'data'))
+        os.chdir(work_dir)
+
+        recorder.measure('load_data', MusicRecommender(seed=0).load_data, n_songs, 'songs')
+        recommender = MusicRecommender(seed=0)
+        recorder.measure('load_data_from_index', recommender.load_data, n_songs, 'songs')
+
+        built = MusicRecommender(seed=0)
+        built.artists_df = tables['artists']
+        built.tags_df = tables['tags']
+        built.artist_tags_df = tables['user_taggedartists']
+        built.user_artists_df = tables['user_artists']
+        recorder.measure('create_song_dataset', built.create_song_dataset, n_songs, 'songs')
+        recorder.measure('process_song_features', built.process_song_features, n_songs, 'songs')
+        del built
+
+        rng = np.random.default_rng(0)
+        moods = rng.choice(list(recommender.mood_categories), n_queries)
+        tags = rng.choice(TAG_WORDS, n_queries)
+        artists = rng.choice(tables['artists']['name'].to_numpy(), n_queries)
+        users = rng.choice(tables['user_artists']['userID'].unique(), n_queries)
+
+        def each(method, values):
+            return lambda: [method(value) for value in values]
+
+        recorder.measure('recommend_by_mood', each(recommender.recommend_by_mood, moods), n_queries, 'queries')
+        recorder.measure('recommend_by_tag', each(recommender.recommend_by_tag, tags), n_queries, 'queries')
+        recorder.measure('recommend_similar_songs', each(recommender.recommend_similar_songs, artists),
+                         n_queries, 'queries')
+        queries = [('mood', m) for m in moods] + [('tag', t) for t in tags] + [('artist', a) for a in artists]
+        recorder.measure('recommend_batch', lambda: recommender.recommend_batch(queries), len(queries), 'queries')
+
+        recorder.measure('load_collaborative', recommender.load_collaborative, n_artists, 'artists')
+        recorder.measure('recommend_for_user', each(recommender.recommend_for_user, users), n_queries, 'queries')
+        recorder.measure('recommend_similar_artists', each(recommender.recommend_similar_artists, artists),
+                         n_queries, 'queries')
+        recorder.measure(
+            'recommend_hybrid',
+            lambda: [recommender.recommend_hybrid(mood=m, tag=t, user=u) for m, t, u in zip(moods, tags, users)],
+            n_queries, 'queries'
+        )
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir)
+
+
+def run_media(video_seconds, audio_seconds, recorder):
+    """Time the visual and audio analysis stages on synthetic media"""
+    from visual_feature import analyze_visual_tempo, detect_shots
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        fps = 30
+        video_path = make_video(os.path.join(work_dir, 'clip.mp4'), video_seconds, fps)
+        n_frames = video_seconds * fps
+        recorder.measure('analyze_visual_tempo', lambda: analyze_visual_tempo(video_path), n_frames, 'frames')
+        recorder.measure('detect_shots', lambda: detect_shots(video_path), n_frames, 'frames')
+
+        audio_path = make_audio(os.path.join(work_dir, 'track.wav'), audio_seconds)
+        try:
+            from audio_feature import extract_audio_features
+        except ImportError as e:
+            recorder.skip('extract_audio_features', f"{type(e).__name__}: {e}")
+        else:
+            recorder.measure('extract_audio_features', lambda: extract_audio_features(audio_path),
+                             audio_seconds, 'audio seconds')
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def run_worker(args):
+    """Run one group of stages in this process and write its results to --worker-output"""
+    if args.worker == 'media':
+        recorder = StageRecorder('media')
+        run_media(args.video_seconds, args.audio_seconds, recorder)
+    else:
+        recorder = StageRecorder(f'catalog_{args.worker}')
+        run_catalog(parse_size(args.worker), args.queries, recorder)
+    with open(args.worker_output, 'w') as f:
+        json.dump(recorder.results, f)
+
+
+def find_regressions(results, baseline, tolerance):
+    """(stage, metric, baseline, current) for every metric beyond tolerance of the baseline"""
+    previous = {result['stage']: result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get(result['stage'])
+        if before is None or 'skipped' in result or 'skipped' in before:
+            continue
+        for metric in ('wall_seconds', 'peak_rss_mb'):
+            grown = result[metric] > before[metric] * (1 + tolerance)
+            if metric == 'wall_seconds':
+                grown = grown and result[metric] - before[metric] > MIN_WALL_DIFFERENCE
+            if grown:
+                regressions.append((result['stage'], metric, before[metric], result[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help="Catalog sizes in songs, comma separated")
+    parser.add_argument('--queries', type=int, default=100, help="Queries per recommend_* stage")
+    parser.add_argument('--video-seconds', type=int, default=10)
+    parser.add_argument('--audio-seconds', type=int, default=30)
+    parser.add_argument('--no-media', action='store_true', help="Skip the video and audio stages")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help="Results JSON to compare against")
+    parser.add_argument('--save-baseline', help="Also write the results to this baseline file")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--worker-output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    groups = [size.strip() for size in args.sizes.split(',') if size.strip()]
+    if not args.no_media:
+        groups.append('media')
+
+    results = []
+    for group in groups:
+        print(f"Running {group}...", flush=True)
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            worker_output = f.name
+        try:
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--worker', group, '--worker-output', worker_output,
+                 '--queries', str(args.queries), '--video-seconds', str(args.video_seconds),
+                 '--audio-seconds', str(args.audio_seconds)],
+                check=True, stdout=subprocess.DEVNULL
+            )
+            with open(worker_output) as f:
+                results.extend(json.load(f))
+        finally:
+            os.remove(worker_output)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results
+    }
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    print(f"\n{'stage':48s}{'wall s':>10}{'peak RSS MB':>13}{'throughput':>24}")
+    for result in results:
+        if 'skipped' in result:
+            print(f"{result['stage']:48s}  skipped: {result['skipped']}")
+            continue
+        throughput = f"{result['throughput']:,.1f} {result['unit']}"
+        print(f"{result['stage']:48s}{result['wall_seconds']:>10.3f}{result['peak_rss_mb']:>13.1f}{throughput:>24}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        for stage, metric, before, after in regressions:
+            print(f"REGRESSION {stage} {metric}: {before:.3f} -> {after:.3f} ({after / before - 1:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} of {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
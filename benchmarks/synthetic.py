@@ -0,0 +1,203 @@
+"""Synthetic LastFM- and MusicCaps-shaped data for offline benchmarks"""
+import os
+import numpy as np
+import pandas as pd
+
+# Tag words mixing mood keywords with genres, so mood scores see real matches
+TAG_WORDS = [
+    'happy', 'sad', 'chill', 'rock', 'love', 'dark', 'party', 'metal',
+    'ambient', 'pop', 'indie', 'heavy', 'sweet', 'mellow', 'energetic',
+    'jazz', 'electronic', 'hip-hop', 'folk', 'calm', 'aggressive', 'romantic'
+]
+
+# Sizes of the real hetrec2011-lastfm-2k dump
+LASTFM_ARTISTS = 17632
+LASTFM_TAGS = 11946
+
+
+def make_lastfm_tables(n_artists=LASTFM_ARTISTS, n_tags=LASTFM_TAGS, n_users=1892,
+                       tags_per_artist=10, artists_per_user=50, seed=0):
+    """Generate artists, tags, user_taggedartists and user_artists tables"""
+    rng = np.random.default_rng(seed)
+
+    artists_df = pd.DataFrame({
+        'id': np.arange(1, n_artists + 1),
+        'name': [f'Artist {i}' for i in range(n_artists)],
+        'url': [f'http://www.last.fm/music/Artist+{i}' for i in range(n_artists)],
+        'pictureURL': ''
+    })
+
+    tags_df = pd.DataFrame({
+        'tagID': np.arange(1, n_tags + 1),
+        'tagValue': [
+            TAG_WORDS[i % len(TAG_WORDS)] + ('' if i < len(TAG_WORDS) else f' {i}')
+            for i in range(n_tags)
+        ]
+    })
+
+    # Popular tags and artists get most of the tagging activity
+    n_assignments = n_artists * tags_per_artist
+    artist_tags_df = pd.DataFrame({
+        'userID': rng.integers(1, n_users + 1, n_assignments),
+        'artistID': rng.integers(1, n_artists + 1, n_assignments),
+        'tagID': np.minimum(rng.zipf(1.3, n_assignments), n_tags),
+        'day': 1, 'month': 1, 'year': 2010
+    })
+
+    n_plays = n_users * artists_per_user
+    user_artists_df = pd.DataFrame({
+        'userID': rng.integers(1, n_users + 1, n_plays),
+        'artistID': np.minimum(rng.zipf(1.2, n_plays), n_artists),
+        'weight': rng.integers(1, 5000, n_plays)
+    }).drop_duplicates(['userID', 'artistID']).reset_index(drop=True)
+
+    return {
+        'artists': artists_df,
+        'tags': tags_df,
+        'user_taggedartists': artist_tags_df,
+        'user_artists': user_artists_df
+    }
+
+
+def write_lastfm_tables(tables, data_dir):
+    """Write tables as tab-separated .dat files in the LastFM layout"""
+    os.makedirs(data_dir, exist_ok=True)
+    for name, df in tables.items():
+        df.to_csv(os.path.join(data_dir, f'{name}.dat'), sep='\t', index=False, encoding='latin-1')
+
+
+def write_lastfm_archive(tables, path):
+    """Write tables as .dat members of a zip laid out like the hetrec2011 download"""
+    import zipfile
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, df in tables.items():
+            archive.writestr(f'{name}.dat', df.to_csv(sep='\t', index=False).encode('latin-1'))
+    return path
+
+
+def make_recommender(n_artists=LASTFM_ARTISTS, seed=0, **kwargs):
+    """MusicRecommender with synthetic tables loaded and the song catalog built"""
+    from recommender import MusicRecommender
+
+    tables = make_lastfm_tables(n_artists=n_artists, seed=seed, **kwargs)
+    recommender = MusicRecommender(seed=seed)
+    recommender.artists_df = tables['artists']
+    recommender.tags_df = tables['tags']
+    recommender.artist_tags_df = tables['user_taggedartists']
+    recommender.user_artists_df = tables['user_artists']
+    recommender.create_song_dataset()
+    return recommender
+
+
+def make_video(path, seconds=10, fps=30, size=(1280, 720), seed=0):
+    """Write a synthetic clip of moving shapes with cuts every few seconds"""
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    width, height = size
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+
+    background = rng.integers(0, 255, 3).tolist()
+    for i in range(int(seconds * fps)):
+        # A hard cut to a new background every 3 seconds
+        if i and i % (3 * fps) == 0:
+            background = rng.integers(0, 255, 3).tolist()
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+        frame[:] = background
+
+        # Moving shapes, with a quiet spell in the second half of every cut
+        speed = 0 if (i // fps) % 3 == 2 else 12
+        x = (i * speed) % width
+        cv2.rectangle(frame, (x, height // 4), (x + width // 8, height // 2), (255, 255, 255), -1)
+        cv2.circle(frame, (width - x, 3 * height // 4), height // 10, (0, 0, 255), -1)
+        writer.write(frame)
+
+    writer.release()
+    return path
+
+
+def make_audio(path, seconds=30, sr=22050, bpm=120, seed=0):
+    """Write a 16-bit mono WAV of a click track at bpm over a soft major chord"""
+    import wave
+
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sr)) / sr
+    chord = sum(np.sin(2 * np.pi * f * t) for f in (261.63, 329.63, 392.0)) / 3
+    signal = 0.2 * chord + 0.01 * rng.standard_normal(len(t))
+
+    # A short decaying noise burst on every beat
+    click = rng.standard_normal(int(0.02 * sr)) * np.exp(-np.linspace(0, 8, int(0.02 * sr)))
+    for start in (np.arange(0, seconds, 60 / bpm) * sr).astype(int):
+        end = min(start + len(click), len(signal))
+        signal[start:end] += 0.6 * click[:end - start]
+
+    samples = (np.clip(signal, -1, 1) * 32767).astype('<i2')
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sr)
+        f.writeframes(samples.tobytes())
+    return path
+
+
+# Words for synthetic MusicCaps aspect lists and captions
+ASPECT_WORDS = [
+    'happy', 'sad', 'calm', 'energetic', 'romantic', 'aggressive', 'melancholic',
+    'upbeat', 'mellow', 'soothing', 'intense', 'emotional', 'playful', 'groovy',
+    'acoustic guitar', 'piano', 'drums', 'bass', 'strings', 'synth', 'male vocal',
+    'female vocal', 'low quality', 'live performance', 'electronic', 'rock', 'jazz'
+]
+
+
+def make_musiccaps_table(n_rows=5521, aspects_per_clip=8, seed=0):
+    """Generate a table with the columns of musiccaps-public.csv"""
+    rng = np.random.default_rng(seed)
+    aspects = rng.choice(len(ASPECT_WORDS), size=(n_rows, aspects_per_clip))
+    aspect_lists = [str([ASPECT_WORDS[i] for i in row]) for row in aspects]
+    captions = [
+        f"This is a {ASPECT_WORDS[row[0]]} song with {ASPECT_WORDS[row[1]]} "
+        f"and {ASPECT_WORDS[row[2]]}. The mood is {ASPECT_WORDS[row[3]]}."
+        for row in aspects
+    ]
+    return pd.DataFrame({
+        'ytid': [f'clip{i:07d}' for i in range(n_rows)],
+        'start_s': rng.integers(0, 300, n_rows) * 10,
+        'end_s': 0,
+        'audioset_positive_labels': '',
+        'aspect_list': aspect_lists,
+        'caption': captions,
+        'author_id': rng.integers(0, 10, n_rows),
+        'is_balanced_subset': False,
+        'is_audioset_eval': False
+    })
+
+
+def make_user_artists(n_users=1892, n_artists=LASTFM_ARTISTS, artists_per_user=50,
+                      n_clusters=20, in_cluster=0.8, seed=0):
+    """user_artists table where users mostly play artists of their own taste cluster
+
+    Unlike the uniform table of make_lastfm_tables, it has structure a
+    collaborative model can learn.
+    """
+    rng = np.random.default_rng(seed)
+    user_cluster = rng.integers(0, n_clusters, n_users)
+    artist_cluster = rng.integers(0, n_clusters, n_artists)
+    cluster_artists = [np.flatnonzero(artist_cluster == c) for c in range(n_clusters)]
+
+    users, artists = [], []
+    for user in range(n_users):
+        own = cluster_artists[user_cluster[user]]
+        n_own = rng.binomial(artists_per_user, in_cluster)
+        # Popular artists of the cluster are played by more of its users
+        picks = own[np.minimum(rng.zipf(1.3, n_own), len(own)) - 1]
+        others = rng.integers(0, n_artists, artists_per_user - n_own)
+        users.append(np.full(artists_per_user, user + 1))
+        artists.append(np.concatenate([picks, others]) + 1)
+
+    return pd.DataFrame({
+        'userID': np.concatenate(users),
+        'artistID': np.concatenate(artists),
+        'weight': rng.integers(1, 5000, n_users * artists_per_user)
+    }).drop_duplicates(['userID', 'artistID']).reset_index(drop=True)
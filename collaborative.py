@@ -0,0 +1,299 @@
+"""Implicit-feedback collaborative filtering on LastFM user_artists play counts
+
+Play counts are BM25-weighted into confidences and factorized with
+alternating least squares (Hu, Koren & Volinsky, 2008). Each half-step
+runs a few conjugate-gradient iterations for all users (or artists) at
+once, so every step is a sparse or dense matrix product. Factors are kept
+as contiguous float32 matrices and neighbours are plain dot products.
+"""
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.sparse.linalg import svds
+
+from similarity import top_k
+from lastfm_dataset import local_archives
+
+CF_DIR = "data/cf"
+CF_VERSION = 1
+CF_SOURCE = "data/user_artists.dat"
+
+# Users scored per artist_factors product in recommend_for_users
+USER_BLOCK = 256
+
+
+def build_interactions(user_artists_df):
+    """(user_ids, artist_ids, plays) with plays a CSR user x artist matrix"""
+    user_codes, user_ids = pd.factorize(user_artists_df['userID'], sort=True)
+    artist_codes, artist_ids = pd.factorize(user_artists_df['artistID'], sort=True)
+    plays = sp.csr_matrix(
+        (user_artists_df['weight'].to_numpy(dtype=np.float64), (user_codes, artist_codes)),
+        shape=(len(user_ids), len(artist_ids))
+    )
+    plays.sum_duplicates()
+    return np.asarray(user_ids), np.asarray(artist_ids), plays
+
+
+def bm25_weight(matrix, k1=100, b=0.8):
+    """BM25-weight a user x item count matrix: damp heavy users, boost rare items"""
+    weighted = sp.csr_matrix(matrix, dtype=np.float64, copy=True)
+    n_users = weighted.shape[0]
+    item_users = np.bincount(weighted.indices, minlength=weighted.shape[1])
+    idf = np.log(n_users) - np.log1p(item_users)
+
+    row_sums = np.asarray(weighted.sum(axis=1)).ravel()
+    length_norm = (1 - b) + b * row_sums / max(row_sums.mean(), 1e-12)
+    row_norm = np.repeat(length_norm, np.diff(weighted.indptr))
+    weighted.data = weighted.data * (k1 + 1) / (k1 * row_norm + weighted.data) * idf[weighted.indices]
+    return weighted
+
+
+def _conjugate_gradient(confidence, X, Y, regularization, steps):
+    """Refine every row of X against fixed Y with a few CG steps
+
+    Solves (Y'Y + Y'(C_u - I)Y + reg I) x_u = Y'C_u p_u for all u at once,
+    where confidence holds c_ui - 1 on the observed entries.
+    """
+    rows = np.repeat(np.arange(confidence.shape[0]), np.diff(confidence.indptr))
+    cols = confidence.indices
+    gram = Y.T @ Y + regularization * np.eye(Y.shape[1], dtype=Y.dtype)
+    weighted = confidence.copy()
+
+    def matvec(P):
+        weighted.data = confidence.data * np.einsum('ij,ij->i', P[rows], Y[cols])
+        return P @ gram + weighted @ Y
+
+    # Observed entries have preference 1 and confidence (c - 1) + 1
+    observed = confidence.copy()
+    observed.data = confidence.data + 1
+    b = observed @ Y
+    residual = b - matvec(X)
+    direction = residual.copy()
+    rs_old = np.einsum('ij,ij->i', residual, residual)
+    for _ in range(steps):
+        A_direction = matvec(direction)
+        denom = np.einsum('ij,ij->i', direction, A_direction)
+        alpha = np.divide(rs_old, denom, out=np.zeros_like(rs_old), where=denom > 0)
+        X += alpha[:, None] * direction
+        residual -= alpha[:, None] * A_direction
+        rs_new = np.einsum('ij,ij->i', residual, residual)
+        beta = np.divide(rs_new, rs_old, out=np.zeros_like(rs_new), where=rs_old > 0)
+        direction = residual + beta[:, None] * direction
+        rs_old = rs_new
+    return X
+
+
+class CollaborativeModel:
+    """User and artist factors learned from play counts
+
+    method is 'als' (confidence-weighted ALS) or 'svd' (truncated SVD of
+    the BM25-weighted matrix, faster but usually less accurate).
+    """
+
+    def __init__(self, factors=64, regularization=0.05, iterations=15, alpha=1.0,
+                 cg_steps=3, method='als', seed=0):
+        if method not in ('als', 'svd'):
+            raise ValueError(f"Unknown factorization method: {method}. Available methods: ['als', 'svd']")
+        self.factors = factors
+        self.regularization = regularization
+        self.iterations = iterations
+        self.alpha = alpha
+        self.cg_steps = cg_steps
+        self.method = method
+        self.seed = seed
+        self.user_ids = None
+        self.artist_ids = None
+        self.user_factors = None
+        self.artist_factors = None
+        self.artist_unit = None
+        self.user_items = None
+        self.train_seconds = None
+
+    def fit(self, user_artists_df):
+        """Learn factors from a userID/artistID/weight table"""
+        start = time.perf_counter()
+        self.user_ids, self.artist_ids, plays = build_interactions(user_artists_df)
+        self._fit_matrix(plays)
+        self.train_seconds = time.perf_counter() - start
+        return self
+
+    def _fit_matrix(self, plays):
+        weighted = bm25_weight(plays)
+        n_users, n_artists = weighted.shape
+        k = min(self.factors, min(n_users, n_artists) - 1)
+
+        if self.method == 'svd':
+            u, s, vt = svds(weighted, k=k, random_state=self.seed)
+            user_factors, artist_factors = u * np.sqrt(s), vt.T * np.sqrt(s)
+        else:
+            rng = np.random.default_rng(self.seed)
+            user_factors = rng.normal(0, 0.01, (n_users, k))
+            artist_factors = rng.normal(0, 0.01, (n_artists, k))
+            confidence = weighted * self.alpha
+            confidence_t = confidence.T.tocsr()
+            for _ in range(self.iterations):
+                _conjugate_gradient(confidence, user_factors, artist_factors,
+                                    self.regularization, self.cg_steps)
+                _conjugate_gradient(confidence_t, artist_factors, user_factors,
+                                    self.regularization, self.cg_steps)
+
+        self.user_items = (plays > 0).astype(np.int8).tocsr()
+        self._set_factors(user_factors, artist_factors)
+
+    def _set_factors(self, user_factors, artist_factors):
+        self.user_factors = np.ascontiguousarray(user_factors, dtype=np.float32)
+        self.artist_factors = np.ascontiguousarray(artist_factors, dtype=np.float32)
+        norms = np.linalg.norm(self.artist_factors, axis=1, keepdims=True)
+        self.artist_unit = np.ascontiguousarray(
+            self.artist_factors / np.maximum(norms, 1e-12), dtype=np.float32
+        )
+
+    def artist_index(self, artist_id):
+        i = np.searchsorted(self.artist_ids, artist_id)
+        return i if i < len(self.artist_ids) and self.artist_ids[i] == artist_id else None
+
+    def user_index(self, user_id):
+        i = np.searchsorted(self.user_ids, user_id)
+        return i if i < len(self.user_ids) and self.user_ids[i] == user_id else None
+
+    def similar_artists(self, artist_id, n=10):
+        """(artist_ids, cosine similarities) of the n nearest artists, itself excluded"""
+        i = self.artist_index(artist_id)
+        if i is None:
+            return self.artist_ids[:0], np.empty(0, dtype=np.float32)
+        scores = self.artist_unit @ self.artist_unit[i]
+        scores[i] = -np.inf
+        rows, scores = top_k(np.arange(len(scores)), scores, n)
+        return self.artist_ids[rows], scores
+
+    def artist_scores(self, user_index):
+        """Predicted preference of one user for every artist"""
+        return self.artist_factors @ self.user_factors[user_index]
+
+    def recommend_for_user(self, user_id, n=10, exclude_seen=True):
+        """(artist_ids, scores) of the n artists a user is predicted to like most"""
+        u = self.user_index(user_id)
+        if u is None:
+            return self.artist_ids[:0], np.empty(0, dtype=np.float32)
+        return self.top_artists(u, self.artist_scores(u), n, exclude_seen)
+
+    def recommend_for_users(self, user_ids, n=10, exclude_seen=True, block_size=USER_BLOCK):
+        """recommend_for_user for many users, scoring block_size users per matrix product"""
+        indices = [self.user_index(user_id) for user_id in user_ids]
+        known = [i for i, u in enumerate(indices) if u is not None]
+        empty = (self.artist_ids[:0], np.empty(0, dtype=np.float32))
+        results = [empty] * len(indices)
+        for start in range(0, len(known), block_size):
+            block = known[start:start + block_size]
+            users = [indices[i] for i in block]
+            scores = self.user_factors[users] @ self.artist_factors.T
+            for i, u, user_scores in zip(block, users, scores):
+                results[i] = self.top_artists(u, user_scores, n, exclude_seen)
+        return results
+
+    def top_artists(self, u, scores, n=10, exclude_seen=True):
+        """(artist_ids, scores) of the n best artists given user u's scores, overwritten in place"""
+        if exclude_seen:
+            start, end = self.user_items.indptr[u], self.user_items.indptr[u + 1]
+            scores[self.user_items.indices[start:end]] = -np.inf
+        rows, scores = top_k(np.arange(len(scores)), scores, n)
+        valid = np.isfinite(scores)
+        return self.artist_ids[rows[valid]], scores[valid]
+
+    @staticmethod
+    def is_fresh(model_dir=CF_DIR, sources=None):
+        """Check that saved factors exist and are newer than the play counts
+
+        sources defaults to the extracted play counts and every local
+        dataset archive they may be read from.
+        """
+        meta_path = os.path.join(model_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            return False
+        with open(meta_path) as f:
+            if json.load(f).get('version') != CF_VERSION:
+                return False
+        if sources is None:
+            sources = [CF_SOURCE, *local_archives()]
+        built_at = os.path.getmtime(meta_path)
+        return all(os.path.getmtime(path) < built_at for path in sources if os.path.exists(path))
+
+    def save(self, model_dir=CF_DIR):
+        """Write the factors next to model_dir, then rename them in with meta.json last
+
+        Loaded id arrays are memory-mapped, and renames leave those maps
+        valid; meta.json only appears once the rest of the model is in place.
+        """
+        tmp_dir = model_dir + '.tmp'
+        os.makedirs(tmp_dir, exist_ok=True)
+        for name in ['user_ids', 'artist_ids', 'user_factors', 'artist_factors']:
+            np.save(os.path.join(tmp_dir, f'{name}.npy'), getattr(self, name))
+        sp.save_npz(os.path.join(tmp_dir, 'user_items.npz'), self.user_items)
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump({
+                'version': CF_VERSION, 'method': self.method, 'factors': self.factors,
+                'regularization': self.regularization, 'iterations': self.iterations,
+                'alpha': self.alpha, 'train_seconds': self.train_seconds
+            }, f)
+
+        os.makedirs(model_dir, exist_ok=True)
+        meta_path = os.path.join(model_dir, 'meta.json')
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        for name in sorted(os.listdir(tmp_dir), key=lambda name: name == 'meta.json'):
+            os.replace(os.path.join(tmp_dir, name), os.path.join(model_dir, name))
+        os.rmdir(tmp_dir)
+
+    def load(self, model_dir=CF_DIR):
+        """Load saved factors; id arrays are memory-mapped"""
+        with open(os.path.join(model_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        for name in ['method', 'factors', 'regularization', 'iterations', 'alpha', 'train_seconds']:
+            setattr(self, name, meta[name])
+        self.user_ids = np.load(os.path.join(model_dir, 'user_ids.npy'), mmap_mode='r')
+        self.artist_ids = np.load(os.path.join(model_dir, 'artist_ids.npy'), mmap_mode='r')
+        self.user_items = sp.load_npz(os.path.join(model_dir, 'user_items.npz')).tocsr()
+        self._set_factors(
+            np.load(os.path.join(model_dir, 'user_factors.npy')),
+            np.load(os.path.join(model_dir, 'artist_factors.npy'))
+        )
+        return self
+
+
+def train_test_split(user_artists_df, test_fraction=0.2, min_artists=5, seed=0):
+    """Hold out a share of the artists of every user with at least min_artists"""
+    rng = np.random.default_rng(seed)
+    counts = user_artists_df.groupby('userID')['artistID'].transform('size').to_numpy()
+    held_out = (rng.random(len(user_artists_df)) < test_fraction) & (counts >= min_artists)
+    return user_artists_df[~held_out], user_artists_df[held_out]
+
+
+def precision_at_k(model, test_df, k=10):
+    """Mean share of each test user's top-k that is in their held-out artists
+
+    Returns (precision, per-query latencies in seconds).
+    """
+    precisions, latencies = [], []
+    for user_id, artists in test_df.groupby('userID')['artistID']:
+        start = time.perf_counter()
+        recommended, _ = model.recommend_for_user(user_id, k)
+        latencies.append(time.perf_counter() - start)
+        if model.user_index(user_id) is None:
+            continue
+        precisions.append(np.isin(recommended, artists.to_numpy()).sum() / min(k, len(artists)))
+    return float(np.mean(precisions)) if precisions else 0.0, np.array(latencies)
+
+
+def popularity_precision_at_k(train_df, test_df, k=10):
+    """precision@k of recommending the most played unseen artists, as a baseline"""
+    popular = train_df.groupby('artistID')['userID'].size().sort_values(ascending=False).index.to_numpy()
+    seen = train_df.groupby('userID')['artistID'].agg(set)
+    precisions = []
+    for user_id, artists in test_df.groupby('userID')['artistID']:
+        user_seen = seen.get(user_id, set())
+        top = [a for a in popular[:k + len(user_seen)] if a not in user_seen][:k]
+        precisions.append(np.isin(top, artists.to_numpy()).sum() / min(k, len(artists)))
+    return float(np.mean(precisions)) if precisions else 0.0
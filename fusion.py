@@ -0,0 +1,87 @@
+import numpy as np
+
+# Default weight of each signal in the fused score
+FUSION_WEIGHTS = {'mood': 1.0, 'similarity': 1.0, 'collaborative': 1.0, 'tag': 0.5}
+
+# Candidates taken from the top of every signal before rescoring
+FUSION_CANDIDATES = 200
+
+
+def normalize_columns(scores):
+    """Min-max scale every column of a candidates x signals matrix to [0, 1]
+
+    Constant columns (every candidate scored the same) become 0, so they do
+    not shift the ranking.
+    """
+    low = scores.min(axis=0)
+    span = scores.max(axis=0) - low
+    return np.divide(scores - low, span, out=np.zeros_like(scores), where=span > 0)
+
+
+def fuse_scores(scores, weights):
+    """Weighted mean of the normalized signal columns
+
+    The same as normalize_columns(scores) @ weights / weights.sum(), with
+    the weights folded into the scale of every column, so the candidates
+    are only shifted and multiplied once.
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    low = scores.min(axis=0)
+    span = scores.max(axis=0) - low
+    scale = np.divide(weights / weights.sum(), span, out=np.zeros_like(span), where=span > 0)
+    return (scores - low) @ scale
+
+
+def rank(rows, fused, limit=None):
+    """Positions of rows ordered by fused score, ties broken by row for determinism
+
+    With limit, only the start of that order: the candidates scoring at
+    least the limit-th best score, ties included, so the first limit
+    positions are the same as in the full order.
+    """
+    if limit is None or limit >= len(fused):
+        return np.lexsort((rows, -fused))
+    threshold = np.partition(fused, len(fused) - limit)[len(fused) - limit]
+    best = np.flatnonzero(fused >= threshold)
+    return best[np.lexsort((rows[best], -fused[best]))]
+
+
+def cap_per_group(order, groups, cap):
+    """Keep at most cap entries of every group, in the given order
+
+    order indexes the candidates best first and groups holds the group
+    (artist) of every candidate.
+    """
+    ranked_groups = groups[order]
+    by_group = np.argsort(ranked_groups, kind='stable')
+    sorted_groups = ranked_groups[by_group]
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    occurrence = np.empty(len(order), dtype=np.int64)
+    occurrence[by_group] = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    return order[occurrence < cap]
+
+
+def mmr_select(order, fused, features, n, trade_off=0.7):
+    """Maximal marginal relevance: pick n candidates balancing score and novelty
+
+    features holds one L2-normalized row per candidate (dense or sparse);
+    each step picks the candidate maximizing
+    trade_off * score - (1 - trade_off) * max similarity to those picked.
+    """
+    pool = order[:max(5 * n, n)]
+    vectors = features[pool]
+    similarity = vectors @ vectors.T
+    similarity = similarity.toarray() if hasattr(similarity, 'toarray') else np.asarray(similarity)
+
+    relevance = fused[pool]
+    max_similarity = np.zeros(len(pool))
+    available = np.ones(len(pool), dtype=bool)
+    picked = []
+    for _ in range(min(n, len(pool))):
+        gain = trade_off * relevance - (1 - trade_off) * max_similarity
+        gain[~available] = -np.inf
+        best = int(np.argmax(gain))
+        picked.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return pool[picked]
@@ -0,0 +1,383 @@
+"""Per-stage timing, tracing hooks and profiling for the processing pipeline
+
+Stages are timed with span, as a context manager or a decorator:
+
+    with span('gemini_analysis'):
+        mood = gemini_analysis(video_path)
+
+    @span('load_data')
+    def load_data(self): ...
+
+Every finished span feeds REGISTRY, an in-process registry of counters and
+latency histograms that exports JSON or Prometheus text, and is passed to
+the hooks added with add_hook. Spans are off unless PIPELINE_METRICS is set
+(or enable() is called); when off a decorated function costs one extra
+call and a flag check. PIPELINE_METRICS may also name the file that
+write_metrics exports to ('.prom' for Prometheus text, else JSON).
+
+Spans only reach the registry of the process they run in: stages run on
+a process pool are timed from the parent instead (see pipeline.py).
+
+profile wraps a single run in cProfile or a stack-sampling profiler,
+selected by PIPELINE_PROFILE ('cprofile' or 'sampling').
+"""
+import collections
+import contextlib
+import contextvars
+import cProfile
+import functools
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+
+METRICS_ENV = "PIPELINE_METRICS"
+TRACE_ENV = "PIPELINE_TRACE"
+PROFILE_ENV = "PIPELINE_PROFILE"
+PROFILE_OUTPUT_ENV = "PIPELINE_PROFILE_OUTPUT"
+
+# Upper bounds (ms) of the latency histogram buckets
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Seconds between stack samples of the sampling profiler
+SAMPLE_INTERVAL = 0.005
+
+# Lines of profile output printed when no output file is given
+PROFILE_LIMIT = 30
+
+# PIPELINE_METRICS values that only switch spans on or off
+_ON_VALUES = ('1', 'true', 'yes', 'on')
+_OFF_VALUES = ('', '0', 'false', 'no', 'off')
+
+
+class LatencyHistogram:
+    """Latency histogram with fixed millisecond buckets
+
+    counts[i] holds the observations that fell in bucket i alone (above
+    the previous bound, up to buckets[i]), with a last bucket for the
+    rest; they are not cumulative. to_prometheus accumulates them into
+    the cumulative le buckets Prometheus expects.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+
+    def observe(self, latency_ms):
+        for i, bound in enumerate(self.buckets):
+            if latency_ms <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.count += 1
+        self.total_ms += latency_ms
+
+    def to_dict(self):
+        labels = [f'le_{bound}' for bound in self.buckets] + ['le_inf']
+        return {
+            'count': self.count,
+            'mean_ms': self.total_ms / self.count if self.count else 0.0,
+            'buckets': dict(zip(labels, self.counts))
+        }
+
+
+class MetricsRegistry:
+    """Named counters and latency histograms, safe to update from any thread"""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def histogram(self, name):
+        """The histogram called name, created empty on first use"""
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            return histogram
+
+    def observe(self, name, latency_ms):
+        histogram = self.histogram(name)
+        with self._lock:
+            histogram.observe(latency_ms)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'latency': {name: hist.to_dict() for name, hist in self.histograms.items()}
+            }
+
+    def to_prometheus(self, prefix='pipeline', label='stage'):
+        """Prometheus text exposition: one histogram family keyed by label, one counter family"""
+        lines = []
+        with self._lock:
+            if self.histograms:
+                metric = f'{prefix}_duration_seconds'
+                lines += [f'# HELP {metric} Wall time by {label}.', f'# TYPE {metric} histogram']
+                for name, hist in sorted(self.histograms.items()):
+                    label_pair = f'{label}="{_escape_label(name)}"'
+                    cumulative = 0
+                    for bound, count in zip(hist.buckets, hist.counts):
+                        cumulative += count
+                        lines.append(f'{metric}_bucket{{{label_pair},le="{bound / 1e3:g}"}} {cumulative}')
+                    lines.append(f'{metric}_bucket{{{label_pair},le="+Inf"}} {hist.count}')
+                    lines.append(f'{metric}_sum{{{label_pair}}} {hist.total_ms / 1e3:.6f}')
+                    lines.append(f'{metric}_count{{{label_pair}}} {hist.count}')
+            if self.counters:
+                metric = f'{prefix}_events_total'
+                lines += [f'# HELP {metric} Event counters.', f'# TYPE {metric} counter']
+                for name, value in sorted(self.counters.items()):
+                    lines.append(f'{metric}{{name="{_escape_label(name)}"}} {value:g}')
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def write(self, path):
+        """Export to path: Prometheus text for '.prom' files, JSON otherwise"""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            if path.endswith('.prom'):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), f, indent=2)
+
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Metrics of every span in this process
+REGISTRY = MetricsRegistry()
+
+_enabled = os.environ.get(METRICS_ENV, '').lower() not in _OFF_VALUES
+_hooks = []
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+def enable(on=True):
+    """Turn span recording on or off for the whole process"""
+    global _enabled
+    _enabled = on
+
+
+def enabled():
+    return _enabled
+
+
+def count(name, value=1):
+    """Add to a counter of REGISTRY, if spans are on"""
+    if _enabled:
+        REGISTRY.inc(name, value)
+
+
+def add_hook(hook):
+    """Call hook(record) with a dict (name, parent, start, seconds, error) for every finished span"""
+    _hooks.append(hook)
+    return hook
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+class span:
+    """Time a block, or every call of a decorated function, as the stage name
+
+    Nested spans record the enclosing span as their parent; each asyncio
+    task and thread has its own chain. A span that raises counts under
+    '<name>.errors'.
+    """
+    __slots__ = ('name', 'parent', 'start', 'wall_start', 'token')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if _enabled:
+            self.parent = _current_span.get()
+            self.token = _current_span.set(self.name)
+            self.wall_start = time.time()
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.start is None:
+            return False
+        seconds = time.perf_counter() - self.start
+        _current_span.reset(self.token)
+        REGISTRY.observe(self.name, seconds * 1e3)
+        if exc_type is not None:
+            REGISTRY.inc(f'{self.name}.errors')
+        if _hooks:
+            record = {
+                'name': self.name,
+                'parent': self.parent,
+                'start': self.wall_start,
+                'seconds': seconds,
+                'error': None if exc_type is None else f"{exc_type.__name__}: {exc}"
+            }
+            for hook in list(_hooks):
+                hook(record)
+        return False
+
+    def __call__(self, func):
+        name = self.name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+class JsonLinesTrace:
+    """Span hook appending one JSON record per finished span to a file"""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.file = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record)
+        with self._lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def metrics_output():
+    """File named by PIPELINE_METRICS, or None when it is only an on/off flag"""
+    value = os.environ.get(METRICS_ENV, '')
+    if value.lower() in _ON_VALUES + _OFF_VALUES:
+        return None
+    return value
+
+
+def write_metrics(path=None):
+    """Export REGISTRY to path (default: the PIPELINE_METRICS file); returns the path written"""
+    path = path or metrics_output()
+    if path is None or not _enabled:
+        return None
+    REGISTRY.write(path)
+    return path
+
+
+if os.environ.get(TRACE_ENV):
+    add_hook(JsonLinesTrace(os.environ[TRACE_ENV]))
+
+
+class StackSampler:
+    """Sampling profiler: records the Python stack of every thread each interval
+
+    Stacks are kept collapsed ('outer;...;inner' -> samples), the input
+    format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(names))] += 1
+            self.samples += 1
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, samples in self.stacks.most_common():
+                f.write(f"{stack} {samples}\n")
+
+    def print_stats(self, limit=PROFILE_LIMIT):
+        """Functions by share of samples spent in them, directly or in their callees"""
+        total = sum(self.stacks.values())
+        inclusive, own = collections.Counter(), collections.Counter()
+        for stack, samples in self.stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += samples
+            for name in set(frames):
+                inclusive[name] += samples
+        print(f"{self.samples} samples every {self.interval * 1e3:g} ms")
+        print(f"{'total':>7}{'self':>7}  function")
+        for name, samples in inclusive.most_common(limit):
+            print(f"{samples / total:>7.1%}{own[name] / total:>7.1%}  {name}")
+
+
+@contextlib.contextmanager
+def profile(mode=None, output=None, limit=PROFILE_LIMIT):
+    """Profile the enclosed block with 'cprofile' or 'sampling'
+
+    mode defaults to PIPELINE_PROFILE and output to PIPELINE_PROFILE_OUTPUT;
+    without a mode nothing is profiled. The profile is written to output
+    (pstats file or collapsed stacks) or printed when there is none.
+    """
+    mode = mode or os.environ.get(PROFILE_ENV)
+    output = output or os.environ.get(PROFILE_OUTPUT_ENV)
+    if not mode:
+        yield
+        return
+
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            if output:
+                profiler.dump_stats(output)
+            else:
+                pstats.Stats(profiler).sort_stats('cumulative').print_stats(limit)
+    elif mode == 'sampling':
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            if output:
+                sampler.write(output)
+            else:
+                sampler.print_stats(limit)
+    else:
+        raise ValueError(f"Unknown profiler: {mode}. Available profilers: ['cprofile', 'sampling']")
+    if output:
+        print(f"Profile written to {output}")
@@ -0,0 +1,196 @@
+"""Download and read the hetrec2011 LastFM dataset
+
+The archive is streamed to disk in chunks. An interrupted download is kept
+as a .part file and resumed with an HTTP Range request, by the next call
+or by a retry after a dropped connection. Tables are parsed straight from
+the zip members, so nothing is extracted.
+
+Set LASTFM_MIRROR to a local directory, archive or URL (for example a
+local HTTP server) to fetch from there instead of DATASET_URL, and
+LASTFM_OFFLINE=1 to never contact DATASET_URL.
+"""
+import hashlib
+import os
+import zipfile
+
+import pandas as pd
+import requests
+from tqdm import tqdm
+
+DATASET_URL = "http://files.grouplens.org/datasets/hetrec2011/hetrec2011-lastfm-2k.zip"
+DATA_DIR = "data"
+ARCHIVE_PATH = os.path.join(DATA_DIR, "hetrec2011-lastfm-2k.zip")
+
+# Expected SHA-256 of the archive. Without a pinned value the digest of the
+# first verified download is recorded next to the archive (DIGEST_SUFFIX),
+# and later downloads and mirror copies must match it
+DATASET_SHA256 = None
+DIGEST_SUFFIX = ".sha256"
+
+MIRROR_ENV = "LASTFM_MIRROR"
+OFFLINE_ENV = "LASTFM_OFFLINE"
+
+# Bytes read per chunk; a dropped connection loses at most the chunk in flight
+CHUNK_SIZE = 64 * 1024
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_TIMEOUT = 30
+
+
+def sha256_file(path, chunk_size=CHUNK_SIZE):
+    """SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def expected_digest(path=ARCHIVE_PATH, sha256=DATASET_SHA256):
+    """SHA-256 the archive at path must have: the pinned one, else the one recorded for it, else None"""
+    if sha256 is not None:
+        return sha256.lower()
+    digest_path = path + DIGEST_SUFFIX
+    if os.path.exists(digest_path):
+        with open(digest_path) as f:
+            return f.read().strip().lower()
+    return None
+
+
+def record_digest(path, digest):
+    """Remember the digest of a verified archive for later checks"""
+    with open(path + DIGEST_SUFFIX, 'w') as f:
+        f.write(digest + '\n')
+
+
+def verify_archive(path, sha256=None):
+    """Check an archive's SHA-256 (when one is expected) and the CRC of every member
+
+    Returns the digest of the archive.
+    """
+    digest = sha256_file(path)
+    if sha256 is not None and digest != sha256.lower():
+        raise ValueError(f"Checksum mismatch for {path}: expected {sha256}, got {digest}")
+    with zipfile.ZipFile(path) as archive:
+        bad_member = archive.testzip()
+    if bad_member is not None:
+        raise zipfile.BadZipFile(f"Corrupt member {bad_member} in {path}")
+    return digest
+
+
+def download(url, path, sha256=None, chunk_size=CHUNK_SIZE, retries=DOWNLOAD_RETRIES,
+             timeout=DOWNLOAD_TIMEOUT):
+    """Stream url to path, resuming a partial download left in path + '.part'
+
+    The file only appears at path once complete and verified against
+    sha256, or the digest recorded by an earlier download; without either,
+    the digest of this download is recorded. A failed verification removes
+    the partial file so the next call starts over.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    sha256 = expected_digest(path, sha256)
+    part_path = path + '.part'
+
+    for attempt in range(retries + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        try:
+            with requests.get(url, stream=True, headers=headers, timeout=timeout) as response:
+                # 416: nothing left past offset, the partial file is complete
+                if response.status_code != 416:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        offset = 0  # The server ignored the range: start over
+                    _write_stream(response, part_path, offset, chunk_size)
+            break
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            if attempt == retries:
+                raise
+            print(f"Download interrupted ({type(e).__name__}), resuming...")
+
+    try:
+        digest = verify_archive(part_path, sha256)
+    except (ValueError, zipfile.BadZipFile):
+        os.remove(part_path)
+        raise
+    os.replace(part_path, path)
+    if sha256 is None:
+        record_digest(path, digest)
+    return path
+
+
+def _write_stream(response, part_path, offset, chunk_size):
+    """Append a streamed response body to part_path from offset on"""
+    total = int(response.headers.get('content-length', 0))
+    with open(part_path, 'r+b' if offset else 'wb') as f, \
+            tqdm(total=offset + total or None, initial=offset, unit='iB', unit_scale=True) as pbar:
+        f.seek(offset)
+        f.truncate()
+        for chunk in response.iter_content(chunk_size):
+            f.write(chunk)
+            pbar.update(len(chunk))
+
+
+def _mirror_archive(url=DATASET_URL):
+    """Local archive named by LASTFM_MIRROR (the file, or url's file name in the directory), if any"""
+    mirror = os.environ.get(MIRROR_ENV)
+    if not mirror:
+        return None
+    local = os.path.join(mirror, os.path.basename(url)) if os.path.isdir(mirror) else mirror
+    return local if os.path.isfile(local) else None
+
+
+def local_archives(path=ARCHIVE_PATH, url=DATASET_URL):
+    """Local files the tables may be read from: the archive at path and a mirror archive
+
+    Anything built from the dataset is stale once one of these is newer.
+    """
+    mirror = _mirror_archive(url)
+    return [path] if mirror is None else [path, mirror]
+
+
+def fetch_dataset(path=ARCHIVE_PATH, url=DATASET_URL, sha256=DATASET_SHA256, offline=None):
+    """Path of the dataset archive, downloading it if needed
+
+    A LASTFM_MIRROR directory or file is used in place, without copying;
+    a mirror URL replaces url. In offline mode (LASTFM_OFFLINE=1 or
+    offline=True) only the local archive and the mirror are used.
+    """
+    if os.path.exists(path):
+        return path
+
+    if offline is None:
+        offline = os.environ.get(OFFLINE_ENV, '').lower() in ('1', 'true', 'yes')
+    mirror = os.environ.get(MIRROR_ENV)
+    if mirror:
+        local = _mirror_archive(url)
+        if local is not None:
+            verify_archive(local, expected_digest(path, sha256))
+            return local
+        if '://' not in mirror:
+            raise FileNotFoundError(f"No dataset archive found in mirror {mirror}")
+        url = mirror if mirror.endswith('.zip') else mirror.rstrip('/') + '/' + os.path.basename(url)
+    elif offline:
+        raise FileNotFoundError(f"{path} not found and offline mode is on; "
+                                f"set {MIRROR_ENV} to a local copy of the dataset")
+
+    print(f"Downloading LastFM dataset from {url}...")
+    return download(url, path, sha256)
+
+
+def read_table(name, data_dir=DATA_DIR, archive=None):
+    """Read one tab-separated .dat table of the dataset
+
+    An extracted data_dir/name takes precedence; otherwise the table is
+    parsed straight from the archive member, fetching the archive first
+    if needed.
+    """
+    extracted = os.path.join(data_dir, name)
+    if os.path.exists(extracted):
+        return pd.read_csv(extracted, sep='\t', encoding='latin-1')
+
+    with zipfile.ZipFile(archive or fetch_dataset()) as zip_file:
+        members = [member for member in zip_file.namelist() if os.path.basename(member) == name]
+        if not members:
+            raise FileNotFoundError(f"{name} not found in {zip_file.filename}")
+        with zip_file.open(members[0]) as f:
+            return pd.read_csv(f, sep='\t', encoding='latin-1')
@@ -2,18 +2,30 @@ import tkinter as tk
 import pandas as pd
 from tkinter import filedialog, messagebox
 from gemini_analysis import gemini_analysis
-from video_intelligence_analysis import vi_analysis
+from video_intelligence_analysis import vi_analysis, resolve_backend
+from visual_feature import analyze_visual_tempo
 from dotenv import load_dotenv
 from recommender import MusicRecommender
-import threading 
+from analysis_cache import AnalysisCache, hash_file
+from instrumentation import profile, span, write_metrics
+import sys
 # from MusicGen.musicGen import generate_music_tensors #part3.2 
 from music_caps import recommend_music_by_mood
 
 load_dotenv()
 
+@span('process_video')
 def process_video(video_path, music_choice):
-    # Step 1: Analyze the mood of the video using Gemini
-    mood = gemini_analysis(video_path)
+    # Step 1: Analyze the mood of the video using Gemini,
+    # reusing the result if the same footage was analyzed before
+    cache = get_analysis_cache()
+    video_hash = hash_file(video_path)
+
+    def analyze_mood():
+        with span('gemini_analysis'):
+            return gemini_analysis(video_path)
+
+    mood = cache.get_or_compute(video_hash, 'mood', analyze_mood)
     
     if mood is None:
         print("Failed to analyze mood.")
@@ -25,13 +37,7 @@ def process_video(video_path, music_choice):
     if music_choice == "vocal":
         # Step 3.1: Only initialize the recommender if user chooses vocal music
         print("Initializing recommender for vocal music...")
-        
-        recommendation_thread = threading.Thread(target=process_vocal_music, args=(mood,))
-        recommendation_thread.start()
-        
-        # Wait for the thread to finish before the main program ends
-        recommendation_thread.join()
-        
+        process_vocal_music(mood)
 
     elif music_choice == "instrumental":
         # Step 3.2: Use instrumental music dataset from musicCaps
@@ -43,16 +49,38 @@ def process_video(video_path, music_choice):
     elif music_choice == "ai-generated":
         # Step 3.3: Use VI for shot change detection and object detection
         print("Generating AI-generated music based on video analysis.")
-        # Your code for AI-generated music and video analysis here (e.g., shot change detection and object detection)
+        backend = resolve_backend()
+        video_analysis = cache.get_or_compute(
+            video_hash, f"shots:{backend}", lambda: vi_analysis(video_path, backend)
+        )
+        motion = cache.get_or_compute(video_hash, 'motion', lambda: analyze_visual_tempo(video_path))
+        print(f"Detected {len(video_analysis['shots'])} shots and "
+              f"{motion['motion_frames']} motion frames.")
+        # Your code for AI-generated music here
     
     else:
         print("Invalid music choice. Please select from 'vocal', 'instrumental', or 'ai-generated'.")
 
+# Recommender and analysis cache shared by every call in this process, loaded on first use
+_recommender = None
+_analysis_cache = None
+
+def get_analysis_cache():
+    global _analysis_cache
+    if _analysis_cache is None:
+        _analysis_cache = AnalysisCache()
+    return _analysis_cache
+
+def get_recommender():
+    global _recommender
+    if _recommender is None:
+        _recommender = MusicRecommender()
+        _recommender.load_data()  # Load the LastFM dataset
+    return _recommender
+
 def process_vocal_music(mood):
     try:
-        # Initialize the recommender object
-        recommender = MusicRecommender()
-        recommender.load_data()  # Load the LastFM dataset
+        recommender = get_recommender()
         
         # Get vocal music recommendations for the given mood
         print(f"Fetching vocal music recommendations for mood: {mood}")
@@ -69,9 +97,26 @@ def process_vocal_music(mood):
 
 
 if __name__ == "__main__":
+    # Resident service mode: python main.py serve [--port 8000 | --unix PATH]
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        from service import main as serve
+        serve(sys.argv[2:])
+        sys.exit()
+
+    # Batch mode: python main.py batch VIDEO_OR_DIR... [--choice ai-generated] [--stub]
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        from pipeline import main as run_batch
+        run_batch(sys.argv[2:])
+        sys.exit()
+
     video_path = input("Please upload your MP4 video file: ")
     print("Choose music type: vocal, instrumental, or ai-generated.")
     music_choice = input("Enter music choice: ").strip().lower()
     
     # Step 1: Process the video based on the user's choice
-    process_video(video_path, music_choice)
+    # (PIPELINE_PROFILE / PIPELINE_METRICS turn on profiling and stage metrics)
+    with profile():
+        process_video(video_path, music_choice)
+    metrics_path = write_metrics()
+    if metrics_path:
+        print(f"Stage metrics written to {metrics_path}")
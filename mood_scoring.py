@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+# Order of the audio feature columns used by the mood weights
+AUDIO_FEATURES = ['energy', 'valence', 'danceability', 'tempo']
+
+# Blend between the audio-feature score and the tag score
+AUDIO_WEIGHT = 0.7
+TAG_WEIGHT = 0.3
+
+
+def audio_mood_weights(moods):
+    """Build (weights, bias) so that audio score = features @ weights + bias
+
+    Features are [energy, valence, danceability, tempo / 180] and the
+    weights expand the formulas of MusicRecommender._calculate_song_mood_score.
+    """
+    weights = np.zeros((len(AUDIO_FEATURES), len(moods)))
+    bias = np.zeros(len(moods))
+
+    for i, mood in enumerate(moods):
+        if mood in ['happy', 'energetic']:
+            weights[:, i] = [0.3, 0.4, 0.3, 0]
+        elif mood == 'sad':
+            # (1 - valence) * 0.5 + (1 - energy) * 0.3 + (1 - danceability) * 0.2
+            weights[:, i] = [-0.3, -0.5, -0.2, 0]
+            bias[i] = 1.0
+        elif mood == 'relaxing':
+            # (1 - energy) * 0.4 + valence * 0.3 + (1 - tempo / 180) * 0.3
+            weights[:, i] = [-0.4, 0.3, 0, -0.3]
+            bias[i] = 0.7
+        else:
+            weights[:, i] = [0.4, 0.3, 0.3, 0]
+
+    return weights, bias
+
+
+def build_artist_tag_matrix(songs_df):
+    """Count each artist's tags once into a sparse artist x tag matrix
+
+    Returns (artist_codes, tag_vocab, counts) where artist_codes maps every
+    song row to its row in counts. Tags are taken from the first song of each
+    artist since all songs of an artist share the same tag list.
+    """
+    artist_codes, artist_ids = pd.factorize(songs_df['artist_id'])
+    _, first_rows = np.unique(artist_codes, return_index=True)
+
+    # One row per (artist, tag) occurrence, empty tag lists drop out
+    tags = songs_df['tags'].iloc[first_rows].reset_index(drop=True).explode()
+    tags = tags[tags.notna()]
+    tag_codes, tag_vocab = pd.factorize(tags.astype(str))
+
+    counts = sp.csr_matrix(
+        (np.ones(len(tag_codes), dtype=np.float64), (tags.index.to_numpy(), tag_codes)),
+        shape=(len(artist_ids), len(tag_vocab))
+    )
+    counts.sum_duplicates()
+
+    return artist_codes, np.asarray(tag_vocab, dtype=object), counts
+
+
+def build_tag_mood_matrix(tag_vocab, mood_categories):
+    """Sparse tag x mood matrix, 1 where a tag contains one of the mood's keywords"""
+    rows, cols = [], []
+    for j, keywords in enumerate(mood_categories.values()):
+        for i, tag in enumerate(tag_vocab):
+            tag = tag.lower()
+            if any(keyword in tag for keyword in keywords):
+                rows.append(i)
+                cols.append(j)
+
+    return sp.csr_matrix(
+        (np.ones(len(rows)), (rows, cols)),
+        shape=(len(tag_vocab), len(mood_categories))
+    )
+
+
+def compute_mood_scores(songs_df, mood_categories, artist_tags=None):
+    """Compute every mood score for every song in one pass
+
+    artist_tags is an (artist_codes, tag_vocab, counts) triple as returned
+    by build_artist_tag_matrix, which is built from songs_df['tags'] when
+    not given. Returns a DataFrame with one mood_<name> column per mood
+    category, aligned with songs_df.
+    """
+    moods = list(mood_categories.keys())
+
+    # Audio part: one matrix product over all songs and moods
+    features = songs_df[AUDIO_FEATURES].to_numpy(dtype=np.float64, copy=True)
+    features[:, 3] /= 180
+    weights, bias = audio_mood_weights(moods)
+    scores = features @ weights + bias
+
+    # Tag part: share of an artist's tags matching each mood, one sparse matmul
+    if artist_tags is None:
+        artist_tags = build_artist_tag_matrix(songs_df)
+    artist_codes, tag_vocab, counts = artist_tags
+    tag_mood = build_tag_mood_matrix(tag_vocab, mood_categories)
+    n_tags = np.maximum(np.asarray(counts.sum(axis=1)).ravel(), 1)
+    tag_scores = (counts @ tag_mood).toarray() / n_tags[:, None]
+
+    scores = AUDIO_WEIGHT * scores + TAG_WEIGHT * tag_scores[artist_codes]
+
+    return pd.DataFrame(
+        scores,
+        columns=[f'mood_{mood}' for mood in moods],
+        index=songs_df.index
+    )
@@ -1,19 +1,232 @@
-import pandas as pd
+import os
+import re
+import json
+import threading
+import numpy as np
 
-music_data = pd.read_csv('../data/musiccaps-public.csv')
+CSV_PATH = '../data/musiccaps-public.csv'
+INDEX_DIR = '../data/musiccaps_index'
+INDEX_VERSION = 1
+
+# Columns kept for the results
+RESULT_COLUMNS = ['ytid', 'start_s', 'aspect_list']
+
+# An aspect_list term counts this many times as often as a caption term
+ASPECT_WEIGHT = 2.0
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Postings are kept in descending score order, and a query reads at most
+# this many per term, so its cost does not grow with the dataset
+MAX_POSTINGS_PER_TERM = 2000
+
+# Related words searched along with a mood, at EXPANSION_WEIGHT
+MOOD_KEYWORDS = {
+    'happy': ['happy', 'joyful', 'cheerful', 'upbeat', 'fun', 'playful'],
+    'sad': ['sad', 'melancholic', 'emotional', 'sorrowful', 'mournful'],
+    'relaxing': ['relaxing', 'calm', 'chill', 'soothing', 'peaceful', 'mellow'],
+    'romantic': ['romantic', 'love', 'sentimental', 'tender', 'passionate'],
+    'angry': ['angry', 'aggressive', 'intense', 'heavy', 'furious'],
+    'energetic': ['energetic', 'upbeat', 'powerful', 'lively', 'groovy']
+}
+EXPANSION_WEIGHT = 0.5
+
+TOKEN_PATTERN = r'[a-z0-9]+'
+
+
+def tokenize(text):
+    return re.findall(TOKEN_PATTERN, text.lower())
+
+
+def parse_moods(moods):
+    """Split 'happy, energetic' or ['happy', 'calm'] into single moods"""
+    if isinstance(moods, str):
+        moods = re.split(r',|/|\band\b', moods)
+    return [mood.strip().lower() for mood in moods if mood.strip()]
+
+
+class MusicCapsIndex:
+    """BM25 index over the aspect_list and caption of every MusicCaps clip
+
+    Nothing is read until the first query. The index is built from the CSV
+    once and saved to index_dir; later loads memory-map the saved arrays.
+    Postings are stored per term as (row, BM25 weight) sorted by weight, so
+    a query only adds up the best postings of its terms.
+    """
+
+    def __init__(self, csv_path=CSV_PATH, index_dir=INDEX_DIR):
+        self.csv_path = csv_path
+        self.index_dir = index_dir
+        self.vocab = None
+        self.postings_ptr = None
+        self.postings_rows = None
+        self.postings_weights = None
+        self.table = None
+        self._lock = threading.Lock()
+
+    def is_fresh(self):
+        """Check that a saved index exists and is newer than the CSV"""
+        meta_path = os.path.join(self.index_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            return False
+        with open(meta_path) as f:
+            if json.load(f).get('version') != INDEX_VERSION:
+                return False
+        return not os.path.exists(self.csv_path) or (
+            os.path.getmtime(self.csv_path) < os.path.getmtime(meta_path)
+        )
+
+    def ensure_loaded(self):
+        with self._lock:
+            if self.vocab is None:
+                if self.is_fresh():
+                    self.load()
+                else:
+                    self.build()
+                    self.save()
+        return self
+
+    def build(self):
+        """Build the postings from the CSV"""
+        import pandas as pd
+
+        music_data = pd.read_csv(self.csv_path)
+        n_rows = len(music_data)
+
+        # One (row, term, weight) entry per token occurrence
+        fields = [('aspect_list', ASPECT_WEIGHT), ('caption', 1.0)]
+        occurrences = []
+        for column, weight in fields:
+            tokens = music_data[column].fillna('').str.lower().str.findall(TOKEN_PATTERN).explode().dropna()
+            occurrences.append(pd.DataFrame({'row': tokens.index, 'term': tokens.to_numpy(), 'tf': weight}))
+        occurrences = pd.concat(occurrences, ignore_index=True)
+
+        # Weighted term frequencies and document lengths
+        tf = occurrences.groupby(['term', 'row'], sort=True)['tf'].sum().reset_index()
+        doc_length = np.bincount(tf['row'], weights=tf['tf'], minlength=n_rows)
+        avg_length = doc_length.mean() if n_rows else 1.0
+
+        terms, term_codes = np.unique(tf['term'].to_numpy(dtype=str), return_inverse=True)
+        doc_freq = np.bincount(term_codes, minlength=len(terms))
+        idf = np.log(1 + (n_rows - doc_freq + 0.5) / (doc_freq + 0.5))
+
+        rows = tf['row'].to_numpy()
+        freq = tf['tf'].to_numpy()
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_length[rows] / avg_length)
+        weights = idf[term_codes] * freq * (BM25_K1 + 1) / (freq + norm)
+
+        # Group by term, best-scoring rows first
+        order = np.lexsort((-weights, term_codes))
+        self.vocab = terms
+        self.postings_ptr = np.concatenate([[0], np.cumsum(doc_freq)]).astype(np.int64)
+        self.postings_rows = rows[order].astype(np.int32)
+        self.postings_weights = weights[order].astype(np.float32)
+
+        import pyarrow as pa
+        self.table = pa.Table.from_pandas(music_data[RESULT_COLUMNS], preserve_index=False)
+        return self
+
+    def save(self):
+        """Save the index, swapping it in once every file is written"""
+        import pyarrow.feather as feather
+
+        tmp_dir = self.index_dir + '.tmp'
+        os.makedirs(tmp_dir, exist_ok=True)
+        # A single record batch: taking rows from a multi-chunk table concatenates the chunks
+        feather.write_feather(
+            self.table, os.path.join(tmp_dir, 'clips.arrow'),
+            compression='uncompressed', chunksize=max(self.table.num_rows, 1)
+        )
+        for name in ['vocab', 'postings_ptr', 'postings_rows', 'postings_weights']:
+            np.save(os.path.join(tmp_dir, f'{name}.npy'), getattr(self, name))
+
+        os.makedirs(self.index_dir, exist_ok=True)
+        for name in os.listdir(tmp_dir):
+            os.replace(os.path.join(tmp_dir, name), os.path.join(self.index_dir, name))
+        os.rmdir(tmp_dir)
+
+        with open(os.path.join(self.index_dir, 'meta.json'), 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'n_clips': self.table.num_rows}, f)
+
+    def load(self):
+        """Memory-map an index written by save"""
+        import pyarrow.feather as feather
+
+        self.table = feather.read_table(os.path.join(self.index_dir, 'clips.arrow'), memory_map=True)
+        for name in ['vocab', 'postings_ptr', 'postings_rows', 'postings_weights']:
+            setattr(self, name, np.load(os.path.join(self.index_dir, f'{name}.npy'), mmap_mode='r'))
+        return self
+
+    def query_terms(self, moods):
+        """{term: weight} for one or more moods, with their related words"""
+        terms = {}
+        for mood in parse_moods(moods):
+            for term in tokenize(mood):
+                terms[term] = terms.get(term, 0) + 1.0
+            for keyword in MOOD_KEYWORDS.get(mood, []):
+                for term in tokenize(keyword):
+                    terms.setdefault(term, EXPANSION_WEIGHT)
+        return terms
+
+    def search(self, moods, n=5):
+        """(rows, scores) of the n clips most relevant to the moods, best first"""
+        self.ensure_loaded()
+        rows, weights = [], []
+        for term, query_weight in self.query_terms(moods).items():
+            i = np.searchsorted(self.vocab, term)
+            if i == len(self.vocab) or self.vocab[i] != term:
+                continue
+            start = self.postings_ptr[i]
+            end = min(self.postings_ptr[i + 1], start + MAX_POSTINGS_PER_TERM)
+            rows.append(self.postings_rows[start:end])
+            weights.append(self.postings_weights[start:end] * query_weight)
+
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        # Sum the scores of every candidate row
+        candidates, inverse = np.unique(np.concatenate(rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(weights))
+
+        n = min(n, len(candidates))
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.lexsort((candidates[top], -scores[top]))]
+        return candidates[top], scores[top]
+
+    def find(self, moods, n=5):
+        """DataFrame of the n best clips with their YouTube links and scores"""
+        rows, scores = self.search(moods, n)
+        recommended_songs = self.table.take(rows).to_pandas()
+        recommended_songs['yt_link'] = [
+            f"https://youtu.be/{ytid}?start={start_s}"
+            for ytid, start_s in zip(recommended_songs['ytid'], recommended_songs['start_s'])
+        ]
+        recommended_songs['score'] = scores
+        return recommended_songs
+
+
+# Index shared by every call in this process, loaded on first query
+_index = None
+
+def get_index():
+    global _index
+    if _index is None:
+        _index = MusicCapsIndex()
+    return _index
+
+def find_music_by_mood(mood, n_recommendations=5):
+    # Rank clips by relevance of their aspect_list and caption to the mood(s)
+    return get_index().find(mood, n_recommendations)
 
 def recommend_music_by_mood(mood):
-    # Filter songs that contain the mood in the aspect_list
-    matching_songs = music_data[music_data['aspect_list'].str.contains(mood, case=False, na=False)]
-    
-    # Select the first 5 matching songs
-    recommended_songs = matching_songs.head(5)
+    recommended_songs = find_music_by_mood(mood)
 
     # Print the recommended song links
     if not recommended_songs.empty:
         print("Recommended songs for mood '{}':".format(mood))
-        for _, song in recommended_songs.iterrows():
-            yt_link = f"https://youtu.be/{song['ytid']}?start={song['start_s']}"
+        for yt_link in recommended_songs['yt_link']:
             print(yt_link)
     else:
         print("No songs found for mood '{}'.".format(mood))
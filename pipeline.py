@@ -0,0 +1,298 @@
+"""Batch pipeline: analyze many videos with overlapped stages
+
+I/O-bound analyzers (Gemini mood, Video Intelligence) run on a thread pool
+and CPU-bound analyzers (cv2 motion, librosa audio, local shot detection)
+on a process pool. All stages of a video run concurrently and their
+results are joined per video; every stage has its own concurrency limit.
+Cloud analyzers can be replaced with local stubs to run offline. Time in
+each stage is also recorded as a 'pipeline.<stage>' span (see
+instrumentation.py), measured from this process so process pool stages
+are included.
+
+    python pipeline.py videos/ --choice ai-generated --stub
+"""
+import argparse
+import asyncio
+import os
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import instrumentation
+from instrumentation import profile, span
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.webm')
+
+# Analysis stages run for each music choice
+CHOICE_STAGES = {
+    'vocal': ['mood'],
+    'instrumental': ['mood'],
+    'ai-generated': ['mood', 'shots', 'motion', 'audio'],
+}
+
+# Default number of videos in each stage at once (None: one per CPU)
+STAGE_LIMITS = {'hash': 4, 'mood': 8, 'shots': 8, 'motion': None, 'audio': None, 'recommend': 1}
+
+# Simulated round trip of the stubbed cloud analyzers, in seconds
+STUB_LATENCY = 0.5
+STUB_MOODS = ['happy', 'sad', 'relaxing', 'energetic', 'romantic', 'angry']
+
+
+@span('gemini_analysis')
+def gemini_mood(video_path):
+    from gemini_analysis import gemini_analysis
+    return gemini_analysis(video_path)
+
+
+def stub_mood(video_path):
+    """Stand-in for gemini_mood: a fixed mood per file name after STUB_LATENCY"""
+    time.sleep(STUB_LATENCY)
+    return STUB_MOODS[zlib.crc32(os.path.basename(video_path).encode()) % len(STUB_MOODS)]
+
+
+def cloud_shots(video_path):
+    from video_intelligence_analysis import vi_analysis
+    return vi_analysis(video_path, backend='cloud')
+
+
+def local_shots(video_path):
+    from video_intelligence_analysis import vi_analysis
+    return vi_analysis(video_path, backend='local')
+
+
+def stub_shots(video_path):
+    """Stand-in for cloud_shots: no labels and no shots after STUB_LATENCY"""
+    time.sleep(STUB_LATENCY)
+    return {'backend': 'stub', 'labels': [], 'shots': []}
+
+
+def motion(video_path):
+    from visual_feature import analyze_visual_tempo
+    return analyze_visual_tempo(video_path)
+
+
+def audio(video_path):
+    from audio_feature import extract_audio_features
+    return extract_audio_features(video_path)
+
+
+def find_videos(paths):
+    """Video files named in paths, expanding directories (not recursively)"""
+    videos = []
+    for path in paths:
+        if os.path.isdir(path):
+            videos.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path))
+                if name.lower().endswith(VIDEO_EXTENSIONS)
+            )
+        else:
+            videos.append(path)
+    return videos
+
+
+class VideoPipeline:
+    """Runs the analysis stages of many videos concurrently
+
+    Each stage maps to (function, 'io' or 'cpu'). 'io' stages run on a
+    thread pool and 'cpu' stages on a process pool. A stage's limit caps
+    how many videos it processes at once. With stub=True the cloud
+    analyzers sleep and return fixed results, and nothing is cached.
+    """
+
+    def __init__(self, music_choice='ai-generated', stages=None, stub=False, vi_backend='cloud',
+                 limits=None, cpu_workers=None, io_workers=16, cache=None):
+        if music_choice not in CHOICE_STAGES:
+            raise ValueError(f"Unknown music choice: {music_choice}. "
+                             f"Available choices: {list(CHOICE_STAGES)}")
+        self.music_choice = music_choice
+        self.stage_names = stages or CHOICE_STAGES[music_choice]
+        self.stub = stub
+        self.cache = None if stub else cache
+
+        shots = (stub_shots, 'io') if stub else (
+            (local_shots, 'cpu') if vi_backend == 'local' else (cloud_shots, 'io')
+        )
+        self.stages = {
+            'mood': (stub_mood, 'io') if stub else (gemini_mood, 'io'),
+            'shots': shots,
+            'motion': (motion, 'cpu'),
+            'audio': (audio, 'cpu'),
+        }
+        unknown = set(self.stage_names) - set(self.stages)
+        if unknown:
+            raise ValueError(f"Unknown stages: {sorted(unknown)}. Available stages: {list(self.stages)}")
+        # Cache kinds, so shots from different backends are kept apart
+        self.cache_kinds = {name: name for name in self.stages}
+        self.cache_kinds['shots'] = f"shots:{'stub' if stub else vi_backend}"
+
+        self.cpu_workers = cpu_workers or os.cpu_count() or 1
+        self.limits = dict(STAGE_LIMITS, **(limits or {}))
+        self.io_workers = io_workers
+        self.stage_seconds = {}
+        self._recommender = None
+
+    def _limit(self, name):
+        return self.limits.get(name) or self.cpu_workers
+
+    async def _in_stage(self, name, executor, func, *args):
+        """Run func(*args) on executor once the stage has a free slot"""
+        async with self.semaphores[name]:
+            start = time.perf_counter()
+            try:
+                with span(f'pipeline.{name}'):
+                    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+            finally:
+                self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + time.perf_counter() - start
+
+    async def _run_stage(self, name, video_path, video_hash):
+        func, kind = self.stages[name]
+        cache_kind = self.cache_kinds[name]
+        if self.cache is not None:
+            cached = await self._in_stage('hash', self.thread_pool, self.cache.get, video_hash, cache_kind)
+            if cached is not None:
+                return cached
+
+        executor = self.process_pool if kind == 'cpu' else self.thread_pool
+        value = await self._in_stage(name, executor, func, video_path)
+        if self.cache is not None and value is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                self.thread_pool, self.cache.put, video_hash, cache_kind, value
+            )
+        return value
+
+    def _recommend(self, mood):
+        """Recommendations for the mood, as JSON-ready records"""
+        if self.music_choice == 'vocal':
+            if self._recommender is None:
+                from recommender import MusicRecommender
+                self._recommender = MusicRecommender()
+                self._recommender.load_data()
+            results = self._recommender.recommend_by_mood(mood)
+        else:
+            from music_caps import find_music_by_mood
+            results = find_music_by_mood(mood)
+        return results.to_dict(orient='records')
+
+    async def _run_video(self, video_path):
+        """Run every stage of one video and join the results"""
+        start = time.perf_counter()
+        result = {'video': video_path, 'errors': {}}
+
+        video_hash = None
+        if self.cache is not None:
+            from analysis_cache import hash_file
+            video_hash = await self._in_stage('hash', self.thread_pool, hash_file, video_path)
+
+        values = await asyncio.gather(
+            *(self._run_stage(name, video_path, video_hash) for name in self.stage_names),
+            return_exceptions=True
+        )
+        for name, value in zip(self.stage_names, values):
+            if isinstance(value, BaseException):
+                result['errors'][name] = f"{type(value).__name__}: {value}"
+                value = None
+            result[name] = value
+
+        if self.music_choice in ('vocal', 'instrumental') and result.get('mood'):
+            try:
+                result['recommendations'] = await self._in_stage(
+                    'recommend', self.thread_pool, self._recommend, result['mood']
+                )
+            except Exception as e:
+                result['errors']['recommend'] = f"{type(e).__name__}: {e}"
+
+        result['seconds'] = time.perf_counter() - start
+        return result
+
+    async def run_async(self, videos, progress=True):
+        self.semaphores = {
+            name: asyncio.Semaphore(self._limit(name))
+            for name in set(self.limits) | set(self.stages)
+        }
+        self.stage_seconds = {}
+        results = []
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix='pipeline-io') as thread_pool, \
+                ProcessPoolExecutor(max_workers=self.cpu_workers) as process_pool:
+            self.thread_pool, self.process_pool = thread_pool, process_pool
+
+            for done, task in enumerate(asyncio.as_completed([self._run_video(v) for v in videos]), 1):
+                result = await task
+                results.append(result)
+                if progress:
+                    elapsed = time.perf_counter() - start
+                    status = f"errors in {', '.join(result['errors'])}" if result['errors'] else 'ok'
+                    print(f"[{done}/{len(videos)}] {os.path.basename(result['video'])}: {status} "
+                          f"in {result['seconds']:.1f} s ({done / elapsed * 60:.1f} videos/min)")
+
+        elapsed = time.perf_counter() - start
+        order = {video: i for i, video in enumerate(videos)}
+        results.sort(key=lambda r: order[r['video']])
+        summary = {
+            'videos': len(videos),
+            'seconds': elapsed,
+            'videos_per_minute': len(videos) / elapsed * 60 if elapsed else 0.0,
+            'stage_seconds': self.stage_seconds,
+            'failed': sum(1 for r in results if r['errors']),
+        }
+        if self.cache is not None:
+            summary['cache'] = self.cache.stats()
+        return results, summary
+
+    def run(self, videos, progress=True):
+        """Analyze the videos; returns (per-video results in input order, summary)"""
+        return asyncio.run(self.run_async(videos, progress))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze a batch of videos")
+    parser.add_argument('paths', nargs='+', help="Video files or directories of videos")
+    parser.add_argument('--choice', default='ai-generated', choices=list(CHOICE_STAGES))
+    parser.add_argument('--stages', help="Comma-separated stages to run instead of the choice's")
+    parser.add_argument('--stub', action='store_true', help="Replace cloud analyzers with local stubs")
+    parser.add_argument('--vi-backend', default='cloud', choices=['cloud', 'local'])
+    parser.add_argument('--cpu-workers', type=int)
+    parser.add_argument('--limit', action='append', default=[], metavar='STAGE=N',
+                        help="Concurrency limit of a stage, e.g. --limit mood=4")
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help="Record stage metrics and write them here (.prom for Prometheus text, else JSON)")
+    parser.add_argument('--profile', choices=['cprofile', 'sampling'], help="Profile the run")
+    parser.add_argument('--profile-output', metavar='PATH',
+                        help="Write the profile here instead of printing it")
+    args = parser.parse_args(argv)
+    if args.metrics:
+        instrumentation.enable()
+
+    limits = {}
+    for item in args.limit:
+        stage, _, value = item.partition('=')
+        limits[stage] = int(value)
+
+    cache = None
+    if not args.no_cache and not args.stub:
+        from analysis_cache import AnalysisCache
+        cache = AnalysisCache()
+
+    pipeline = VideoPipeline(
+        args.choice, stages=args.stages.split(',') if args.stages else None, stub=args.stub,
+        vi_backend=args.vi_backend, limits=limits, cpu_workers=args.cpu_workers, cache=cache
+    )
+    videos = find_videos(args.paths)
+    with profile(args.profile, args.profile_output):
+        _, summary = pipeline.run(videos)
+
+    print(f"Processed {summary['videos']} videos in {summary['seconds']:.1f} s "
+          f"({summary['videos_per_minute']:.1f} videos/min), {summary['failed']} with errors")
+    for name, seconds in sorted(summary['stage_seconds'].items()):
+        print(f"  {name:<10} {seconds:8.1f} s in stage, summed over videos")
+    if 'cache' in summary:
+        print(f"Cache: {summary['cache']}")
+    metrics_path = instrumentation.write_metrics(args.metrics)
+    if metrics_path:
+        print(f"Stage metrics written to {metrics_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,194 @@
 import pandas as pd
 import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import requests
-import zipfile
-import io
 import os
-from tqdm import tqdm
+import copy
+import threading
+import json
+import pickle
+import scipy.sparse as sp
+import pyarrow as pa
+import pyarrow.feather as feather
+from requests.utils import quote
+from mood_scoring import compute_mood_scores
+from similarity import make_similarity_index
+from append_buffer import append
+from collaborative import CF_DIR, CollaborativeModel
+from fusion import FUSION_CANDIDATES, FUSION_WEIGHTS, cap_per_group, fuse_scores, mmr_select, rank
+from lastfm_dataset import ARCHIVE_PATH, fetch_dataset, local_archives, read_table
+from instrumentation import span
+
+YOUTUBE_SEARCH_URL = "https://www.youtube.com/results?search_query="
+
+# Song variants generated for every artist
+SONG_TYPES = [
+    'Greatest Hits', 'Live Performance', 'Acoustic Version',
+    'Radio Edit', 'Album Version', 'Single Version',
+    'Remix', 'Extended Mix', 'Studio Recording'
+]
+
+# (low, high) ranges of the generated song features
+FEATURE_RANGES = {
+    'tempo': (60, 180),  # BPM
+    'energy': (0, 1),
+    'danceability': (0, 1),
+    'valence': (0, 1)  # Musical positiveness
+}
+
+# Raw LastFM files the song catalog is built from: the archive or its extracted tables
+SOURCE_FILES = [
+    ARCHIVE_PATH, "data/artists.dat", "data/user_artists.dat",
+    "data/tags.dat", "data/user_taggedartists.dat"
+]
+
+# Precomputed catalog index written after the first full load
+INDEX_DIR = "data/index"
+INDEX_VERSION = 7
+
+# Query-path arrays saved with the index as memory-mappable .npy files
+INDEX_ARRAYS = [
+    'artist_ids', 'song_features', 'mood_scores', 'mood_order', 'artist_keys',
+    'tag_vocab', 'tag_artist_indptr', 'tag_artist_indices', 'tag_artist_counts',
+    'tag_names', 'artist_tag_ptr', 'artist_tag_ids'
+]
+
+# String fields of every artist code, saved with the index in artists.arrow
+ARTIST_FIELDS = {'artist_name': 'artist_names', 'url': 'artist_urls'}
+
+# Upper bound of the random boost added to mood scores for variety
+MOOD_RANDOM_BOOST = 0.2
+
+# A mood query draws its n songs from the MOOD_POOL_FACTOR * n best of the mood
+MOOD_POOL_FACTOR = 20
+
+# Songs kept in order at the top of each mood's ranking; deeper pools scan
+# mood_scores. Covers MOOD_POOL_FACTOR * n for n up to 200
+MOOD_ORDER_DEPTH = 4096
+
+# Same-mood queries scored per candidates x queries block in recommend_batch
+MOOD_QUERY_BLOCK = 64
+
+# Number of tag and artist-name lookups, and hybrid signal candidates, remembered per instance
+LOOKUP_CACHE_SIZE = 256
+
+# Share of the catalog's songs added or retagged since the TF-IDF fit above
+# which update_catalog refits the catalog
+REBUILD_DRIFT = 0.1
+
+# Columns of the full song table (see songs_frame)
+SONG_COLUMNS = [
+    'song_name', 'artist_id', 'artist_name', 'tags',
+    'tempo', 'energy', 'danceability', 'valence',
+    'url', 'youtube_search_link'
+]
+
+# Columns of songs_df, the song table as stored
+STORED_COLUMNS = ['artist_id', 'variant', 'artist_name', 'url'] + list(FEATURE_RANGES)
+
+# Columns not in songs_df but generated per row from its artist and variant
+GENERATED_COLUMNS = ['song_name', 'tags', 'youtube_search_link']
+
+# What update_catalog keeps aside until _merge_updates folds it into the catalog
+UPDATE_DELTAS = [
+    'added_artist_fields', 'delta_tag_artists', 'delta_tag_ptr', 'delta_tag_ids',
+    'delta_posting_tags', 'delta_posting_ptr', 'delta_posting_artists',
+    'delta_posting_counts', 'delta_posting_new', 'delta_mood_rows', 'delta_mood_scores'
+]
+
+
+class _AppendedTable:
+    """A raw table attribute that update_catalog appends rows to
+
+    Appended chunks are concatenated when the table is next read, so an
+    update costs its own rows rather than the table. unique names a key
+    column whose last row wins.
+    """
+    def __init__(self, unique=None):
+        self.unique = unique
+
+    def __set_name__(self, owner, name):
+        self.chunks = f'_{name}_chunks'
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        chunks = instance.__dict__.get(self.chunks, ())
+        if len(chunks) > 1:
+            table = pd.concat(chunks, ignore_index=True)
+            if self.unique is not None:
+                table = table.drop_duplicates(self.unique, keep='last')
+            chunks = instance.__dict__[self.chunks] = (table,)
+        return chunks[0] if chunks else None
+
+    def __set__(self, instance, table):
+        instance.__dict__[self.chunks] = () if table is None else (table,)
+
+    def append(self, instance, rows):
+        """Add rows to the table of instance, if it has one loaded"""
+        chunks = instance.__dict__.get(self.chunks, ())
+        if chunks and rows is not None and len(rows):
+            instance.__dict__[self.chunks] = chunks + (rows,)
+
 
 class MusicRecommender:
-    def __init__(self):
-        self.songs_df = None
+    # Raw LastFM tables, loaded by load_data
+    artists_df = _AppendedTable()
+    tags_df = _AppendedTable(unique='tagID')
+    artist_tags_df = _AppendedTable()
+
+    def __init__(self, seed=None, index_dir=INDEX_DIR, similarity='exact', similarity_params=None):
+        self.index_dir = index_dir
+        self.similarity = similarity
+        self.similarity_params = similarity_params or {}
+        self.similarity_index = None
         self.artists_df = None
         self.tags_df = None
         self.user_artists_df = None
         self.artist_tags_df = None
+        # One TF-IDF row per artist code, shared by the artist's songs, as
+        # fitted or merged; the similarity index also holds rows updated since
         self.tfidf_matrix = None
         self.vectorizer = None
+        self.rng = np.random.default_rng(seed)
+
+        # The catalog, built by create_song_dataset or memory-mapped from the index.
+        # Songs are stored artist by artist, len(SONG_TYPES) rows each, so the
+        # songs of artist code a are rows a * len(SONG_TYPES) onwards and the
+        # artist code of song row r is r // len(SONG_TYPES). Artist fields are
+        # kept once per artist code, features as one float32 row per song.
+        self.artist_ids = None
+        self.artist_names = None
+        self.artist_urls = None
+        self.song_features = None
+
+        # Query-path arrays, built by _build_query_index or memory-mapped from the index
+        self.mood_scores = None
+        self.mood_order = None
+        self.artist_keys = None
+        self.tag_vocab = None
+        self.tag_artist_indptr = None
+        self.tag_artist_indices = None
+        self.tag_artist_counts = None
+        self._lookup_cache = {}
+
+        # {LastFM artist id: artist code}, built on first use by update_catalog
+        self._artist_code_of = None
+
+        # Tags stored once per artist: CSR over artist codes into tag_names
+        self.tag_names = None
+        self.artist_tag_ptr = None
+        self.artist_tag_ids = None
+
+        # Songs added or retagged by update_catalog since the last TF-IDF fit
+        self.stale_songs = 0
+        self.rebuild_thread = None
+        self._catalog_version = 0
+        self._update_lock = threading.Lock()
+
+        # Collaborative model on user_artists, loaded by load_collaborative
+        self.collaborative = None
+        self.cf_artist_rows = None
+        self.cf_artist_index = None
         
         # Define mood categories and their related tags
         self.mood_categories = {
@@ -28,149 +200,931 @@ class MusicRecommender:
             'energetic': ['energetic', 'upbeat', 'powerful', 'dynamic', 'lively']
         }
 
+        # Updates kept aside by update_catalog (see UPDATE_DELTAS), so it
+        # never rewrites an array the size of the catalog. Arrays that only
+        # grow are extended through append buffers; the rest is overlaid:
+        # - added_artist_fields: ARTIST_FIELDS values of the artist codes past
+        #   the end of the Arrow-backed arrays, as object arrays
+        # - delta_tag_*: CSR over the sorted delta_tag_artists of the tags
+        #   they were given after their stored ones in artist_tag_ids
+        # - delta_posting_*: CSR over the sorted delta_posting_tags of the
+        #   (artist, assignment count) postings added to those tags, and
+        #   whether the artist is missing from the tag's stored postings
+        # - delta_mood_*: mood scores of the sorted delta_mood_rows, which
+        #   override their rows in mood_scores
+        self._buffers = {}
+        self._tag_code_of = None
+        self._reset_updates()
+
     def download_dataset(self):
-        """Download LastFM dataset"""
-        print("Downloading LastFM dataset...")
-        url = "http://files.grouplens.org/datasets/hetrec2011/hetrec2011-lastfm-2k.zip"
-        
+        """Download LastFM dataset, resuming a partial download
+
+        Returns the path of the zip archive the tables are read from (see
+        lastfm_dataset for the mirror and offline settings).
+        """
         try:
-            response = requests.get(url, stream=True)
-            total_size = int(response.headers.get('content-length', 0))
-            
-            with tqdm(total=total_size, unit='iB', unit_scale=True) as pbar:
-                response = requests.get(url)
-                with open("data/lastfm.zip", 'wb') as f:
-                    f.write(response.content)
-            
-            print("Extracting files...")
-            with zipfile.ZipFile("data/lastfm.zip", 'r') as zip_ref:
-                zip_ref.extractall("data")
-            
-            os.remove("data/lastfm.zip")
-            
+            return fetch_dataset()
         except Exception as e:
             print(f"Error downloading dataset: {str(e)}")
             raise
 
-    def load_data(self):
+    @span('load_data')
+    def load_data(self, use_index=True):
         """Load LastFM dataset and create song-level data"""
-        if not os.path.exists("data/artists.dat"):
-            print("Dataset not found, downloading...")
-            self.download_dataset()
+        if use_index and self.index_is_fresh():
+            print("Loading precomputed index...")
+            self.load_index()
+            return
+
+        archive = None
+        if not all(os.path.exists(path) for path in SOURCE_FILES[1:]):
+            archive = self.download_dataset()
         
         print("Loading dataset...")
         try:
-            # Load base datasets
-            self.artists_df = pd.read_csv("data/artists.dat", 
-                                        sep='\t', 
-                                        encoding='latin-1')
-            
-            self.user_artists_df = pd.read_csv("data/user_artists.dat",
-                                             sep='\t',
-                                             encoding='latin-1')
-            
-            self.tags_df = pd.read_csv("data/tags.dat",
-                                     sep='\t',
-                                     encoding='latin-1')
-            
-            self.artist_tags_df = pd.read_csv("data/user_taggedartists.dat",
-                                            sep='\t',
-                                            encoding='latin-1')
+            # Load base datasets, straight from the archive unless extracted
+            self.artists_df = read_table("artists.dat", archive=archive)
+            self.user_artists_df = read_table("user_artists.dat", archive=archive)
+            self.tags_df = read_table("tags.dat", archive=archive)
+            self.artist_tags_df = read_table("user_taggedartists.dat", archive=archive)
             
             print("Creating song-level dataset...")
             self.create_song_dataset()
             
             print("\nDataset loaded successfully!")
-            print(f"Total Songs: {len(self.songs_df)}")
+            print(f"Total Songs: {self.n_songs}")
             print(f"Total Artists: {len(self.artists_df)}")
-            print("Columns in songs_df:", self.songs_df.columns.tolist())
+            print("Columns in songs_df:", STORED_COLUMNS)
             
             self.process_song_features()
+
+            if use_index:
+                self.save_index()
             
         except Exception as e:
             print(f"Error loading data: {str(e)}")
             raise
 
-    # def create_youtube_search_link(self, song_name, artist_name):
-    #     search_query = f"{song_name} {artist_name}"
-    #     return f"https://www.youtube.com/results?search_query={requests.utils.quote(search_query)}"
+    def index_is_fresh(self):
+        """Check that a saved index exists and is newer than the source files and any mirror archive"""
+        meta_path = os.path.join(self.index_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            return False
+
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get('version') != INDEX_VERSION:
+            return False
+
+        built_at = os.path.getmtime(meta_path)
+        return all(
+            os.path.getmtime(path) < built_at
+            for path in SOURCE_FILES + local_archives() if os.path.exists(path)
+        )
+
+    def save_index(self):
+        """Save the processed catalog so later loads can skip the rebuild"""
+        print(f"Saving index to {self.index_dir}...")
+        self._merge_updates()
+
+        # Write into a scratch directory first: the current index may be
+        # memory-mapped by this or another process and must not be overwritten
+        tmp_dir = self.index_dir + '.tmp'
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        # Uncompressed Arrow IPC so the artist strings can be memory-mapped:
+        # one record batch of large_string columns, the layout of pandas'
+        # Arrow-backed strings, so load_index wraps them without a copy
+        artists = pa.table({field: getattr(self, name) for field, name in ARTIST_FIELDS.items()})
+        feather.write_feather(
+            artists.combine_chunks(),
+            os.path.join(tmp_dir, 'artists.arrow'),
+            compression='uncompressed', chunksize=max(len(artists), 1)
+        )
+
+        # CSR components as plain .npy files so they can be memory-mapped too
+        tfidf = self.tfidf_matrix.tocsr()
+        for part in ('data', 'indices', 'indptr'):
+            np.save(os.path.join(tmp_dir, f'tfidf_{part}.npy'), getattr(tfidf, part))
+
+        for name in INDEX_ARRAYS:
+            np.save(os.path.join(tmp_dir, f'{name}.npy'), getattr(self, name))
+        self.similarity_index.save(tmp_dir)
+
+        with open(os.path.join(tmp_dir, 'vectorizer.pkl'), 'wb') as f:
+            pickle.dump(self.vectorizer, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump({
+                'version': INDEX_VERSION,
+                'n_songs': self.n_songs,
+                'similarity': self.similarity,
+                'tfidf_shape': list(tfidf.shape),
+                'stale_songs': self.stale_songs
+            }, f)
+
+        # Swap files in with renames, which leave existing memory maps valid.
+        # meta.json goes last: its mtime marks the index as complete
+        os.makedirs(self.index_dir, exist_ok=True)
+        meta_path = os.path.join(self.index_dir, 'meta.json')
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        for name in sorted(os.listdir(tmp_dir), key=lambda name: name == 'meta.json'):
+            os.replace(os.path.join(tmp_dir, name), os.path.join(self.index_dir, name))
+        os.rmdir(tmp_dir)
+
+    def load_index(self):
+        """Memory-map a catalog saved by save_index"""
+        with open(os.path.join(self.index_dir, 'meta.json')) as f:
+            meta = json.load(f)
+
+        # Views of the mapped file, like the .npy arrays below: nothing is
+        # read or copied until a query touches it
+        table = feather.read_table(os.path.join(self.index_dir, 'artists.arrow'), memory_map=True)
+        for field, name in ARTIST_FIELDS.items():
+            setattr(self, name, pd.array(table[field], dtype='str'))
+
+        parts = [
+            np.load(os.path.join(self.index_dir, f'tfidf_{part}.npy'), mmap_mode='r')
+            for part in ('data', 'indices', 'indptr')
+        ]
+        self.tfidf_matrix = sp.csr_matrix(tuple(parts), shape=tuple(meta['tfidf_shape']), copy=False)
+
+        with open(os.path.join(self.index_dir, 'vectorizer.pkl'), 'rb') as f:
+            self.vectorizer = pickle.load(f)
+        self.stale_songs = meta.get('stale_songs', 0)
+
+        for name in INDEX_ARRAYS:
+            setattr(self, name, np.load(os.path.join(self.index_dir, f'{name}.npy'), mmap_mode='r'))
+        self._artist_code_of = None
+        self._tag_code_of = None
+        self._buffers = {}
+        self._reset_updates()
+        self._allocate_query_buffers()
+
+        # An index saved with another similarity backend only needs that part rebuilt
+        if meta['similarity'] == self.similarity:
+            self._make_similarity_index().load(self.index_dir)
+        else:
+            self._build_similarity_index()
+
+        print(f"Index loaded: {meta['n_songs']} songs")
 
     def create_song_dataset(self):
-        """Create a song-level dataset with popular songs for each artist"""
-        # Create a base song dataset with multiple songs per artist
-        songs_data = []
-        
-        # Get top tags for each artist
+        """Create a song-level dataset with popular songs for each artist
+
+        There is one song per (artist, song type) pair, artist by artist.
+        The artist id, name and url are kept once per artist code in
+        artist_ids / artist_names / artist_urls and the float32 features
+        of every song in song_features; a song's variant (index into
+        SONG_TYPES) follows from its row. Tags are kept once per artist in
+        artist_tag_ptr / artist_tag_ids, mood scores in mood_scores, and
+        song names and search links are generated when a result needs them
+        (see songs_frame).
+        """
+        artists = self.artists_df
+        n_artists, n_types = len(artists), len(SONG_TYPES)
+
+        # Every tag assignment, grouped by the artist's position in artists_df;
+        # assignments of artists missing from artists_df drop out
         artist_tags = pd.merge(self.artist_tags_df, self.tags_df, on='tagID')
-        artist_tags_grouped = artist_tags.groupby('artistID')['tagValue'].agg(list).reset_index()
-        
-        # Create multiple songs for each artist based on their tags and popularity
-        for _, artist in self.artists_df.iterrows():
-            artist_id = artist['id']
-            
-            # Get artist's tags
-            tags = artist_tags_grouped[
-                artist_tags_grouped['artistID'] == artist_id
-            ]['tagValue'].iloc[0] if len(
-                artist_tags_grouped[artist_tags_grouped['artistID'] == artist_id]
-            ) > 0 else []
-            
-            # Generate song names based on common song types
-            song_types = [
-                'Greatest Hits', 'Live Performance', 'Acoustic Version',
-                'Radio Edit', 'Album Version', 'Single Version',
-                'Remix', 'Extended Mix', 'Studio Recording'
-            ]
-            
-            # Create multiple songs for the artist
-            for song_type in song_types:
-                song_name = f"{artist['name']} - {song_type}"
-                
-                # Generate song features
-                tempo = np.random.uniform(60, 180)  # BPM
-                energy = np.random.uniform(0, 1)
-                danceability = np.random.uniform(0, 1)
-                valence = np.random.uniform(0, 1)  # Musical positiveness
-                
-                # youtube_search_link = self.create_youtube_search_link(song_name, artist['name'])
-                
-                songs_data.append({
-                    'song_name': song_name,
-                    'artist_id': artist_id,
-                    'artist_name': artist['name'],
-                    'tags': tags,
-                    'tempo': tempo,
-                    'energy': energy,
-                    'danceability': danceability,
-                    'valence': valence,
-                    'url': artist['url'],
-                    'youtube_search_link': youtube_search_link
-                })
-        
-        self.songs_df = pd.DataFrame(songs_data)
+        owners = pd.Index(artists['id']).get_indexer(artist_tags['artistID'])
+        known = owners >= 0
+        owners = owners[known]
+        order = np.argsort(owners, kind='stable')
+        tag_codes, tag_names = pd.factorize(artist_tags['tagValue'][known].astype(str))
+        self.tag_names = np.array(tag_names, dtype=str)
+        self._tag_code_of = None
+        self.artist_tag_ids = tag_codes[order].astype(np.int32)
+        self.artist_tag_ptr = np.concatenate(
+            [[0], np.cumsum(np.bincount(owners, minlength=n_artists))]
+        ).astype(np.int64)
+
+        # The artist fields, one value per artist rather than per song
+        self.artist_ids = artists['id'].to_numpy(dtype=np.int32)
+        self.artist_names = pd.array(artists['name'].astype(str), dtype='str')
+        self.artist_urls = pd.array(artists['url'], dtype='str')
+        self._artist_code_of = None
+        self._buffers = {}
+        self._reset_updates()
+
+        self.song_features = self._draw_features(n_artists * n_types)
+
+    def _draw_features(self, n_songs):
+        """float32 (n songs x FEATURE_RANGES) features, in one draw from the seeded generator"""
+        low = np.array([r[0] for r in FEATURE_RANGES.values()])
+        high = np.array([r[1] for r in FEATURE_RANGES.values()])
+        features = self.rng.uniform(low, high, size=(n_songs, len(FEATURE_RANGES)))
+        return features.astype(np.float32, order='F')
 
+    @span('process_song_features')
     def process_song_features(self):
         """Process song features and create feature matrix"""
         print("Processing song features...")
-        
-        # Create text features from tags
-        self.songs_df['tag_text'] = self.songs_df['tags'].apply(
-            lambda x: ' '.join(x) if isinstance(x, list) else ''
+        self._fit_tfidf()
+
+        # Process mood scores for all songs and moods at once
+        self._set_mood_scores()
+
+        self._build_query_index()
+        self._build_similarity_index()
+
+    def _fit_tfidf(self):
+        """Fit the vectorizer and TF-IDF matrix on the tags of every artist
+
+        Songs share their artist's tags, so the matrix holds one float32 row
+        per artist code and a song's row is that of its artist.
+        """
+        artist_text = [' '.join(tags) for tags in self._tag_lists(np.arange(len(self.artist_tag_ptr) - 1))]
+        self.vectorizer = TfidfVectorizer(max_features=1000, stop_words='english', dtype=np.float32)
+        self.tfidf_matrix = self.vectorizer.fit_transform(artist_text)
+        self.stale_songs = 0
+
+    def apply_audio_features(self, features):
+        """Replace the generated audio features of songs with measured ones
+
+        features maps song names to feature values: a DataFrame indexed by
+        song_name, or a dict such as audio_feature.extract_many returns when
+        keyed by song name. Values are clipped to FEATURE_RANGES, then mood
+        scores and the query index are recomputed. Returns the number of
+        songs updated.
+        """
+        if isinstance(features, dict):
+            features = pd.DataFrame.from_dict(features, orient='index')
+        features = features[~features.index.duplicated(keep='last')]
+        # Scores and postings are recomputed below from the merged catalog
+        self._merge_updates()
+        columns = [column for column in FEATURE_RANGES if column in features.columns]
+
+        song_names = pd.Series(self.song_names(np.arange(self.n_songs)))
+        updated = np.zeros(self.n_songs, dtype=bool)
+        # Written on a copy: worker copies and the memory-mapped index keep theirs
+        song_features = np.array(self.song_features, order='F')
+        for i, column in enumerate(FEATURE_RANGES):
+            if column not in columns:
+                continue
+            low, high = FEATURE_RANGES[column]
+            measured = song_names.map(features[column].clip(low, high)).to_numpy(dtype=np.float32)
+            found = ~np.isnan(measured)
+            song_features[found, i] = measured[found]
+            updated |= found
+        self.song_features = song_features
+
+        self._set_mood_scores()
+        self._build_query_index()
+        return int(updated.sum())
+
+    def _set_mood_scores(self):
+        """Recompute mood_scores, one float32 column per mood, from features and tags"""
+        mood_scores = compute_mood_scores(
+            self._features_frame(), self.mood_categories,
+            artist_tags=(self._song_artists(np.arange(self.n_songs)), self.tag_names, self._artist_tag_counts())
         )
-        
-        # Create TF-IDF matrix from tags
-        self.vectorizer = TfidfVectorizer(max_features=1000, stop_words='english')
-        self.tfidf_matrix = self.vectorizer.fit_transform(self.songs_df['tag_text'])
-        
-        # Process mood scores for songs
-        for mood in self.mood_categories.keys():
-            self.songs_df[f'mood_{mood}'] = self.songs_df.apply(
-                lambda x: self._calculate_song_mood_score(x, mood),
-                axis=1
+        self.mood_scores = np.asfortranarray(mood_scores.to_numpy(dtype=np.float32))
+
+    def _artist_tags(self, artists=None):
+        """(ptr, tag ids): CSR of the tags of every artist code, or of the given codes
+
+        An artist's tags are its stored ones in artist_tag_ids followed by
+        those update_catalog gave it since, in delta_tag_ids.
+        """
+        ptr, ids = self.artist_tag_ptr, self.artist_tag_ids
+        if artists is None:
+            if len(self.delta_tag_artists) == 0:
+                return ptr, ids
+            artists = np.arange(len(ptr) - 1)
+        artists = np.asarray(artists, dtype=np.int64)
+        stored = ptr[artists + 1] - ptr[artists]
+        positions, found = _positions_in(self.delta_tag_artists, artists)
+        added = np.zeros(len(artists), dtype=np.int64)
+        added[found] = self.delta_tag_ptr[positions[found] + 1] - self.delta_tag_ptr[positions[found]]
+
+        lengths = stored + added
+        merged_ptr = np.concatenate([[0], np.cumsum(lengths)])
+        merged_ids = np.empty(merged_ptr[-1], dtype=ids.dtype)
+        merged_ids[_segment_positions(merged_ptr[:-1], stored)] = _gather_segments(ptr, ids, artists)
+        merged_ids[_segment_positions(merged_ptr[:-1] + stored, added)] = _gather_segments(
+            self.delta_tag_ptr, self.delta_tag_ids, positions[found]
+        )
+        return merged_ptr, merged_ids
+
+    def _artist_tag_counts(self, artists=None):
+        """Sparse artist x tag matrix counting each tag of every artist, or of the given artist codes"""
+        ptr, ids = self._artist_tags(artists)
+        # Copied: summing duplicates sorts the indices in place
+        counts = sp.csr_matrix(
+            (np.ones(len(ids)), ids, ptr),
+            shape=(len(ptr) - 1, len(self.tag_names)), copy=True
+        )
+        counts.sum_duplicates()
+        return counts
+
+    def _tag_lists(self, artist_codes):
+        """Tag list of every given artist code"""
+        ptr, ids = self._artist_tags(artist_codes)
+        names = self.tag_names[ids]
+        return [names[start:end].tolist() for start, end in zip(ptr[:-1], ptr[1:])]
+
+    def update_catalog(self, artists_df=None, artist_tags_df=None, tags_df=None, background=True):
+        """Add artists and tag assignments without refitting the catalog
+
+        artists_df holds new artists in the artists.dat layout (id, name,
+        url); ids already in the catalog are skipped. artist_tags_df holds
+        new user_taggedartists rows for new or existing artists, with the
+        values of their tagIDs taken from tags_df or the tags loaded before;
+        a tagValue column can be given instead.
+
+        Only the songs of the affected artists are rescored. Their TF-IDF
+        rows come from the fitted vectorizer, so tags outside its vocabulary
+        are ignored until the next fit; their mood scores are recomputed and
+        they are moved within the heads of the mood orders and the similarity
+        index. An update costs its own artists and tags, not the catalog:
+        new artists are appended and the rest is kept aside (see
+        UPDATE_DELTAS) until saving or rebuilding merges it. Once the share
+        of songs added or retagged since the last fit exceeds REBUILD_DRIFT,
+        rebuild_catalog runs, in a background thread unless background is
+        False.
+
+        Must not run concurrently with queries on this instance; worker
+        copies keep the catalog they were made from. Returns a summary dict.
+        """
+        with self._update_lock:
+            code_of = self._artist_code_map()
+            n_artists, n_songs = len(self.artist_ids), self.n_songs
+
+            artists = pd.DataFrame(columns=['id', 'name', 'url'])
+            if artists_df is not None:
+                artists = artists_df.drop_duplicates('id')
+                artists = artists[[artist_id not in code_of for artist_id in artists['id'].tolist()]]
+            codes = np.arange(n_artists, n_artists + len(artists))
+            code_of.update(zip(artists['id'].tolist(), codes.tolist()))
+
+            owners, tag_codes = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+            if artist_tags_df is not None and len(artist_tags_df):
+                owners, tag_codes = self._tag_assignments(artist_tags_df, tags_df, code_of)
+
+            affected = np.union1d(codes, owners)
+            if len(affected) == 0:
+                return {'artists_added': 0, 'songs_updated': 0,
+                        'drift': self.stale_songs / max(n_songs, 1), 'rebuild': False}
+
+            self._append_artists(artists)
+            self._append_artist_tags(owners, tag_codes, n_artists)
+
+            rows = self._artist_song_rows(affected)
+            # Updated on a copy, so worker copies keep the index they share
+            self.similarity_index = copy.copy(self.similarity_index).update(
+                affected, self.vectorizer.transform([' '.join(tags) for tags in self._tag_lists(affected)])
+            )
+            self._update_mood_rows(affected, rows, n_songs)
+            if self.collaborative is not None:
+                self._map_collaborative_artists(self.collaborative, codes)
+            self._allocate_query_buffers()
+
+            # Keep the raw tables in step when they are loaded
+            type(self).artists_df.append(self, artists)
+            type(self).artist_tags_df.append(self, artist_tags_df)
+            type(self).tags_df.append(self, tags_df)
+
+            self.stale_songs += len(rows)
+            self._catalog_version += 1
+            drift = self.stale_songs / self.n_songs
+
+        rebuild = drift > REBUILD_DRIFT
+        if rebuild:
+            self._schedule_rebuild(background)
+        return {'artists_added': len(artists), 'songs_updated': len(rows), 'drift': drift, 'rebuild': rebuild}
+
+    def _artist_code_map(self):
+        """{LastFM artist id: artist code}, kept in step by update_catalog so lookups cost the delta"""
+        if self._artist_code_of is None:
+            self._artist_code_of = dict(zip(self.artist_ids.tolist(), range(len(self.artist_ids))))
+        return self._artist_code_of
+
+    def _tag_code_map(self):
+        """{tag value: tag code}, kept in step by update_catalog like _artist_code_map"""
+        if self._tag_code_of is None:
+            self._tag_code_of = dict(zip(self.tag_names.tolist(), range(len(self.tag_names))))
+        return self._tag_code_of
+
+    def _tag_assignments(self, artist_tags_df, tags_df, code_of):
+        """(artist codes, tag codes) of new tag assignments, extending tag_names with unseen tags"""
+        if 'tagValue' not in artist_tags_df.columns:
+            known = [tags for tags in (self.tags_df, tags_df) if tags is not None]
+            if not known:
+                raise ValueError("Tag values unknown: pass tags_df or a tagValue column")
+            tags = pd.concat(known, ignore_index=True).drop_duplicates('tagID', keep='last')
+            artist_tags_df = artist_tags_df.merge(tags[['tagID', 'tagValue']], on='tagID')
+
+        owners = np.array(
+            [code_of.get(artist_id, -1) for artist_id in artist_tags_df['artistID'].tolist()], dtype=np.int64
+        )
+        values = artist_tags_df['tagValue'].astype(str).to_numpy()[owners >= 0]
+        owners = owners[owners >= 0]
+
+        tag_code_of = self._tag_code_map()
+        unseen = list(dict.fromkeys(value for value in values.tolist() if value not in tag_code_of))
+        if unseen:
+            tag_code_of.update(zip(unseen, range(len(self.tag_names), len(self.tag_names) + len(unseen))))
+            unseen = np.array(unseen, dtype=str)
+            self.tag_names = append(self._buffers, 'tag_names', self.tag_names, unseen)
+            self.tag_vocab = append(self._buffers, 'tag_vocab', self.tag_vocab, np.char.lower(unseen))
+        tag_codes = np.array([tag_code_of[value] for value in values.tolist()], dtype=np.int64)
+        return owners, tag_codes
+
+    def _append_artists(self, artists):
+        """Append new artists to the artist fields and their songs' features"""
+        if len(artists) == 0:
+            return
+        names = pd.array(artists['name'].astype(str), dtype='str')
+        self.artist_ids = append(self._buffers, 'artist_ids', self.artist_ids, artists['id'].to_numpy(dtype=np.int32))
+        added = {'artist_names': names, 'artist_urls': pd.array(artists['url'], dtype='str')}
+        # A new dict: worker copies share the one they were made with
+        self.added_artist_fields = {
+            name: append(self._buffers, name, values, added[name].to_numpy())
+            for name, values in self.added_artist_fields.items()
+        }
+        self.song_features = append(
+            self._buffers, 'song_features', self.song_features, self._draw_features(len(artists) * len(SONG_TYPES))
+        )
+        self.artist_keys = append(
+            self._buffers, 'artist_keys', self.artist_keys, np.char.lower(names.to_numpy().astype(str))
+        )
+
+    def _append_artist_tags(self, owners, tag_codes, n_artists):
+        """Add tag assignments to the per-artist tags and the tag -> artists postings
+
+        Artists from code n_artists on, added by this update, get theirs
+        stored after the others in artist_tag_ids; older artists get them
+        in the delta_tag_* lists. The postings they add go to the
+        delta_posting_* lists.
+        """
+        order = np.argsort(owners, kind='stable')
+        owners, tag_codes = owners[order], tag_codes[order]
+        new = owners >= n_artists
+
+        n_added = len(self.artist_ids) - n_artists
+        if n_added:
+            lengths = np.bincount(owners[new] - n_artists, minlength=n_added)
+            self.artist_tag_ptr = append(
+                self._buffers, 'artist_tag_ptr', self.artist_tag_ptr, self.artist_tag_ptr[-1] + np.cumsum(lengths)
             )
+            self.artist_tag_ids = append(
+                self._buffers, 'artist_tag_ids', self.artist_tag_ids, tag_codes[new].astype(np.int32)
+            )
+
+        if not new.all():
+            # After the tags older updates gave the same artists
+            tag_artists = np.concatenate([
+                np.repeat(self.delta_tag_artists, np.diff(self.delta_tag_ptr)), owners[~new]
+            ])
+            order = np.argsort(tag_artists, kind='stable')
+            self.delta_tag_artists, lengths = np.unique(tag_artists, return_counts=True)
+            self.delta_tag_ptr = np.concatenate([[0], np.cumsum(lengths)])
+            self.delta_tag_ids = np.concatenate([self.delta_tag_ids, tag_codes[~new]])[order].astype(np.int32)
+
+        if len(owners):
+            self._add_postings(owners, tag_codes)
+
+    def _add_postings(self, owners, tag_codes):
+        """Count new (artist, tag) assignments into the delta_posting_* lists"""
+        postings, counts = np.unique((tag_codes.astype(np.int64) << 32) | owners, return_counts=True)
+        tags, artists = postings >> 32, postings & 0xFFFFFFFF
+
+        # Whether the stored postings of the tag lack the artist
+        missing = np.ones(len(postings), dtype=bool)
+        stored = np.flatnonzero(tags < len(self.tag_artist_indptr) - 1)
+        starts, ends = self.tag_artist_indptr[tags[stored]], self.tag_artist_indptr[tags[stored] + 1]
+        positions = starts + np.array([
+            np.searchsorted(self.tag_artist_indices[start:end], artist)
+            for start, end, artist in zip(starts, ends, artists[stored])
+        ], dtype=np.int64)
+        found = positions < ends
+        found[found] = self.tag_artist_indices[positions[found]] == artists[stored][found]
+        missing[stored[found]] = False
+
+        # Merged with the postings of older updates, in (tag, artist) order
+        old = (np.repeat(self.delta_posting_tags, np.diff(self.delta_posting_ptr)) << 32) | self.delta_posting_artists
+        postings, inverse = np.unique(np.concatenate([old, postings]), return_inverse=True)
+        tags, per_tag = np.unique(postings >> 32, return_counts=True)
+        self.delta_posting_tags = tags
+        self.delta_posting_ptr = np.concatenate([[0], np.cumsum(per_tag)])
+        self.delta_posting_artists = (postings & 0xFFFFFFFF).astype(np.int32)
+        self.delta_posting_counts = np.bincount(
+            inverse, weights=np.concatenate([self.delta_posting_counts, counts]), minlength=len(postings)
+        ).astype(np.int32)
+        new = np.empty(len(postings), dtype=bool)
+        new[inverse] = np.concatenate([self.delta_posting_new, missing])
+        self.delta_posting_new = new
+
+    def _update_mood_rows(self, artists, rows, n_songs):
+        """Rescore the given song rows and move them within the heads of the mood orders
+
+        Rows from n_songs on, the songs of new artists, extend mood_scores;
+        the others go to delta_mood_scores.
+        """
+        counts = self._artist_tag_counts(artists)
+        used = np.unique(counts.indices)
+        scores = compute_mood_scores(
+            self._features_frame(rows), self.mood_categories,
+            artist_tags=(np.searchsorted(artists, self._song_artists(rows)), self.tag_names[used], counts[:, used])
+        ).to_numpy(dtype=np.float32)
+        n_moods = scores.shape[1]
+
+        # Lowest score each head held, among the songs before the update
+        heads = [self.mood_order[:, j][self.mood_order[:, j] >= 0] for j in range(n_moods)]
+        floors = [self._mood_values(head[:1], j)[0] for j, head in enumerate(heads)]
+
+        changed = rows < n_songs
+        if not changed.all():
+            self.mood_scores = append(self._buffers, 'mood_scores', self.mood_scores, scores[~changed])
+        if changed.any():
+            kept = ~np.isin(self.delta_mood_rows, rows[changed])
+            delta_rows = np.concatenate([self.delta_mood_rows[kept], rows[changed]])
+            order = np.argsort(delta_rows, kind='stable')
+            self.delta_mood_rows = delta_rows[order]
+            self.delta_mood_scores = np.concatenate([self.delta_mood_scores[kept], scores[changed]])[order]
+
+        # Drop the changed rows from each head, then insert those that rank
+        # in it at the position of their new score among the unchanged ones
+        depth = min(MOOD_ORDER_DEPTH, self.n_songs)
+        mood_order = np.full((depth, n_moods), -1, dtype=np.int32, order='F')
+        for j, head in enumerate(heads):
+            kept = head[~np.isin(head, rows)]
+            order = np.argsort(scores[:, j], kind='stable')
+            if len(head) < n_songs:
+                # Unchanged songs below the head are unknown: only changed
+                # songs scoring above them can join
+                order = order[scores[order, j] >= floors[j]]
+            positions = np.searchsorted(self._mood_values(kept, j), scores[order, j], side='right')
+            merged = np.insert(kept, positions, rows[order])[-depth:]
+            if len(merged) < depth // 2:
+                merged = self._scan_mood_top(j, depth)
+            mood_order[depth - len(merged):, j] = merged
+        self.mood_order = mood_order
+
+    def _reset_updates(self):
+        """Start over with nothing kept aside by update_catalog"""
+        self.added_artist_fields = {name: np.empty(0, dtype=object) for name in ARTIST_FIELDS.values()}
+        self.delta_tag_artists = np.empty(0, dtype=np.int64)
+        self.delta_tag_ptr = np.zeros(1, dtype=np.int64)
+        self.delta_tag_ids = np.empty(0, dtype=np.int32)
+        self.delta_posting_tags = np.empty(0, dtype=np.int64)
+        self.delta_posting_ptr = np.zeros(1, dtype=np.int64)
+        self.delta_posting_artists = np.empty(0, dtype=np.int32)
+        self.delta_posting_counts = np.empty(0, dtype=np.int32)
+        self.delta_posting_new = np.empty(0, dtype=bool)
+        self.delta_mood_rows = np.empty(0, dtype=np.int64)
+        self.delta_mood_scores = np.empty((0, len(self.mood_categories)), dtype=np.float32)
+
+    def _merge_updates(self):
+        """Fold what update_catalog kept aside into the catalog arrays
+
+        Costs the size of the catalog, so it runs when the catalog is saved,
+        rebuilt or rescored rather than on every update. Merged arrays are
+        new ones: worker copies keep theirs.
+        """
+        for name, added in self.added_artist_fields.items():
+            if len(added):
+                values = np.concatenate([getattr(self, name).to_numpy(), added])
+                setattr(self, name, pd.array(values, dtype='str'))
+        if len(self.delta_mood_rows):
+            mood_scores = np.array(self.mood_scores, order='F')
+            mood_scores[self.delta_mood_rows] = self.delta_mood_scores
+            self.mood_scores = mood_scores
+        if self.similarity_index is not None:
+            self.similarity_index = self.similarity_index.merged()
+            self.tfidf_matrix = self.similarity_index.tfidf_matrix
+
+        ptr, ids = self._artist_tags()
+        rebuild_postings = len(self.delta_posting_tags) > 0
+        self._reset_updates()
+        self.artist_tag_ptr, self.artist_tag_ids = ptr.astype(np.int64, copy=False), ids.astype(np.int32, copy=False)
+        if rebuild_postings:
+            self._build_tag_postings()
+
+    def _schedule_rebuild(self, background=True):
+        """Run rebuild_catalog now or in a background thread, unless one is running"""
+        if not background:
+            self.rebuild_catalog()
+        elif self.rebuild_thread is None or not self.rebuild_thread.is_alive():
+            self.rebuild_thread = threading.Thread(target=self.rebuild_catalog, daemon=True)
+            self.rebuild_thread.start()
+
+    def rebuild_catalog(self):
+        """Merge the updates, refit TF-IDF and rebuild the similarity index
+
+        Everything is built on a copy and swapped in with one update of the
+        instance dict, so a query reads either the old or the new catalog;
+        the merged arrays hold the same values as the arrays and deltas they
+        replace. If update_catalog changes the catalog meanwhile, the result
+        is dropped and the rebuild starts over.
+        """
+        while True:
+            with self._update_lock:
+                version = self._catalog_version
+                fresh = copy.copy(self)
+            fresh._merge_updates()
+            fresh._fit_tfidf()
+            fresh._build_similarity_index()
+
+            with self._update_lock:
+                if version == self._catalog_version:
+                    names = INDEX_ARRAYS + list(ARTIST_FIELDS.values()) + UPDATE_DELTAS + [
+                        'vectorizer', 'tfidf_matrix', 'stale_songs', 'similarity_index'
+                    ]
+                    # The lookups cached hybrid candidates from the old similarity index
+                    self.__dict__.update({name: fresh.__dict__[name] for name in names}, _lookup_cache={})
+                    return
+
+    def _make_similarity_index(self):
+        """Create the configured similarity backend over the TF-IDF matrix"""
+        self.similarity_index = make_similarity_index(self.similarity, self.tfidf_matrix, **self.similarity_params)
+        return self.similarity_index
+
+    def _build_similarity_index(self):
+        """Build the similarity backend used by recommend_similar_songs"""
+        print(f"Building {self.similarity} similarity index...")
+        self._make_similarity_index().build()
+
+    def _build_query_index(self):
+        """Build the arrays the recommend_* methods score and look up tags with"""
+        # The best songs of each mood in ascending order of score, so a query
+        # can start from the top of the ranking instead of scanning the catalog
+        depth = min(MOOD_ORDER_DEPTH, len(self.mood_scores))
+        self.mood_order = np.empty((depth, self.mood_scores.shape[1]), dtype=np.int32, order='F')
+        for j in range(self.mood_scores.shape[1]):
+            self.mood_order[:, j] = self._scan_mood_top(j, depth)
+
+        self.tag_vocab = np.array([tag.lower() for tag in self.tag_names], dtype=str)
+        self._build_tag_postings()
+        self.artist_keys = np.char.lower(self.artist_names.to_numpy().astype(str))
+
+        self._allocate_query_buffers()
+
+    def _build_tag_postings(self):
+        """Inverted index: tag -> artists and how often each was given the tag"""
+        tag_artists = self._artist_tag_counts().T.tocsr()
+        self.tag_artist_indptr = tag_artists.indptr.astype(np.int64)
+        self.tag_artist_indices = tag_artists.indices.astype(np.int32)
+        self.tag_artist_counts = tag_artists.data.astype(np.int32)
+
+    def worker_copy(self):
+        """Shallow copy sharing the loaded catalog, with its own query buffers and generator
+
+        Queries write into per-instance buffers, so every thread answering
+        queries concurrently needs its own copy.
+        """
+        worker = copy.copy(self)
+        worker.rng = np.random.default_rng(self.rng.bit_generator.seed_seq.spawn(1)[0])
+        worker._allocate_query_buffers()
+        return worker
+
+    def _allocate_query_buffers(self, size=MOOD_POOL_FACTOR * 5):
+        """Allocate the scoring buffers reused by every query, for pools of up to size songs"""
+        self._score_buf = np.empty(size, dtype=np.float64)
+        self._work_buf = np.empty(size, dtype=np.float64)
+        self._boost_buf = np.empty(size, dtype=np.float64)
+        self._mask_buf = np.empty(size, dtype=bool)
+        self._lookup_cache = {}
+
+    def _reserve_query_buffers(self, size):
+        """Grow the scoring buffers when a query scores a larger pool than they hold"""
+        if size > len(self._score_buf):
+            lookup_cache = self._lookup_cache
+            self._allocate_query_buffers(size)
+            self._lookup_cache = lookup_cache
+
+    def _top_k(self, scores, k):
+        """Indices of the k largest scores, best first
+
+        Partitions a copy in the preallocated work buffer to find the k-th
+        largest value, so only the selected indices are newly allocated.
+        """
+        n = len(scores)
+        k = min(k, n)
+        if k <= 0:
+            return np.empty(0, dtype=np.intp)
+
+        work = self._work_buf[:n]
+        np.copyto(work, scores)
+        work.partition(n - k)
+
+        mask = self._mask_buf[:n]
+        np.greater_equal(scores, work[n - k], out=mask)
+        candidates = np.flatnonzero(mask)
+        return candidates[np.argsort(-scores[candidates], kind='stable')[:k]]
+
+    def _result_frame(self, rows, columns, **scores):
+        """Build the output DataFrame for the selected song rows only"""
+        data = {
+            column: scores[column] if column in scores else self._column(column, rows)
+            for column in columns
+        }
+        return pd.DataFrame(data, index=rows)
+
+    def _column(self, column, rows):
+        """Values of one song column for the given rows, generating the derived ones"""
+        if column == 'song_name':
+            return self.song_names(rows)
+        if column == 'tags':
+            return self._tag_lists(self._song_artists(rows))
+        if column == 'youtube_search_link':
+            # Percent-encoding works per character, so the query can be encoded in one piece
+            names = self._column('artist_name', rows)
+            return [
+                YOUTUBE_SEARCH_URL + quote(f'{song_name} {name}')
+                for song_name, name in zip(self.song_names(rows), names)
+            ]
+
+        if column == 'variant':
+            return (np.asarray(rows) % len(SONG_TYPES)).astype(np.int8)
+        if column == 'artist_id':
+            return self.artist_ids.take(self._song_artists(rows))
+        if column in ARTIST_FIELDS:
+            return self._artist_field(ARTIST_FIELDS[column], self._song_artists(rows))
+        return self.song_features[rows, list(FEATURE_RANGES).index(column)]
+
+    def _artist_field(self, name, artists):
+        """Values of one of ARTIST_FIELDS for the given artist codes
+
+        Taking from an Arrow array of several chunks would concatenate them
+        first, so the values of artists added since the catalog was built
+        or merged are taken from added_artist_fields separately.
+        """
+        values, added = getattr(self, name), self.added_artist_fields[name]
+        if len(added) == 0:
+            return values.take(artists)
+        stored = artists < len(values)
+        taken = np.empty(len(artists), dtype=object)
+        taken[stored] = values.take(artists[stored]).to_numpy()
+        taken[~stored] = added[artists[~stored] - len(values)]
+        return pd.array(taken, dtype='str')
+
+    def song_names(self, rows):
+        """'<artist> - <song type>' names of the given song rows"""
+        names = self._column('artist_name', rows).to_numpy()
+        variants = self._column('variant', rows)
+        return [f'{name} - {SONG_TYPES[variant]}' for name, variant in zip(names, variants)]
+
+    @property
+    def n_songs(self):
+        """Number of songs in the catalog"""
+        return len(self.song_features)
+
+    @property
+    def songs_df(self):
+        """The song table as stored (STORED_COLUMNS), built from the catalog arrays on each access"""
+        return self.songs_frame(columns=STORED_COLUMNS)
+
+    def _features_frame(self, rows=None):
+        """Features of all or some song rows as a DataFrame, as compute_mood_scores takes them"""
+        features = self.song_features if rows is None else self.song_features[rows]
+        return pd.DataFrame(features, columns=list(FEATURE_RANGES), copy=False)
+
+    def songs_frame(self, rows=None, columns=SONG_COLUMNS):
+        """Full song table with the generated columns, for all or some song rows"""
+        rows = np.arange(self.n_songs) if rows is None else np.asarray(rows)
+        return self._result_frame(rows, columns)
+
+    def _result_frames(self, row_groups, columns, **score_groups):
+        """Build one output DataFrame per group of rows from a single combined frame"""
+        if not row_groups:
+            return []
+        combined = self._result_frame(
+            np.concatenate(row_groups), columns,
+            **{name: np.concatenate(groups) for name, groups in score_groups.items()}
+        )
+        bounds = np.cumsum([0] + [len(rows) for rows in row_groups])
+        return [combined.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def _songs_of_artist(self, artist_name):
+        """Song rows of the artists whose name contains artist_name"""
+        key = ('artist', artist_name.lower())
+        rows = self._lookup_cache.get(key)
+        if rows is None:
+            artists = np.flatnonzero(np.char.find(self.artist_keys, key[1]) >= 0)
+            rows = self._cache_lookup(key, self._artist_song_rows(artists))
+        return rows
+
+    @staticmethod
+    def _song_artists(rows):
+        """Artist code of every given song row"""
+        return np.asarray(rows) // len(SONG_TYPES)
+
+    @staticmethod
+    def _artist_song_rows(artist_codes):
+        """Song rows of the given artist codes, artist by artist"""
+        n_types = len(SONG_TYPES)
+        return (np.asarray(artist_codes, dtype=np.int64)[:, None] * n_types + np.arange(n_types)).ravel()
+
+    def _rank_songs(self, artists, similarities, n):
+        """(song rows, similarities) of the first n songs of ranked artists
+
+        A song scores its artist's similarity, so the best songs are those of
+        the best artists, taken artist by artist.
+        """
+        return self._artist_song_rows(artists)[:n], np.repeat(similarities, len(SONG_TYPES))[:n]
+
+    def _cache_lookup(self, key, value):
+        """Remember the result of a name or tag lookup"""
+        if len(self._lookup_cache) >= LOOKUP_CACHE_SIZE:
+            self._lookup_cache.clear()
+        self._lookup_cache[key] = value
+        return value
+
+    def _matching_tags(self, tag):
+        """Ids of the tags containing the given text"""
+        key = ('tag', tag.lower())
+        tag_ids = self._lookup_cache.get(key)
+        if tag_ids is None:
+            # Substring match runs over the tag vocabulary, not over the songs
+            tag_ids = self._cache_lookup(key, np.flatnonzero(np.char.find(self.tag_vocab, key[1]) >= 0))
+        return tag_ids
+
+    def _sample_tag_songs(self, tag, n):
+        """Up to n distinct song rows drawn at random among the songs of artists with a matching tag
+
+        Positions are drawn in the posting segments of the matching tags, each
+        posting standing for its artist's songs, so the set of matching songs
+        is never built. An artist holding several matching tags is that much
+        likelier to be drawn.
+        """
+        tag_ids = self._matching_tags(tag)
+        stored = tag_ids[tag_ids < len(self.tag_artist_indptr) - 1]
+        starts = self.tag_artist_indptr[stored]
+        lengths = self.tag_artist_indptr[stored + 1] - starts
+        # Artists given a matching tag by updates, past the stored postings
+        added = self._delta_postings(tag_ids, new_only=True)[0]
+        n_types = len(SONG_TYPES)
+        n_stored = int(lengths.sum())
+        n_slots = (n_stored + len(added)) * n_types
+        if n_slots == 0:
+            return np.empty(0, dtype=np.int64)
+
+        slots = self.rng.choice(n_slots, size=min(n, n_slots), replace=False)
+        postings, variants = np.divmod(slots, n_types)
+        # Positions past the stored postings draw from the added ones
+        in_stored = postings < n_stored if len(added) else slice(None)
+        ends = np.cumsum(lengths)
+        segments = np.searchsorted(ends, postings[in_stored], side='right')
+        artists = np.empty(len(postings), dtype=np.int64)
+        artists[in_stored] = self.tag_artist_indices[
+            starts[segments] + postings[in_stored] - (ends[segments] - lengths[segments])
+        ]
+        if len(added):
+            artists[~in_stored] = added[postings[~in_stored] - n_stored]
+        rows = pd.unique(artists * n_types + variants)
+        if len(rows) == len(slots):
+            return rows
+
+        # Some draws hit the same artist through two tags: draw again among the distinct songs
+        artists = np.unique(np.concatenate([
+            _gather_segments(self.tag_artist_indptr, self.tag_artist_indices, stored), added
+        ]))
+        rows = self._artist_song_rows(artists)
+        return self.rng.choice(rows, size=min(n, len(rows)), replace=False)
+
+    def _tag_artist_weights(self, tag):
+        """(artist codes, tag assignments) of the artists with a tag containing the given text
+
+        An artist's weight counts how often it was given any matching tag;
+        codes come out sorted.
+        """
+        tag_ids = self._matching_tags(tag)
+        stored = tag_ids[tag_ids < len(self.tag_artist_indptr) - 1]
+        added_artists, added_counts = self._delta_postings(tag_ids)
+        artists = np.concatenate([
+            _gather_segments(self.tag_artist_indptr, self.tag_artist_indices, stored), added_artists
+        ])
+        counts = np.concatenate([
+            _gather_segments(self.tag_artist_indptr, self.tag_artist_counts, stored), added_counts
+        ])
+        artists, inverse = np.unique(artists, return_inverse=True)
+        return artists, np.bincount(inverse, weights=counts, minlength=len(artists))
+
+    def _delta_postings(self, tag_ids, new_only=False):
+        """(artist codes, assignment counts) update_catalog added to the postings of the given tags
+
+        With new_only, only the artists missing from the stored postings.
+        """
+        if len(self.delta_posting_tags) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32)
+        positions, found = _positions_in(self.delta_posting_tags, tag_ids)
+        ptr = self.delta_posting_ptr
+        artists = _gather_segments(ptr, self.delta_posting_artists, positions[found]).astype(np.int64)
+        counts = _gather_segments(ptr, self.delta_posting_counts, positions[found])
+        if new_only:
+            new = _gather_segments(ptr, self.delta_posting_new, positions[found])
+            return artists[new], counts[new]
+        return artists, counts
 
     def _calculate_song_mood_score(self, song, mood):
-        """Calculate mood score for a song based on its features and tags"""
+        """Calculate mood score for a song based on its features and tags
+
+        Row-wise reference for mood_scoring.compute_mood_scores, kept for
+        checking and benchmarking the vectorized engine.
+        """
         # Initialize base score from audio features
         score = 0
         
@@ -199,6 +1153,7 @@ class MusicRecommender:
         
         return score
 
+    @span('recommend_songs')
     def recommend_songs(self, query_type, query_value, n_recommendations=5):
         """Recommend songs based on query type and value"""
         try:
@@ -208,6 +1163,8 @@ class MusicRecommender:
                 return self.recommend_similar_songs(query_value, n_recommendations)
             elif query_type == 'tag':
                 return self.recommend_by_tag(query_value, n_recommendations)
+            elif query_type == 'user':
+                return self.recommend_for_user(query_value, n_recommendations)
             else:
                 print(f"Unknown query type: {query_type}")
                 return pd.DataFrame()
@@ -216,70 +1173,508 @@ class MusicRecommender:
             print(f"Error recommending songs: {str(e)}")
             return pd.DataFrame()
 
+    @span('recommend_batch')
+    def recommend_batch(self, queries, n_recommendations=5):
+        """Recommend songs for many (query_type, query_value) pairs at once
+
+        Queries are grouped by type and each group is scored as a matrix.
+        Returns one DataFrame per query, in input order.
+        """
+        results = [pd.DataFrame() for _ in queries]
+        groups = {}
+        for position, (query_type, _) in enumerate(queries):
+            groups.setdefault(query_type, []).append(position)
+        
+        for query_type, positions in groups.items():
+            values = [queries[position][1] for position in positions]
+            try:
+                if query_type == 'mood':
+                    frames = self._recommend_moods(values, n_recommendations)
+                elif query_type == 'artist':
+                    frames = self._recommend_similar_batch(values, n_recommendations)
+                elif query_type == 'tag':
+                    frames = self._recommend_tags(values, n_recommendations)
+                elif query_type == 'user':
+                    frames = self._recommend_users(values, n_recommendations)
+                else:
+                    print(f"Unknown query type: {query_type}")
+                    continue
+            except Exception as e:
+                print(f"Error recommending songs: {str(e)}")
+                continue
+            
+            for position, frame in zip(positions, frames):
+                results[position] = frame
+        
+        return results
+
+    def _recommend_moods(self, moods, n_recommendations, block_size=MOOD_QUERY_BLOCK):
+        """Batch mood queries: boosted candidates x queries score matrices per mood
+
+        Queries of a mood are scored block_size at a time, which bounds the
+        score matrix whatever the number of queries.
+        """
+        frames = [pd.DataFrame() for _ in moods]
+        n = min(n_recommendations, self.n_songs)
+        
+        by_mood = {}
+        for position, mood in enumerate(moods):
+            if mood.lower() not in self.mood_categories:
+                print(f"Unknown mood. Available moods: {list(self.mood_categories.keys())}")
+                continue
+            by_mood.setdefault(mood.lower(), []).append(position)
+        if n == 0:
+            return frames
+        
+        for mood, mood_positions in by_mood.items():
+            mood_idx = list(self.mood_categories).index(mood)
+            candidates = self._mood_candidates(mood_idx, n)
+            mood_scores = self._mood_values(candidates, mood_idx)
+            
+            for start in range(0, len(mood_positions), block_size):
+                positions = mood_positions[start:start + block_size]
+                
+                # Each query column gets its own random boost for variety
+                final_scores = self.rng.random((len(candidates), len(positions)))
+                final_scores *= MOOD_RANDOM_BOOST
+                final_scores += mood_scores[:, None]
+                
+                top = np.argpartition(-final_scores, n - 1, axis=0)[:n]
+                order = np.argsort(-np.take_along_axis(final_scores, top, axis=0), axis=0, kind='stable')
+                top = np.take_along_axis(top, order, axis=0)
+                
+                mood_frames = self._result_frames(
+                    list(candidates[top].T), ['song_name', 'artist_name', 'mood_score', 'url'],
+                    mood_score=list(mood_scores[top].T)
+                )
+                for position, frame in zip(positions, mood_frames):
+                    frames[position] = frame
+        
+        return frames
+
+    def _recommend_tags(self, tags, n_recommendations):
+        """Batch tag queries: posting-list lookups, one combined output frame"""
+        frames = [pd.DataFrame() for _ in tags]
+        positions, picks = [], []
+        for position, tag in enumerate(tags):
+            rows = self._sample_tag_songs(tag, n_recommendations)
+            if len(rows) == 0:
+                print(f"No songs found with tag: {tag}")
+                continue
+            positions.append(position)
+            picks.append(rows)
+        
+        tag_frames = self._result_frames(picks, ['song_name', 'artist_name', 'url'])
+        for position, frame in zip(positions, tag_frames):
+            frames[position] = frame
+        return frames
+
+    def _recommend_similar_batch(self, artist_names, n_recommendations):
+        """Batch artist queries: one TF-IDF block scored against the corpus"""
+        frames = [pd.DataFrame() for _ in artist_names]
+        references = [self._reference_song(artist_name) for artist_name in artist_names]
+        positions = [i for i, song in enumerate(references) if song is not None]
+        if not positions:
+            return frames
+        
+        artists = self._song_artists([references[i] for i in positions])
+        index = self.similarity_index
+        results = [
+            self._rank_songs(similar, similarities, n_recommendations)
+            for similar, similarities in index.search_batch(
+                index.rows(artists), _artists_covering(n_recommendations), exclude=artists
+            )
+        ]
+        
+        similar_frames = self._result_frames(
+            [rows for rows, _ in results],
+            ['song_name', 'artist_name', 'similarity', 'url', 'youtube_search_link'],
+            similarity=[similarities for _, similarities in results]
+        )
+        for position, frame in zip(positions, similar_frames):
+            frames[position] = frame
+        return frames
+
+    def _recommend_users(self, user_ids, n_recommendations):
+        """Batch user queries: artist scores of a block of users in one factor product"""
+        self._require_collaborative()
+        user_ids = [int(user_id) for user_id in user_ids]
+        # Ask for a few extra in case some artists are missing from the catalog
+        results = self.collaborative.recommend_for_users(user_ids, 2 * n_recommendations)
+        frames = []
+        for user_id, (artist_ids, scores) in zip(user_ids, results):
+            if len(artist_ids) == 0:
+                print(f"No listening history for user: {user_id}")
+                frames.append(pd.DataFrame())
+            else:
+                frames.append(self._artist_result_frame(artist_ids, scores, 'score', n_recommendations))
+        return frames
+
+    @span('recommend_by_mood')
     def recommend_by_mood(self, mood, n_recommendations=5):
         """Recommend songs based on mood"""
         if mood.lower() not in self.mood_categories:
             print(f"Unknown mood. Available moods: {list(self.mood_categories.keys())}")
             return pd.DataFrame()
         
-        mood_col = f'mood_{mood.lower()}'
+        mood_idx = list(self.mood_categories).index(mood.lower())
+        n = min(n_recommendations, self.n_songs)
+        if n == 0:
+            return pd.DataFrame()
+        candidates = self._mood_candidates(mood_idx, n)
+        self._reserve_query_buffers(len(candidates))
         
-        # Get songs sorted by mood score and add variety
-        recommendations = self.songs_df.copy()
-        recommendations['mood_score'] = recommendations[mood_col]
+        # Score candidates into the preallocated buffer with a random boost for variety
+        final_scores = self._score_buf[:len(candidates)]
+        boosts = self._boost_buf[:len(candidates)]
+        final_scores[:] = self._mood_values(candidates, mood_idx)
+        self.rng.random(out=boosts)
+        boosts *= MOOD_RANDOM_BOOST
+        final_scores += boosts
         
-        # Add some randomness to promote variety
-        recommendations['random_boost'] = np.random.uniform(0, 0.2, len(recommendations))
-        recommendations['final_score'] = recommendations['mood_score'] + recommendations['random_boost']
+        top = candidates[self._top_k(final_scores, n)]
+        return self._result_frame(
+            top, ['song_name', 'artist_name', 'mood_score', 'url'],
+            mood_score=self._mood_values(top, mood_idx)
+        )
+
+    def _mood_candidates(self, mood_idx, n):
+        """Song rows the top n of a mood is drawn from once boosted
+
+        The pool is the MOOD_POOL_FACTOR * n best songs of the mood, read off
+        the end of its sorted order, so a query costs the same however many
+        songs score close to the top.
+        """
+        return self._mood_top(mood_idx, MOOD_POOL_FACTOR * n)
+
+    def _mood_top(self, mood_idx, m):
+        """The m best song rows of a mood in ascending order of score
+
+        Read off the head of the ranking in mood_order, whose columns are
+        padded with -1 in front once updates push songs out of them, or
+        scanned from mood_scores when m reaches past the head.
+        """
+        order = self.mood_order[:, mood_idx]
+        start = len(order) - m
+        if start >= 0 and order[start] >= 0:
+            return order[start:]
+        if order[0] >= 0 and len(order) == len(self.mood_scores):
+            return order
+        return self._scan_mood_top(mood_idx, m)
+
+    def _scan_mood_top(self, mood_idx, m):
+        """The m best song rows of a mood in ascending order of score, from every song"""
+        scores = self.mood_scores[:, mood_idx]
+        if len(self.delta_mood_rows):
+            scores = scores.copy()
+            scores[self.delta_mood_rows] = self.delta_mood_scores[:, mood_idx]
+        kth = max(len(scores) - m, 0)
+        top = np.sort(np.argpartition(scores, kth)[kth:]).astype(np.int32)
+        return top[np.argsort(scores[top], kind='stable')]
+
+    def _mood_values(self, rows, mood_idx):
+        """Mood scores of the given song rows, those rescored by updates included"""
+        values = self.mood_scores[rows, mood_idx]
+        if len(self.delta_mood_rows):
+            positions, found = _positions_in(self.delta_mood_rows, rows)
+            values[found] = self.delta_mood_scores[positions[found], mood_idx]
+        return values
+
+    def _reference_song(self, artist_name):
+        """Random song row of an artist whose name contains artist_name, or None"""
+        artist_songs = self._songs_of_artist(artist_name)
+        if len(artist_songs) == 0:
+            print(f"No songs found for artist: {artist_name}")
+            return None
         
-        return recommendations.nlargest(n_recommendations, 'final_score')[
-            ['song_name', 'artist_name', 'mood_score', 'url']
-        ]
+        return self.rng.choice(artist_songs)
 
+    @span('recommend_similar_songs')
     def recommend_similar_songs(self, artist_name, n_recommendations=5):
         """Recommend similar songs based on artist and song features"""
-        artist_songs = self.songs_df[
-            self.songs_df['artist_name'].str.contains(artist_name, case=False)
-        ]
+        # Get a random song from the matching artists as reference
+        reference_song = self._reference_song(artist_name)
+        if reference_song is None:
+            return pd.DataFrame()
         
+        # Get recommendations excluding the reference song's artist: songs
+        # share their artist's TF-IDF row, so artists are ranked, then their songs
+        index = self.similarity_index
+        artist = self._song_artists(reference_song)
+        artists, similarities = index.search(
+            index.rows(artist), _artists_covering(n_recommendations), exclude=artist
+        )
+        rows, similarities = self._rank_songs(artists, similarities, n_recommendations)
+        
+        return self._result_frame(
+            rows, ['song_name', 'artist_name', 'similarity', 'url', 'youtube_search_link'],
+            similarity=similarities
+        )
+
+    @span('load_collaborative')
+    def load_collaborative(self, model_dir=CF_DIR, retrain=False, **params):
+        """Load the collaborative model, training and saving it if it is missing or stale
+
+        params are passed to CollaborativeModel when training.
+        """
+        model = CollaborativeModel(**params)
+        if not retrain and CollaborativeModel.is_fresh(model_dir):
+            model.load(model_dir)
+        else:
+            if self.user_artists_df is None:
+                self.user_artists_df = read_table("user_artists.dat")
+            print("Training collaborative model...")
+            model.fit(self.user_artists_df)
+            print(f"Trained in {model.train_seconds:.1f} s")
+            model.save(model_dir)
+
+        self._map_collaborative_artists(model)
+        self.collaborative = model
+        return model
+
+    def _require_collaborative(self):
+        """Fail clearly when no collaborative model is loaded
+
+        Queries never train the model themselves: training takes seconds and
+        would run on whichever scoring thread asked first, in a worker copy
+        the model would not be shared from. Call load_collaborative once,
+        before serving or making worker copies.
+        """
+        if self.collaborative is None:
+            raise RuntimeError("Collaborative model is not loaded: call load_collaborative() first")
+
+    def _map_collaborative_artists(self, model, artists=None):
+        """Link the artists of the collaborative model and of the catalog
+
+        Given the codes of artists appended to the catalog, links those only.
+        """
+        if artists is not None:
+            positions, found = _positions_in(model.artist_ids, self.artist_ids[artists])
+            self.cf_artist_index = append(
+                self._buffers, 'cf_artist_index', self.cf_artist_index, np.where(found, positions, -1)
+            )
+            if found.any():
+                cf_artist_rows = self.cf_artist_rows.copy()
+                cf_artist_rows[positions[found]] = artists[found] * len(SONG_TYPES)
+                self.cf_artist_rows = cf_artist_rows
+            return
+
+        # First catalog song of every model artist, -1 for artists not in the catalog
+        first_rows = np.arange(len(self.artist_ids)) * len(SONG_TYPES)
+        codes = pd.Index(self.artist_ids).get_indexer(model.artist_ids)
+        self.cf_artist_rows = np.where(codes >= 0, first_rows[codes], -1)
+
+        # And the other way round: model artist of every catalog artist code, -1 if unknown
+        self.cf_artist_index = np.full(len(first_rows), -1, dtype=np.int64)
+        self.cf_artist_index[codes[codes >= 0]] = np.flatnonzero(codes >= 0)
+
+    def _artist_result_frame(self, artist_ids, scores, score_column, n):
+        """Artist name, url and score of the first n model artists found in the catalog"""
+        codes = np.searchsorted(self.collaborative.artist_ids, artist_ids)
+        rows = self.cf_artist_rows[codes]
+        keep = rows >= 0
+        rows, scores = rows[keep][:n], scores[keep][:n]
+        return self._result_frame(rows, ['artist_name', 'url', score_column], **{score_column: scores})
+
+    @span('recommend_similar_artists')
+    def recommend_similar_artists(self, artist_name, n_recommendations=5):
+        """Artists played by the same listeners as an artist whose name contains artist_name"""
+        self._require_collaborative()
+        artist_songs = self._songs_of_artist(artist_name)
         if len(artist_songs) == 0:
             print(f"No songs found for artist: {artist_name}")
             return pd.DataFrame()
-        
-        # Get a random song from the artist as reference
-        reference_song = artist_songs.sample(1).index[0]
-        
-        # Calculate similarities
-        similarities = cosine_similarity(
-            self.tfidf_matrix[reference_song:reference_song+1],
-            self.tfidf_matrix
-        )[0]
-        
-        # Get recommendations excluding the same artist
-        recommendations = self.songs_df.copy()
-        recommendations['similarity'] = similarities
-        recommendations = recommendations[
-            recommendations['artist_name'].str.lower() != artist_name.lower()
-        ]
-        
-        return recommendations.nlargest(n_recommendations, 'similarity')[
-            ['song_name', 'artist_name', 'similarity', 'url', 'youtube_search_link']
-        ]
 
+        artist_id = self.artist_ids[self._song_artists(artist_songs[0])]
+        # Ask for a few extra in case some neighbours are missing from the catalog
+        artist_ids, similarities = self.collaborative.similar_artists(artist_id, 2 * n_recommendations)
+        return self._artist_result_frame(artist_ids, similarities, 'similarity', n_recommendations)
+
+    @span('recommend_for_user')
+    def recommend_for_user(self, user_id, n_recommendations=5):
+        """Artists a LastFM user has not played yet but is predicted to like"""
+        self._require_collaborative()
+        artist_ids, scores = self.collaborative.recommend_for_user(int(user_id), 2 * n_recommendations)
+        if len(artist_ids) == 0:
+            print(f"No listening history for user: {user_id}")
+            return pd.DataFrame()
+        return self._artist_result_frame(artist_ids, scores, 'score', n_recommendations)
+
+    @span('recommend_hybrid')
+    def recommend_hybrid(self, mood=None, artist=None, tag=None, user=None, n_recommendations=5,
+                         weights=None, diversity='cap', max_per_artist=1,
+                         n_candidates=FUSION_CANDIDATES):
+        """Recommend songs by fusing mood, tag similarity, collaborative and tag signals
+
+        Every given signal contributes its top n_candidates songs. All
+        candidates are then rescored on every signal, the scores are
+        min-max normalized and combined with weights (see FUSION_WEIGHTS).
+        Instead of random boosts, variety comes from diversity: 'cap' keeps
+        at most max_per_artist songs per artist, 'mmr' trades score against
+        tag similarity to songs already picked. Results are deterministic.
+        A song's tag score is how often its artist was given a matching
+        tag, so a tag contributes the songs of its most tagged artists.
+        """
+        weights = dict(FUSION_WEIGHTS, **(weights or {}))
+        candidates, signals = [], []
+
+        if mood is not None:
+            if mood.lower() not in self.mood_categories:
+                print(f"Unknown mood. Available moods: {list(self.mood_categories.keys())}")
+                return pd.DataFrame()
+            mood_idx = list(self.mood_categories).index(mood.lower())
+            candidates.append(self._mood_top(mood_idx, n_candidates))
+            signals.append('mood')
+
+        # One read of the index: rebuild_catalog and update_catalog swap it with its TF-IDF matrix
+        index = self.similarity_index
+        reference = None
+        if artist is not None:
+            similar = self._similar_candidates(artist, n_candidates, index)
+            if similar is None:
+                print(f"No songs found for artist: {artist}")
+                return pd.DataFrame()
+            similar_rows, exclude_artist = similar
+            reference = index.rows(exclude_artist)
+            candidates.append(similar_rows)
+            signals.append('similarity')
+
+        user_scores = None
+        if user is not None:
+            self._require_collaborative()
+            user_index = self.collaborative.user_index(int(user))
+            if user_index is None:
+                print(f"No listening history for user: {user}")
+                return pd.DataFrame()
+            user_scores = self.collaborative.artist_scores(user_index)
+            # Enough top artists to give about n_candidates songs
+            n_artists = max(1, n_candidates // len(SONG_TYPES))
+            artist_ids, _ = self.collaborative.top_artists(user_index, user_scores.copy(), n_artists)
+            artist_rows = self.cf_artist_rows[np.searchsorted(self.collaborative.artist_ids, artist_ids)]
+            artist_codes = self._song_artists(artist_rows[artist_rows >= 0])
+            candidates.append(self._artist_song_rows(artist_codes))
+            signals.append('collaborative')
+
+        if tag is not None:
+            tag_rows, tag_artists, tag_weights = self._tag_candidates(tag, n_candidates)
+            if len(tag_artists) == 0:
+                print(f"No songs found with tag: {tag}")
+                return pd.DataFrame()
+            candidates.append(tag_rows)
+            signals.append('tag')
+
+        if not signals:
+            print("No query given: pass a mood, artist, tag or user")
+            return pd.DataFrame()
+
+        # The union of the signals' candidates; rank orders ties by row, so hashing them in any order will do
+        rows = pd.unique(np.concatenate(candidates))
+        codes = self._song_artists(rows)
+        if reference is not None:
+            rows, codes = rows[codes != exclude_artist], codes[codes != exclude_artist]
+
+        # Rescore every candidate on every signal
+        scores = np.empty((len(rows), len(signals)))
+        for j, signal in enumerate(signals):
+            if signal == 'mood':
+                scores[:, j] = self._mood_values(rows, mood_idx)
+            elif signal == 'similarity':
+                scores[:, j] = (index.rows(codes) @ reference.T).toarray().ravel()
+            elif signal == 'collaborative':
+                # Artists without listening history score as the least liked
+                cf_index = self.cf_artist_index[codes]
+                scores[:, j] = np.where(cf_index >= 0, user_scores[cf_index], user_scores.min())
+            else:
+                positions = np.minimum(np.searchsorted(tag_artists, codes), len(tag_artists) - 1)
+                scores[:, j] = np.where(tag_artists[positions] == codes, tag_weights[positions], 0)
+
+        fused = fuse_scores(scores, [weights[signal] for signal in signals])
+        n = min(n_recommendations, len(rows))
+        # An artist has len(SONG_TYPES) songs, so the best n * len(SONG_TYPES)
+        # candidates span n artists: enough for the cap, and more than mmr_select's pool
+        order = rank(rows, fused, limit=n * len(SONG_TYPES))
+        if diversity == 'mmr':
+            top = mmr_select(order, fused, index.rows(codes), n)
+        elif diversity == 'cap':
+            top = cap_per_group(order, codes, max_per_artist)[:n]
+        else:
+            top = order[:n]
+
+        signal_columns = {signal: scores[top, j] for j, signal in enumerate(signals)}
+        return self._result_frame(
+            rows[top], ['song_name', 'artist_name', 'score', *signals, 'url'],
+            score=fused[top], **signal_columns
+        )
+
+    def _similar_candidates(self, artist, n_candidates, index):
+        """(song rows, reference artist code) of the similarity signal of recommend_hybrid, or None
+
+        The first artist whose name contains artist is the reference; the
+        rows are the songs of its most similar artists, enough to give
+        about n_candidates songs. Cached per query like the name lookups,
+        along with the index searched, so a query still running on an index
+        that was swapped out cannot leave its result for later ones.
+        """
+        key = ('similar', artist.lower(), n_candidates)
+        cached = self._lookup_cache.get(key)
+        if cached is None or cached[2] is not index:
+            artist_songs = self._songs_of_artist(artist)
+            if len(artist_songs) == 0:
+                return None
+            reference = self._song_artists(artist_songs[0])
+            similar, _ = index.search(index.rows(reference), _artists_covering(n_candidates), exclude=reference)
+            cached = self._cache_lookup(key, (self._artist_song_rows(similar), reference, index))
+        return cached[:2]
+
+    def _tag_candidates(self, tag, n_candidates):
+        """(song rows, artist codes, tag weights) of the tag signal of recommend_hybrid
+
+        The weights are those of _tag_artist_weights; the rows are the songs
+        of the most tagged artists, enough to give about n_candidates songs.
+        Cached per query like the name lookups.
+        """
+        key = ('tag candidates', tag.lower(), n_candidates)
+        cached = self._lookup_cache.get(key)
+        if cached is None:
+            tag_artists, tag_weights = self._tag_artist_weights(tag)
+            n_artists = max(1, n_candidates // len(SONG_TYPES))
+            top_artists = tag_artists[np.lexsort((tag_artists, -tag_weights))[:n_artists]]
+            cached = self._cache_lookup(key, (self._artist_song_rows(top_artists), tag_artists, tag_weights))
+        return cached
+
+    @span('recommend_by_tag')
     def recommend_by_tag(self, tag, n_recommendations=5):
         """Recommend songs based on tag/genre"""
-        # Find songs with matching tags
-        recommendations = self.songs_df[
-            self.songs_df['tag_text'].str.contains(tag, case=False)
-        ].copy()
+        # Pick a random sample of the songs with matching tags, drawn through the inverted index
+        picked = self._sample_tag_songs(tag, n_recommendations)
         
-        if len(recommendations) == 0:
+        if len(picked) == 0:
             print(f"No songs found with tag: {tag}")
             return pd.DataFrame()
         
-        # Add some randomness for variety
-        recommendations['random_score'] = np.random.uniform(0, 1, len(recommendations))
-        
-        return recommendations.nlargest(n_recommendations, 'random_score')[
-            ['song_name', 'artist_name', 'url']
-        ]
\ No newline at end of file
+        return self._result_frame(picked, ['song_name', 'artist_name', 'url'])
+
+
+def _artists_covering(n_songs):
+    """Number of artists whose songs make up n_songs songs"""
+    return -(-n_songs // len(SONG_TYPES))
+
+
+def _segment_positions(starts, lengths):
+    """Concatenated ranges start, ..., start + length - 1 of every segment"""
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(len(offsets))
+
+
+def _gather_segments(ptr, values, keys):
+    """Concatenate values[ptr[k]:ptr[k + 1]] for every k in keys"""
+    starts = ptr[keys]
+    return values[_segment_positions(starts, ptr[keys + 1] - starts)]
+
+
+def _positions_in(sorted_values, values):
+    """(positions, found): where each of values is in sorted_values, and which are there"""
+    positions = np.searchsorted(sorted_values, values)
+    found = positions < len(sorted_values)
+    found[found] = sorted_values[positions[found]] == values[found]
+    return positions, found
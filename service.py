@@ -0,0 +1,234 @@
+"""Resident recommendation service
+
+Loads the MusicRecommender and the MusicCaps table once and answers
+queries over HTTP (TCP or a Unix socket):
+
+    GET /recommend/<mood|artist|tag|user|instrumental>?q=<value>&n=<count>
+    GET /metrics[?format=prometheus]
+    GET /health
+
+Scoring runs on a bounded thread pool. Requests beyond max_pending are
+rejected with 503, and identical requests in flight share one result.
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import instrumentation
+from instrumentation import MetricsRegistry
+
+ENDPOINTS = ('mood', 'artist', 'tag', 'user', 'instrumental')
+
+# MusicRecommender method answering each endpoint. They are called directly
+# rather than through recommend_songs, which turns errors into empty results.
+RECOMMENDER_METHODS = {'mood': 'recommend_by_mood', 'artist': 'recommend_similar_songs',
+                       'tag': 'recommend_by_tag', 'user': 'recommend_for_user'}
+
+# Largest number of results a request may ask for
+MAX_N = 100
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+               405: 'Method Not Allowed', 500: 'Internal Server Error',
+               503: 'Service Unavailable'}
+
+
+class RecommendationService:
+    """Answers recommendation queries from models loaded once"""
+
+    def __init__(self, recommender, find_instrumental=None, max_workers=4, max_pending=64):
+        self.recommender = recommender
+        self.find_instrumental = find_instrumental
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scoring')
+        self.pending = 0
+        self.inflight = {}
+        self.registry = MetricsRegistry()
+        self.histograms = {endpoint: self.registry.histogram(endpoint) for endpoint in ENDPOINTS}
+        self.counters = self.registry.counters
+        self.counters.update(requests=0, coalesced=0, rejected=0, errors=0)
+        self._local = threading.local()
+
+    def _worker_recommender(self):
+        """Per-thread recommender copy, since queries write into instance buffers"""
+        recommender = getattr(self._local, 'recommender', None)
+        if recommender is None:
+            recommender = self._local.recommender = self.recommender.worker_copy()
+        return recommender
+
+    def _score(self, endpoint, value, n):
+        """Run one query on a scoring thread and return JSON-ready records"""
+        if endpoint == 'instrumental':
+            if self.find_instrumental is None:
+                raise ValueError("MusicCaps table is not loaded")
+            results = self.find_instrumental(value, n)
+        else:
+            recommender = self._worker_recommender()
+            if endpoint == 'mood' and value.lower() not in recommender.mood_categories:
+                raise ValueError(f"Unknown mood: {value}. Available moods: {', '.join(recommender.mood_categories)}")
+            results = getattr(recommender, RECOMMENDER_METHODS[endpoint])(value, n)
+        return results.to_dict(orient='records')
+
+    async def recommend(self, endpoint, value, n):
+        """Answer a query, sharing the result with identical queries in flight"""
+        key = (endpoint, value.lower(), n)
+        future = self.inflight.get(key)
+        if future is not None:
+            self.counters['coalesced'] += 1
+            return await asyncio.shield(future)
+
+        # Backpressure: refuse new work once the pool queue is full
+        if self.pending >= self.max_pending:
+            self.counters['rejected'] += 1
+            raise OverflowError("Too many pending requests")
+
+        self.pending += 1
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, self._score, endpoint, value, n)
+        self.inflight[key] = future
+        try:
+            return await asyncio.shield(future)
+        finally:
+            self.pending -= 1
+            self.inflight.pop(key, None)
+
+    def metrics(self):
+        metrics = self.registry.to_dict()
+        metrics['counters']['pending'] = self.pending
+        # Stage spans of the scoring threads, when instrumentation is on
+        if instrumentation.enabled():
+            metrics['stages'] = instrumentation.REGISTRY.to_dict()
+        return metrics
+
+    def prometheus_metrics(self):
+        return (self.registry.to_prometheus('service', label='endpoint')
+                + f"# TYPE service_pending gauge\nservice_pending {self.pending}\n"
+                + instrumentation.REGISTRY.to_prometheus())
+
+    async def handle(self, path):
+        """Route a GET path to (status, payload)"""
+        url = urlsplit(path)
+        parts = url.path.strip('/').split('/')
+
+        if url.path == '/health':
+            return 200, {'status': 'ok'}
+        if url.path == '/metrics':
+            if parse_qs(url.query).get('format') == ['prometheus']:
+                return 200, self.prometheus_metrics()
+            return 200, self.metrics()
+        if len(parts) != 2 or parts[0] != 'recommend' or parts[1] not in ENDPOINTS:
+            return 404, {'error': f"Unknown path: {url.path}"}
+
+        endpoint = parts[1]
+        params = parse_qs(url.query)
+        value = params.get('q', [''])[0]
+        try:
+            n = int(params.get('n', ['5'])[0])
+        except ValueError:
+            return 400, {'error': "n must be an integer"}
+        if not 1 <= n <= MAX_N:
+            return 400, {'error': f"n must be between 1 and {MAX_N}"}
+        if not value:
+            return 400, {'error': "Missing query parameter q"}
+
+        self.counters['requests'] += 1
+        start = time.perf_counter()
+        try:
+            results = await self.recommend(endpoint, value, n)
+        except OverflowError as e:
+            return 503, {'error': str(e)}
+        except (ValueError, KeyError) as e:
+            # Bad query values, such as a user id that is not a number
+            self.counters['errors'] += 1
+            return 400, {'error': str(e)}
+        except Exception as e:
+            self.counters['errors'] += 1
+            return 500, {'error': f"{type(e).__name__}: {e}"}
+        finally:
+            self.histograms[endpoint].observe((time.perf_counter() - start) * 1e3)
+
+        return 200, {'query': {'type': endpoint, 'value': value, 'n': n}, 'results': results}
+
+    async def handle_connection(self, reader, writer):
+        """Minimal HTTP/1.1 handling: one GET request per connection"""
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+
+            try:
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+            except ValueError:
+                status, payload = 400, {'error': "Malformed request"}
+            else:
+                if method != 'GET':
+                    status, payload = 405, {'error': "Only GET is supported"}
+                else:
+                    status, payload = await self.handle(path)
+
+            # Text payloads (Prometheus metrics) are sent as they are, everything else as JSON
+            if isinstance(payload, str):
+                body, content_type = payload.encode(), 'text/plain; version=0.0.4'
+            else:
+                body, content_type = json.dumps(payload, default=str).encode(), 'application/json'
+            writer.write(
+                f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8000, unix_path=None):
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix_path)
+            print(f"Serving recommendations on unix:{unix_path}")
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            print(f"Serving recommendations on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the resident recommendation service")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--unix', help="Serve on this Unix socket path instead of TCP")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--max-pending', type=int, default=64)
+    parser.add_argument('--no-musiccaps', action='store_true',
+                        help="Do not load the MusicCaps table for /recommend/instrumental")
+    args = parser.parse_args(argv)
+
+    from recommender import MusicRecommender
+
+    recommender = MusicRecommender()
+    recommender.load_data()
+    # Load once here so worker copies share the model instead of each loading it
+    recommender.load_collaborative()
+
+    find_instrumental = None
+    if not args.no_musiccaps:
+        from music_caps import find_music_by_mood
+        find_instrumental = find_music_by_mood
+
+    service = RecommendationService(
+        recommender, find_instrumental,
+        max_workers=args.workers, max_pending=args.max_pending
+    )
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        print("Service stopped.")
+
+
+if __name__ == '__main__':
+    main()
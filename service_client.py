@@ -0,0 +1,93 @@
+"""Load-test client for the recommendation service (service.py)"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import quote
+
+import numpy as np
+
+DEFAULT_QUERIES = {
+    'mood': ['happy', 'sad', 'relaxing', 'romantic', 'angry', 'energetic'],
+    'tag': ['rock', 'pop', 'jazz', 'indie', 'metal', 'electronic'],
+    'artist': ['Madonna', 'Coldplay', 'Radiohead', 'Muse', 'Britney Spears'],
+}
+
+
+async def fetch(path, host='127.0.0.1', port=8000, unix_path=None):
+    """GET a path and return (status, decoded JSON body)"""
+    if unix_path:
+        reader, writer = await asyncio.open_unix_connection(unix_path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+
+    head, _, body = response.partition(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    return status, json.loads(body)
+
+
+async def run_load(args):
+    """Fire args.requests queries with args.concurrency connections in flight"""
+    endpoints = args.endpoints.split(',')
+    rng = random.Random(args.seed)
+    paths = []
+    for _ in range(args.requests):
+        endpoint = rng.choice(endpoints)
+        value = rng.choice(DEFAULT_QUERIES.get(endpoint, DEFAULT_QUERIES['mood']))
+        paths.append(f"/recommend/{endpoint}?q={quote(value)}&n={args.n}")
+
+    latencies, statuses = [], {}
+    queue = asyncio.Queue()
+    for path in paths:
+        queue.put_nowait(path)
+
+    async def worker():
+        while not queue.empty():
+            path = queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                status, _ = await fetch(path, args.host, args.port, args.unix)
+            except OSError:
+                status = 'connection error'
+            latencies.append((time.perf_counter() - start) * 1e3)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    print(f"Requests: {len(paths)} in {elapsed:.2f} s ({len(paths) / elapsed:.0f} req/s)")
+    print(f"Statuses: {statuses}")
+    print("Latency ms: p50 {:.2f}, p90 {:.2f}, p99 {:.2f}, max {:.2f}".format(
+        *np.percentile(latencies, [50, 90, 99, 100])
+    ))
+
+    _, metrics = await fetch('/metrics', args.host, args.port, args.unix)
+    print("Server metrics:")
+    print(json.dumps(metrics, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--unix', help="Connect to this Unix socket instead of TCP")
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--endpoints', default='mood,tag,artist',
+                        help="Comma-separated endpoints to query")
+    parser.add_argument('-n', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    asyncio.run(run_load(args))
+
+
+if __name__ == '__main__':
+    main()
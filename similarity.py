@@ -0,0 +1,385 @@
+import os
+import copy
+import json
+import numpy as np
+import scipy.sparse as sp
+from append_buffer import append
+
+
+# Rows per chunk when search_batch selects the top of each query's similarities
+SELECT_CHUNK_ROWS = 256
+
+
+def top_k(rows, similarities, k):
+    """The k most similar (rows, similarities), most similar first"""
+    k = min(k, len(rows))
+    if k == 0:
+        return rows[:0], similarities[:0]
+    top = np.argpartition(-similarities, k - 1)[:k]
+    top = top[np.argsort(-similarities[top], kind='stable')]
+    return rows[top], similarities[top]
+
+
+def top_k_columns(similarities, k, chunk_rows=SELECT_CHUNK_ROWS):
+    """(rows, similarities) of the k largest similarities in every column of an n x q block, best first
+
+    Returns two q x k arrays. Reading a column of a row-major block is
+    slow, so the rows are reduced to the maximum of every chunk of
+    chunk_rows in one pass along the rows: the k largest values of a
+    column lie in the k chunks with the largest maxima, and only those
+    are gathered and partitioned.
+    """
+    n_rows, n_columns = similarities.shape
+    n_full = n_rows // chunk_rows
+    n_chunks = -(-n_rows // chunk_rows)
+    chunk_max = np.empty((n_chunks, n_columns), dtype=similarities.dtype)
+    similarities[:n_full * chunk_rows].reshape(n_full, chunk_rows, n_columns).max(axis=1, out=chunk_max[:n_full])
+    if n_chunks > n_full:
+        chunk_max[n_full] = similarities[n_full * chunk_rows:].max(axis=0)
+
+    m = min(k, n_chunks)
+    chunk_max = np.ascontiguousarray(chunk_max.T)
+    chunks = np.argpartition(chunk_max, n_chunks - m, axis=1)[:, n_chunks - m:]
+    rows = (chunks[:, :, None] * chunk_rows + np.arange(chunk_rows)).reshape(n_columns, -1)
+    # Rows past the end of a partial last chunk never win
+    valid = rows < n_rows
+    candidates = similarities[np.minimum(rows, n_rows - 1), np.arange(n_columns)[:, None]]
+    candidates[~valid] = -np.inf
+
+    n_candidates = candidates.shape[1]
+    top = np.argpartition(candidates, n_candidates - k, axis=1)[:, n_candidates - k:]
+    top_similarities = np.take_along_axis(candidates, top, axis=1)
+    order = np.argsort(-top_similarities, axis=1, kind='stable')
+    top = np.take_along_axis(top, order, axis=1)
+    return np.take_along_axis(rows, top, axis=1), np.take_along_axis(top_similarities, order, axis=1)
+
+
+class ExactSimilarity:
+    """Exact cosine similarity against every row of the TF-IDF matrix
+
+    The recommender keeps one TF-IDF row per artist, shared by its songs.
+    Rows are L2-normalised, so cosine similarity is one sparse
+    matrix-vector product over the whole matrix.
+
+    update appends the rows of new artists to tfidf_matrix and keeps the
+    new version of changed rows aside in delta_matrix (for the sorted rows
+    in delta_rows), which overrides tfidf_matrix until merged.
+    """
+    name = 'exact'
+
+    def __init__(self, tfidf_matrix, block_size=64):
+        self.tfidf_matrix = tfidf_matrix
+        self.block_size = block_size
+        self.delta_rows = np.empty(0, dtype=np.int64)
+        self.delta_matrix = None
+        self._buffers = {}
+
+    def build(self):
+        """Nothing to precompute for brute force"""
+        return self
+
+    def update(self, rows, row_matrix):
+        """Take the new TF-IDF rows of the given sorted rows, new or changed
+
+        Rows from tfidf_matrix.shape[0] on are appended, in order, to
+        buffers with spare capacity; the others join delta_matrix. Costs
+        the rows given, not the matrix. Update a copy to keep this index
+        unchanged: the matrices it holds are never written.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        appended = rows >= self.tfidf_matrix.shape[0]
+        if appended.any():
+            self.tfidf_matrix = self._append_rows(row_matrix[appended])
+        if not appended.all():
+            changed = rows[~appended]
+            kept = ~np.isin(self.delta_rows, changed)
+            delta_rows = np.concatenate([self.delta_rows[kept], changed])
+            blocks = [row_matrix[~appended]]
+            if self.delta_matrix is not None:
+                blocks.insert(0, self.delta_matrix[kept])
+            order = np.argsort(delta_rows, kind='stable')
+            self.delta_rows = delta_rows[order]
+            self.delta_matrix = sp.vstack(blocks, format='csr')[order]
+        return self
+
+    def _append_rows(self, row_matrix):
+        """tfidf_matrix with the rows of row_matrix added at the end"""
+        matrix = self.tfidf_matrix
+        indptr = append(self._buffers, 'indptr', matrix.indptr, row_matrix.indptr[1:] + matrix.indptr[-1])
+        return sp.csr_matrix((
+            append(self._buffers, 'data', matrix.data, row_matrix.data),
+            append(self._buffers, 'indices', matrix.indices, row_matrix.indices),
+            indptr
+        ), shape=(len(indptr) - 1, matrix.shape[1]), copy=False)
+
+    def merged(self):
+        """Copy of the index with delta_matrix folded into tfidf_matrix
+
+        Costs the size of the matrix: the recommender merges when it saves
+        or rebuilds the catalog, not on every update.
+        """
+        index = copy.copy(self)
+        if len(self.delta_rows):
+            n_rows = self.tfidf_matrix.shape[0]
+            rows = np.arange(n_rows)
+            rows[self.delta_rows] = n_rows + np.arange(len(self.delta_rows))
+            index.tfidf_matrix = sp.vstack([self.tfidf_matrix, self.delta_matrix], format='csr')[rows]
+        index.delta_rows, index.delta_matrix = np.empty(0, dtype=np.int64), None
+        index._buffers = {}
+        return index
+
+    def rows(self, rows):
+        """Current TF-IDF rows of the given row numbers, one per row"""
+        rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+        positions = np.searchsorted(self.delta_rows, rows)
+        changed = positions < len(self.delta_rows)
+        changed[changed] = self.delta_rows[positions[changed]] == rows[changed]
+        if not changed.any():
+            return self.tfidf_matrix[rows]
+        stacked = sp.vstack([self.tfidf_matrix[rows[~changed]], self.delta_matrix[positions[changed]]], format='csr')
+        order = np.empty(len(rows), dtype=np.int64)
+        order[~changed] = np.arange(np.count_nonzero(~changed))
+        order[changed] = np.count_nonzero(~changed) + np.arange(np.count_nonzero(changed))
+        return stacked[order]
+
+    def similarities(self, query_columns):
+        """Similarities of every row to an n_features x q dense block of queries"""
+        similarities = self.tfidf_matrix @ query_columns
+        if len(self.delta_rows):
+            similarities[self.delta_rows] = self.delta_matrix @ query_columns
+        return similarities
+
+    def search(self, query, k, exclude=None):
+        """Top k (rows, similarities) for a 1 x n_features query row, leaving out row exclude"""
+        similarities = self.similarities(query.toarray().ravel())
+        rows = np.arange(len(similarities))
+        if exclude is not None:
+            similarities[exclude] = -np.inf
+        rows, similarities = top_k(rows, similarities, k)
+        valid = np.isfinite(similarities)
+        return rows[valid], similarities[valid]
+
+    def search_batch(self, queries, k, exclude=None):
+        """Top k (rows, similarities) for every row of a q x n_features query matrix
+
+        Scores block_size queries at a time with one product of the matrix
+        and the dense query block, an n_rows x block_size array: the
+        similarities of a query to the catalog are nearly all nonzero, so
+        a sparse result would only be slower. exclude holds a row to leave
+        out per query, dropped from each query's top k + 1 rather than
+        masked in the scores.
+        """
+        results = []
+        n_rows = self.tfidf_matrix.shape[0]
+        k = min(k, n_rows)
+        if k == 0:
+            return [(np.empty(0, dtype=np.intp), np.empty(0)) for _ in range(queries.shape[0])]
+        m = min(k + (exclude is not None), n_rows)
+
+        for start in range(0, queries.shape[0], self.block_size):
+            block = queries[start:start + self.block_size]
+
+            top, top_similarities = top_k_columns(self.similarities(block.T.toarray()), m)
+
+            if exclude is None:
+                results.extend(zip(top, top_similarities))
+                continue
+            for rows, row_similarities, excluded in zip(top, top_similarities, exclude[start:start + self.block_size]):
+                kept = rows != excluded
+                results.append((rows[kept][:k], row_similarities[kept][:k]))
+        return results
+
+    def save(self, index_dir):
+        """Nothing to save for brute force"""
+
+    def load(self, index_dir):
+        """Nothing to load for brute force"""
+        return self
+
+
+class LSHSimilarity(ExactSimilarity):
+    """Approximate cosine similarity with random-projection LSH
+
+    Each of n_tables hash tables keys a row by the signs of n_bits random
+    projections of it. A query collects the rows in its own
+    bucket of every table plus, for n_probes > 1, the buckets reached by
+    flipping its least certain bits. Candidates are then rescored exactly.
+    More tables and probes raise recall at the cost of latency.
+
+    On the synthetic catalogs of benchmarks/bench_similarity.py (22k and
+    111k artists) the fastest setting reaching recall@10 of 0.9 runs at
+    0.7x and 1.0x the speed of the exact scan: artists share so many tags
+    that the probed buckets hold 10-25% of the catalog, and gathering and
+    rescoring those rows costs about as much as one product with all of
+    them. Exact stays the default; LSH pays off only when the buckets are
+    far narrower than that.
+
+    Rows added or changed by update are hashed into the small pending
+    tables (pending_rows, pending_codes), which candidates checks besides
+    the sorted tables until the index is merged.
+    """
+    name = 'lsh'
+
+    def __init__(self, tfidf_matrix, n_tables=8, n_bits=12, n_probes=1,
+                 seed=0, chunk_size=100_000):
+        super().__init__(tfidf_matrix)
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.n_probes = n_probes
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.planes = None
+        self.bucket_codes = None
+        self.bucket_rows = None
+        self.pending_rows = np.empty(0, dtype=np.int64)
+        self.pending_codes = np.empty((0, n_tables), dtype=np.int64)
+        self._bit_values = 1 << np.arange(n_bits, dtype=np.int64)
+
+    def _hash(self, projections):
+        """Bucket code per table from an (n, n_tables * n_bits) projection block"""
+        bits = (projections > 0).reshape(len(projections), self.n_tables, self.n_bits)
+        return bits @ self._bit_values
+
+    def build(self):
+        """Hash every row and sort each table by bucket code"""
+        rng = np.random.default_rng(self.seed)
+        n_rows, n_features = self.tfidf_matrix.shape
+        self.planes = rng.standard_normal(
+            (n_features, self.n_tables * self.n_bits)
+        ).astype(np.float32)
+
+        # Project in row chunks to bound the dense intermediate
+        codes = np.empty((n_rows, self.n_tables), dtype=np.int64)
+        for start in range(0, n_rows, self.chunk_size):
+            block = self.tfidf_matrix[start:start + self.chunk_size]
+            codes[start:start + self.chunk_size] = self._hash(block @ self.planes)
+
+        self.bucket_rows = np.asfortranarray(np.argsort(codes, axis=0, kind='stable').astype(np.int32))
+        self.bucket_codes = np.asfortranarray(np.take_along_axis(codes, self.bucket_rows, axis=0))
+        return self
+
+    def update(self, rows, row_matrix):
+        """Take the new TF-IDF rows of the given sorted rows and hash them into the pending tables"""
+        super().update(rows, row_matrix)
+        rows = np.asarray(rows, dtype=np.int64)
+        codes = self._hash(np.asarray(row_matrix @ self.planes))
+        kept = ~np.isin(self.pending_rows, rows)
+        pending_rows = np.concatenate([self.pending_rows[kept], rows])
+        order = np.argsort(pending_rows, kind='stable')
+        self.pending_rows = pending_rows[order]
+        self.pending_codes = np.concatenate([self.pending_codes[kept], codes])[order]
+        return self
+
+    def merged(self):
+        """Copy of the index with the pending rows inserted into the sorted tables"""
+        index = super().merged()
+        if len(self.pending_rows):
+            index._insert_rows(self.pending_rows, self.pending_codes)
+        index.pending_rows = np.empty(0, dtype=np.int64)
+        index.pending_codes = np.empty((0, self.n_tables), dtype=np.int64)
+        return index
+
+    def _insert_rows(self, rows, codes):
+        """Replace the entries of the given rows in the sorted tables by their codes"""
+        # Drop the old entries of changed rows, then insert every row at its bucket
+        stale = np.zeros(self.tfidf_matrix.shape[0], dtype=bool)
+        stale[rows] = True
+        n_kept = self.bucket_rows.shape[0] - np.count_nonzero(stale[self.bucket_rows[:, 0]])
+        bucket_rows = np.empty((n_kept + len(rows), self.n_tables), dtype=np.int32, order='F')
+        bucket_codes = np.empty((n_kept + len(rows), self.n_tables), dtype=np.int64, order='F')
+        for table in range(self.n_tables):
+            keep = ~stale[self.bucket_rows[:, table]]
+            kept_codes = self.bucket_codes[keep, table]
+            order = np.argsort(codes[:, table], kind='stable')
+            positions = np.searchsorted(kept_codes, codes[order, table], side='right')
+            bucket_rows[:, table] = np.insert(self.bucket_rows[keep, table], positions, rows[order])
+            bucket_codes[:, table] = np.insert(kept_codes, positions, codes[order, table])
+        self.bucket_rows, self.bucket_codes = bucket_rows, bucket_codes
+
+    def _probe_codes(self, projection):
+        """Bucket codes to visit in every table, own bucket first"""
+        projection = projection.reshape(self.n_tables, self.n_bits)
+        codes = [self._hash(projection.reshape(1, -1))[0]]
+
+        # Flip the bits whose projections were closest to the hyperplane
+        uncertain = np.argsort(np.abs(projection), axis=1)[:, :self.n_probes - 1]
+        for i in range(uncertain.shape[1]):
+            codes.append(codes[0] ^ self._bit_values[uncertain[:, i]])
+        return np.stack(codes, axis=1)
+
+    def candidates(self, query):
+        """Rows sharing a probed bucket with the query in any table"""
+        projection = np.asarray(query @ self.planes).ravel()
+        rows = []
+        probes = self._probe_codes(projection)
+        for table, codes in enumerate(probes):
+            bucket_codes = self.bucket_codes[:, table]
+            starts = np.searchsorted(bucket_codes, codes, side='left')
+            ends = np.searchsorted(bucket_codes, codes, side='right')
+            rows.extend(self.bucket_rows[s:e, table] for s, e in zip(starts, ends))
+        # The tables return most rows several times; a bitmap drops the repeats without sorting them
+        hits = np.zeros(self.tfidf_matrix.shape[0], dtype=bool)
+        hits[np.concatenate(rows)] = True
+        rows = np.flatnonzero(hits)
+        if len(self.pending_rows) == 0:
+            return rows
+
+        # Pending rows are in the sorted tables under their old codes, if at all
+        pending = (self.pending_codes[:, :, None] == probes[None]).any(axis=(1, 2))
+        return np.union1d(rows[~np.isin(rows, self.pending_rows)], self.pending_rows[pending])
+
+    def search(self, query, k, exclude=None):
+        """Approximate top k (rows, similarities) for a 1 x n_features query row, leaving out row exclude"""
+        rows = self.candidates(query)
+        if exclude is not None:
+            rows = rows[rows != exclude]
+
+        # Exact rescoring of the candidates only
+        similarities = self.rows(rows) @ query.toarray().ravel()
+        return top_k(rows, similarities, k)
+
+    def search_batch(self, queries, k, exclude=None):
+        """Approximate top k for every row of a query matrix, one lookup per row"""
+        return [
+            self.search(queries[i], k, exclude=None if exclude is None else exclude[i])
+            for i in range(queries.shape[0])
+        ]
+
+    def save(self, index_dir):
+        """Save the hash tables and their parameters"""
+        np.save(os.path.join(index_dir, 'lsh_planes.npy'), self.planes)
+        np.save(os.path.join(index_dir, 'lsh_bucket_codes.npy'), self.bucket_codes)
+        np.save(os.path.join(index_dir, 'lsh_bucket_rows.npy'), self.bucket_rows)
+        with open(os.path.join(index_dir, 'lsh.json'), 'w') as f:
+            json.dump({'n_tables': self.n_tables, 'n_bits': self.n_bits, 'n_probes': self.n_probes,
+                       'seed': self.seed}, f)
+
+    def load(self, index_dir):
+        """Memory-map hash tables written by save"""
+        with open(os.path.join(index_dir, 'lsh.json')) as f:
+            params = json.load(f)
+        self.n_tables = params['n_tables']
+        self.n_bits = params['n_bits']
+        self.n_probes = params['n_probes']
+        self.seed = params['seed']
+        self._bit_values = 1 << np.arange(self.n_bits, dtype=np.int64)
+
+        self.planes = np.load(os.path.join(index_dir, 'lsh_planes.npy'))
+        self.bucket_codes = np.load(os.path.join(index_dir, 'lsh_bucket_codes.npy'), mmap_mode='r')
+        self.bucket_rows = np.load(os.path.join(index_dir, 'lsh_bucket_rows.npy'), mmap_mode='r')
+        return self
+
+
+SIMILARITY_BACKENDS = {
+    ExactSimilarity.name: ExactSimilarity,
+    LSHSimilarity.name: LSHSimilarity,
+}
+
+
+def make_similarity_index(backend, tfidf_matrix, **params):
+    """Create an (unbuilt) similarity index by backend name"""
+    if backend not in SIMILARITY_BACKENDS:
+        raise ValueError(f"Unknown similarity backend: {backend}. "
+                         f"Available backends: {list(SIMILARITY_BACKENDS)}")
+    return SIMILARITY_BACKENDS[backend](tfidf_matrix, **params)
+
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules live at the top of the repository; the synthetic tables come from the benchmarks
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
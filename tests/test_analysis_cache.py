@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+import analysis_cache
+from analysis_cache import AnalysisCache, hash_file
+
+
+class Clock:
+    """Stands in for the time module inside analysis_cache"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(analysis_cache, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    cache = AnalysisCache(str(tmp_path / 'cache.sqlite'), ttl=60)
+    yield cache
+    cache.close()
+
+
+def test_miss_then_hit(cache):
+    assert cache.get('abc', 'mood') is None
+    cache.put('abc', 'mood', {'mood': 'happy', 'scores': np.array([0.5, 0.25])})
+    assert cache.get('abc', 'mood') == {'mood': 'happy', 'scores': [0.5, 0.25]}
+    # Another kind of result for the same video is a separate entry
+    assert cache.get('abc', 'shots') is None
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 2, 1)
+    assert stats['hit_rate'] == pytest.approx(1 / 3)
+
+
+def test_entries_expire_after_ttl(cache, clock):
+    cache.put('abc', 'mood', 'happy')
+    clock.now += 59
+    assert cache.get('abc', 'mood') == 'happy'
+    clock.now += 2
+    assert cache.get('abc', 'mood') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_other_analyzer_version_misses(tmp_path, clock):
+    path = str(tmp_path / 'cache.sqlite')
+    AnalysisCache(path, version='1').put('abc', 'mood', 'happy')
+    assert AnalysisCache(path, version='1').get('abc', 'mood') == 'happy'
+    assert AnalysisCache(path, version='2').get('abc', 'mood') is None
+
+
+def test_evicts_least_recently_used_past_max_bytes(tmp_path, clock):
+    cache = AnalysisCache(str(tmp_path / 'cache.sqlite'), max_bytes=25)
+    cache.put('a', 'mood', 'x' * 8)
+    clock.now += 1
+    cache.put('b', 'mood', 'x' * 8)
+    clock.now += 1
+    cache.get('a', 'mood')
+    clock.now += 1
+    cache.put('c', 'mood', 'x' * 8)
+
+    assert cache.get('b', 'mood') is None
+    assert cache.get('a', 'mood') is not None and cache.get('c', 'mood') is not None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_get_or_compute_computes_once_and_skips_none(cache):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return [1, 2]
+
+    assert cache.get_or_compute('abc', 'motion', compute) == [1, 2]
+    assert cache.get_or_compute('abc', 'motion', compute) == [1, 2]
+    assert len(calls) == 1
+
+    assert cache.get_or_compute('abc', 'audio', lambda: None) is None
+    assert cache.stats()['entries'] == 1
+
+
+def test_hash_file_depends_on_content_only(tmp_path):
+    (tmp_path / 'a.mp4').write_bytes(b'video' * 1000)
+    (tmp_path / 'b.mp4').write_bytes(b'video' * 1000)
+    (tmp_path / 'c.mp4').write_bytes(b'other' * 1000)
+    assert hash_file(tmp_path / 'a.mp4', chunk_size=7) == hash_file(tmp_path / 'b.mp4')
+    assert hash_file(tmp_path / 'a.mp4') != hash_file(tmp_path / 'c.mp4')
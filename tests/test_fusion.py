@@ -0,0 +1,62 @@
+import numpy as np
+import scipy.sparse as sp
+
+from fusion import cap_per_group, fuse_scores, mmr_select, normalize_columns, rank
+
+
+def test_normalize_columns_scales_to_unit_range_and_zeroes_constant_columns():
+    scores = np.array([[1.0, 5.0, 2.0], [3.0, 5.0, 4.0], [2.0, 5.0, 8.0]])
+    normalized = normalize_columns(scores)
+    np.testing.assert_allclose(normalized[:, 0], [0, 1, 0.5])
+    np.testing.assert_allclose(normalized[:, 1], 0)
+    np.testing.assert_allclose(normalized[:, 2], [0, 1 / 3, 1])
+
+
+def test_fuse_scores_is_weighted_mean_of_normalized_columns():
+    rng = np.random.default_rng(0)
+    scores = rng.random((50, 3)) * [1, 10, 100]
+    scores[:, 1] = 7.0
+    weights = [1.0, 2.0, 0.5]
+    expected = normalize_columns(scores) @ (np.array(weights) / sum(weights))
+    np.testing.assert_allclose(fuse_scores(scores, weights), expected)
+
+
+def test_rank_breaks_ties_by_row():
+    rows = np.array([40, 10, 30, 20])
+    fused = np.array([0.5, 0.9, 0.5, 0.5])
+    np.testing.assert_array_equal(rank(rows, fused), [1, 3, 2, 0])
+
+
+def test_rank_with_limit_is_start_of_full_order():
+    rng = np.random.default_rng(1)
+    rows = rng.permutation(1000)
+    # Few distinct values, so the limit falls inside a tie
+    fused = rng.integers(0, 20, 1000).astype(float)
+    full = rank(rows, fused)
+    for limit in (1, 7, 45, 999, 1000, 5000):
+        limited = rank(rows, fused, limit=limit)
+        assert len(limited) >= min(limit, len(rows))
+        np.testing.assert_array_equal(limited, full[:len(limited)])
+
+
+def test_cap_per_group_keeps_first_entries_of_each_group():
+    order = np.array([5, 3, 0, 1, 4, 2])
+    groups = np.array([0, 1, 0, 0, 1, 2])
+    np.testing.assert_array_equal(cap_per_group(order, groups, 1), [5, 3, 1])
+    np.testing.assert_array_equal(cap_per_group(order, groups, 2), [5, 3, 0, 1, 4])
+
+
+def test_mmr_select_without_novelty_follows_scores():
+    rng = np.random.default_rng(2)
+    fused = rng.random(30)
+    order = np.argsort(-fused)
+    features = rng.random((30, 4))
+    np.testing.assert_array_equal(mmr_select(order, fused, features, 5, trade_off=1.0), order[:5])
+
+
+def test_mmr_select_skips_duplicates_of_picked_candidates():
+    fused = np.array([1.0, 0.99, 0.8])
+    order = np.array([0, 1, 2])
+    # Candidates 0 and 1 are the same vector
+    features = sp.csr_matrix(np.array([[1.0, 0.0], [1.0, 0.0], [0.0, 1.0]]))
+    np.testing.assert_array_equal(mmr_select(order, fused, features, 2, trade_off=0.5), [0, 2])
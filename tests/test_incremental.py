@@ -0,0 +1,136 @@
+"""update_catalog against building the catalog from the same tables"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import recommender as recommender_module
+from mood_scoring import compute_mood_scores
+from recommender import MusicRecommender
+from synthetic import make_lastfm_tables
+
+N_ARTISTS = 400
+N_NEW = 12
+TAGS = ['rock', 'pop', 'metal', 'e']
+
+
+def build(tables, artists, artist_tags, **kwargs):
+    recommender = MusicRecommender(seed=0, **kwargs)
+    recommender.artists_df = artists
+    recommender.tags_df = tables['tags']
+    recommender.artist_tags_df = artist_tags
+    recommender.create_song_dataset()
+    recommender.process_song_features()
+    return recommender
+
+
+@pytest.fixture
+def tables():
+    return make_lastfm_tables(n_artists=N_ARTISTS)
+
+
+def make_updated(tables, tmp_path, similarity='exact'):
+    """All but the last N_NEW artists, then two updates adding them, their tags and tags for older artists"""
+    artists, assignments = tables['artists'], tables['user_taggedartists']
+    n_base = N_ARTISTS - N_NEW
+    retags = assignments[assignments['artistID'].isin(artists['id'][:n_base])].sample(150, random_state=0)
+    recommender = build(tables, artists[:n_base], assignments.drop(retags.index),
+                        similarity=similarity, index_dir=str(tmp_path))
+
+    for step, new_artists in enumerate(np.array_split(np.arange(n_base, N_ARTISTS), 2)):
+        new_artists = artists.iloc[new_artists]
+        new_tags = pd.concat([
+            assignments[assignments['artistID'].isin(new_artists['id'])],
+            retags[step * 75:(step + 1) * 75],
+        ])
+        recommender.update_catalog(new_artists, new_tags)
+    return recommender
+
+
+@pytest.fixture
+def updated(tables, tmp_path, monkeypatch):
+    # Keep the updates incremental: no drift-triggered rebuild
+    monkeypatch.setattr(recommender_module, 'REBUILD_DRIFT', float('inf'))
+    return make_updated(tables, tmp_path)
+
+
+@pytest.fixture
+def full(tables):
+    return build(tables, tables['artists'], tables['user_taggedartists'])
+
+
+def all_mood_values(recommender):
+    rows = np.arange(recommender.n_songs)
+    return np.stack([recommender._mood_values(rows, j) for j in range(len(recommender.mood_categories))], axis=1)
+
+
+def test_update_adds_artists_and_tags_as_full_build(updated, full):
+    assert updated.n_songs == full.n_songs
+    artists = np.arange(N_ARTISTS)
+    assert list(updated._artist_field('artist_names', artists)) == list(full._artist_field('artist_names', artists))
+    assert [sorted(tags) for tags in updated._tag_lists(artists)] == \
+        [sorted(tags) for tags in full._tag_lists(artists)]
+    for tag in TAGS:
+        updated_artists, updated_weights = updated._tag_artist_weights(tag)
+        full_artists, full_weights = full._tag_artist_weights(tag)
+        np.testing.assert_array_equal(updated_artists, full_artists)
+        np.testing.assert_array_equal(updated_weights, full_weights)
+
+
+def test_tag_queries_draw_from_updated_postings(updated, full):
+    for tag in TAGS:
+        artists = set(updated._sample_tag_songs(tag, updated.n_songs) // len(recommender_module.SONG_TYPES))
+        assert artists == set(full._tag_artist_weights(tag)[0].tolist())
+
+
+def test_update_rescores_moods_as_full_recomputation(updated):
+    n_songs = updated.n_songs
+    expected = compute_mood_scores(
+        updated.songs_df, updated.mood_categories,
+        artist_tags=(updated._song_artists(np.arange(n_songs)), updated.tag_names, updated._artist_tag_counts())
+    ).to_numpy(np.float32)
+    np.testing.assert_allclose(all_mood_values(updated), expected, atol=1e-6)
+
+    for j in range(expected.shape[1]):
+        top = updated._mood_top(j, 50)
+        np.testing.assert_allclose(expected[top, j], np.sort(expected[:, j])[-50:], atol=1e-6)
+
+
+def test_update_indexes_tfidf_rows_of_fitted_vectorizer(updated):
+    artists = np.arange(N_ARTISTS)
+    expected = updated.vectorizer.transform([' '.join(tags) for tags in updated._tag_lists(artists)])
+    index = updated.similarity_index
+    assert abs(index.rows(artists) - expected).max() < 1e-6
+
+    # An added artist and a retagged one against brute force
+    for artist in [N_ARTISTS - 1, int(index.delta_rows[0])]:
+        similarities = (expected @ expected[artist].T).toarray().ravel()
+        similarities[artist] = -np.inf
+        _, found = index.search(expected[artist], 5, exclude=artist)
+        np.testing.assert_allclose(found, np.sort(similarities)[::-1][:5], atol=1e-6)
+
+
+def test_rebuild_matches_full_build(updated, full):
+    moods = all_mood_values(updated)
+    updated.rebuild_catalog()
+
+    np.testing.assert_array_equal(all_mood_values(updated), moods)
+    assert len(updated.delta_mood_rows) == 0 and len(updated.similarity_index.delta_rows) == 0
+    assert abs(updated.tfidf_matrix - full.tfidf_matrix).max() < 1e-6
+    for tag in TAGS:
+        np.testing.assert_array_equal(updated._tag_artist_weights(tag)[1], full._tag_artist_weights(tag)[1])
+
+
+@pytest.mark.parametrize('similarity', ['exact', 'lsh'])
+def test_saved_index_loads_updates(tables, tmp_path, monkeypatch, similarity):
+    monkeypatch.setattr(recommender_module, 'REBUILD_DRIFT', float('inf'))
+    updated = make_updated(tables, tmp_path, similarity)
+    moods = all_mood_values(updated)
+    updated.save_index()
+
+    loaded = MusicRecommender(seed=0, similarity=similarity, index_dir=str(tmp_path))
+    loaded.load_index()
+    np.testing.assert_array_equal(all_mood_values(loaded), moods)
+    pd.testing.assert_frame_equal(loaded.songs_df, updated.songs_df)
+    assert abs(loaded.similarity_index.tfidf_matrix - updated.similarity_index.rows(np.arange(N_ARTISTS))).max() < 1e-7
+    for tag in TAGS:
+        np.testing.assert_array_equal(loaded._tag_artist_weights(tag)[1], updated._tag_artist_weights(tag)[1])
@@ -0,0 +1,46 @@
+"""Vectorized mood scoring against the row-wise reference _calculate_song_mood_score"""
+import numpy as np
+import pandas as pd
+
+from mood_scoring import compute_mood_scores
+from recommender import MusicRecommender
+from synthetic import make_recommender
+
+
+def reference_scores(recommender, songs_df):
+    return pd.DataFrame({
+        f'mood_{mood}': songs_df.apply(lambda song: recommender._calculate_song_mood_score(song, mood), axis=1)
+        for mood in recommender.mood_categories
+    })
+
+
+def test_compute_mood_scores_matches_reference():
+    recommender = make_recommender(n_artists=150)
+    songs_df = recommender.songs_frame()
+
+    scores = compute_mood_scores(songs_df, recommender.mood_categories)
+    np.testing.assert_allclose(scores.to_numpy(), reference_scores(recommender, songs_df).to_numpy(), atol=1e-9)
+
+
+def test_catalog_mood_scores_match_reference():
+    recommender = make_recommender(n_artists=150)
+    recommender.process_song_features()
+
+    expected = reference_scores(recommender, recommender.songs_frame()).to_numpy()
+    # Stored as float32
+    np.testing.assert_allclose(recommender.mood_scores, expected, atol=1e-6)
+
+
+def test_tags_matching_several_keywords_and_no_tags():
+    recommender = MusicRecommender(seed=0)
+    songs_df = pd.DataFrame({
+        'artist_id': [1, 1, 2, 3],
+        'tags': [['Happy Pop', 'sad songs', 'rock'], ['Happy Pop', 'sad songs', 'rock'], [], ['chill', 'CHILL out']],
+        'energy': [0.9, 0.1, 0.5, 0.3],
+        'valence': [0.8, 0.2, 0.5, 0.6],
+        'danceability': [0.7, 0.3, 0.5, 0.2],
+        'tempo': [150.0, 70.0, 120.0, 90.0],
+    })
+
+    scores = compute_mood_scores(songs_df, recommender.mood_categories)
+    np.testing.assert_allclose(scores.to_numpy(), reference_scores(recommender, songs_df).to_numpy(), atol=1e-12)
@@ -0,0 +1,63 @@
+"""MusicCapsIndex search against BM25 scores computed clip by clip"""
+import numpy as np
+import pytest
+
+from music_caps import ASPECT_WEIGHT, BM25_B, BM25_K1, MusicCapsIndex, tokenize
+from synthetic import make_musiccaps_table
+
+
+@pytest.fixture
+def table(tmp_path):
+    table = make_musiccaps_table(n_rows=300)
+    table.to_csv(tmp_path / 'musiccaps.csv', index=False)
+    return table
+
+
+def make_index(tmp_path):
+    return MusicCapsIndex(csv_path=str(tmp_path / 'musiccaps.csv'), index_dir=str(tmp_path / 'index'))
+
+
+def bm25_scores(table, query_terms):
+    """Score of every clip, from the definition"""
+    counts = []
+    for aspects, caption in zip(table['aspect_list'].fillna(''), table['caption'].fillna('')):
+        tf = {}
+        for terms, weight in ((tokenize(aspects), ASPECT_WEIGHT), (tokenize(caption), 1.0)):
+            for term in terms:
+                tf[term] = tf.get(term, 0) + weight
+        counts.append(tf)
+    lengths = np.array([sum(tf.values()) for tf in counts])
+
+    scores = np.zeros(len(table))
+    for term, query_weight in query_terms.items():
+        doc_freq = sum(term in tf for tf in counts)
+        idf = np.log(1 + (len(table) - doc_freq + 0.5) / (doc_freq + 0.5))
+        for row, tf in enumerate(counts):
+            if term in tf:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[row] / lengths.mean())
+                scores[row] += query_weight * idf * tf[term] * (BM25_K1 + 1) / (tf[term] + norm)
+    return scores
+
+
+@pytest.mark.parametrize('moods', ['happy', 'sad, relaxing', 'guitar'])
+def test_search_matches_bm25_definition(table, tmp_path, moods):
+    index = make_index(tmp_path)
+    rows, scores = index.search(moods, n=10)
+
+    expected = bm25_scores(table, index.query_terms(moods))
+    np.testing.assert_allclose(scores, np.sort(expected)[::-1][:10], rtol=1e-5)
+    np.testing.assert_allclose(expected[rows], scores, rtol=1e-5)
+
+
+def test_saved_index_is_memory_mapped_with_same_results(table, tmp_path):
+    built = make_index(tmp_path).ensure_loaded()
+    loaded = make_index(tmp_path)
+    assert loaded.is_fresh()
+    loaded.ensure_loaded()
+
+    assert isinstance(loaded.postings_rows, np.memmap)
+    built_rows, built_scores = built.search('energetic', n=20)
+    loaded_rows, loaded_scores = loaded.search('energetic', n=20)
+    np.testing.assert_array_equal(loaded_rows, built_rows)
+    np.testing.assert_array_equal(loaded_scores, built_scores)
+    assert list(loaded.find('energetic', n=3)['ytid']) == list(table['ytid'].iloc[built_rows[:3]])
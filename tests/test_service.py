@@ -0,0 +1,74 @@
+"""Status codes of RecommendationService.handle"""
+import asyncio
+import threading
+
+import pandas as pd
+import pytest
+
+from service import MAX_N, RecommendationService
+from synthetic import make_recommender
+
+
+@pytest.fixture(scope='module')
+def recommender():
+    recommender = make_recommender(n_artists=300)
+    recommender.process_song_features()
+    return recommender
+
+
+def handle(service, path):
+    return asyncio.run(service.handle(path))
+
+
+def test_answers_query(recommender):
+    status, payload = handle(RecommendationService(recommender, max_workers=1), '/recommend/mood?q=happy&n=3')
+    assert status == 200
+    assert payload['query'] == {'type': 'mood', 'value': 'happy', 'n': 3}
+    assert len(payload['results']) == 3
+
+
+@pytest.mark.parametrize('path', [
+    '/recommend/mood?q=happy&n=abc',
+    '/recommend/mood?q=happy&n=0',
+    f'/recommend/mood?q=happy&n={MAX_N + 1}',
+    '/recommend/tag?n=3',
+    '/recommend/mood?q=nope',
+    '/recommend/instrumental?q=calm',
+])
+def test_rejects_bad_queries_with_400(recommender, path):
+    service = RecommendationService(recommender, max_workers=1)
+    status, payload = handle(service, path)
+    assert status == 400
+    assert payload['error']
+
+
+def test_unknown_path_is_404(recommender):
+    status, _ = handle(RecommendationService(recommender, max_workers=1), '/recommend/genre?q=rock')
+    assert status == 404
+
+
+def test_rejects_work_past_max_pending_with_503(recommender):
+    release = threading.Event()
+
+    def find_instrumental(value, n):
+        release.wait(5)
+        return pd.DataFrame({'caption': [value] * n})
+
+    service = RecommendationService(recommender, find_instrumental, max_workers=1, max_pending=1)
+
+    async def requests():
+        first = asyncio.create_task(service.handle('/recommend/instrumental?q=calm&n=2'))
+        same = asyncio.create_task(service.handle('/recommend/instrumental?q=calm&n=2'))
+        await asyncio.sleep(0.05)
+        # The pool queue is full: a different query is refused, while the same one shares the first
+        rejected = await service.handle('/recommend/instrumental?q=piano&n=2')
+        release.set()
+        return await first, await same, rejected
+
+    (first, first_payload), (same, same_payload), (rejected, rejected_payload) = asyncio.run(requests())
+    assert first == same == 200
+    assert same_payload == first_payload
+    assert rejected == 503
+    assert 'pending' in rejected_payload['error']
+    assert service.counters['rejected'] == 1
+    assert service.counters['coalesced'] == 1
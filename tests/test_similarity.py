@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from similarity import ExactSimilarity, top_k_columns
+from synthetic import make_recommender
+
+
+@pytest.mark.parametrize('n_rows', [1, 5, 256, 300, 1000])
+@pytest.mark.parametrize('k', [1, 3, 40])
+def test_top_k_columns_matches_sort(n_rows, k):
+    k = min(k, n_rows)
+    similarities = np.random.default_rng(n_rows).random((n_rows, 7)).astype(np.float32)
+    rows, values = top_k_columns(similarities, k, chunk_rows=16)
+    np.testing.assert_array_equal(values, -np.sort(-similarities, axis=0)[:k].T)
+    np.testing.assert_array_equal(similarities[rows, np.arange(7)[:, None]], values)
+
+
+def test_search_batch_matches_search():
+    recommender = make_recommender(n_artists=2000)
+    recommender.process_song_features()
+    tfidf = recommender.tfidf_matrix
+    queries = np.random.default_rng(0).choice(tfidf.shape[0], 100, replace=False)
+
+    index = ExactSimilarity(tfidf, block_size=32).build()
+    batch = index.search_batch(tfidf[queries], 4, exclude=queries)
+    for query, (rows, similarities) in zip(queries, batch):
+        assert query not in rows
+        _, expected = index.search(tfidf[query], 4, exclude=query)
+        np.testing.assert_allclose(similarities, expected, atol=1e-6)
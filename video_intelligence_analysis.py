@@ -1,8 +1,19 @@
-import io
-from dotenv import load_dotenv
-from google.cloud import videointelligence
+import os
+from visual_feature import detect_shots
+from instrumentation import span
+
+# Default backend when vi_analysis is called without one: 'cloud' or 'local'
+DEFAULT_BACKEND = 'cloud'
+
+
+def _offset_seconds(offset):
+    return offset.seconds + offset.microseconds / 1e6
+
+
+def _cloud_analysis(video_path):
+    """Label and shot change detection with the Video Intelligence API"""
+    from google.cloud import videointelligence
 
-def vi_analysis(video_path):
     video_client = videointelligence.VideoIntelligenceServiceClient()
     
     # Use multiple features including LABEL_DETECTION and SHOT_CHANGE_DETECTION
@@ -11,7 +22,8 @@ def vi_analysis(video_path):
         videointelligence.Feature.SHOT_CHANGE_DETECTION
     ]
     
-    with open(video_path, 'rb') as media_file: #works perrfectly
+    # The API takes inline content as a single payload
+    with open(video_path, 'rb') as media_file:
         input_content = media_file.read()
         
     operation = video_client.annotate_video(
@@ -25,21 +37,76 @@ def vi_analysis(video_path):
     result = operation.result(timeout=180)
     print('\nFinished processing.')
 
+    annotations = result.annotation_results[0]
+    labels = [
+        {
+            'description': segment_label.entity.description,
+            'segments': [
+                {
+                    'start_time': _offset_seconds(segment.segment.start_time_offset),
+                    'end_time': _offset_seconds(segment.segment.end_time_offset),
+                    'confidence': segment.confidence
+                }
+                for segment in segment_label.segments
+            ]
+        }
+        for segment_label in annotations.segment_label_annotations
+    ]
+    shots = [
+        {
+            'start_time': _offset_seconds(shot.start_time_offset),
+            'end_time': _offset_seconds(shot.end_time_offset)
+        }
+        for shot in annotations.shot_annotations
+    ]
+    return {'backend': 'cloud', 'labels': labels, 'shots': shots}
+
+
+def _local_analysis(video_path):
+    """Shot change detection on this machine, streaming the video frames
+
+    There is no local label model, so labels are always empty.
+    """
+    return {'backend': 'local', 'labels': [], 'shots': detect_shots(video_path)}
+
+
+VI_BACKENDS = {
+    'cloud': _cloud_analysis,
+    'local': _local_analysis,
+}
+
+
+def resolve_backend(backend=None):
+    """The backend to use: the given one, else VI_BACKEND, else DEFAULT_BACKEND"""
+    backend = backend or os.getenv('VI_BACKEND', DEFAULT_BACKEND)
+    if backend not in VI_BACKENDS:
+        raise ValueError(f"Unknown video analysis backend: {backend}. "
+                         f"Available backends: {list(VI_BACKENDS)}")
+    return backend
+
+
+@span('vi_analysis')
+def vi_analysis(video_path, backend=None):
+    """Detect segment labels and shot changes in a video
+
+    backend is 'cloud' (Video Intelligence API) or 'local' (offline shot
+    detection, no labels); it defaults to the VI_BACKEND environment
+    variable, then DEFAULT_BACKEND. Returns
+    {'backend': ..., 'labels': [{'description', 'segments': [{'start_time',
+    'end_time', 'confidence'}]}], 'shots': [{'start_time', 'end_time'}]}.
+    """
+    result = VI_BACKENDS[resolve_backend(backend)](video_path)
+
     # Process segment labels
-    segment_labels = result.annotation_results[0].segment_label_annotations
-    for segment_label in segment_labels:
-        print('Video label description: {}'.format(segment_label.entity.description))
-        for i, segment in enumerate(segment_label.segments):
-            start_time = (segment.segment.start_time_offset.seconds + segment.segment.start_time_offset.microseconds / 1e6)
-            end_time = (segment.segment.end_time_offset.seconds + segment.segment.end_time_offset.microseconds / 1e6)
-            positions = '{}s to {}s'.format(start_time, end_time)
-            confidence = segment.confidence
+    for label in result['labels']:
+        print('Video label description: {}'.format(label['description']))
+        for i, segment in enumerate(label['segments']):
+            positions = '{}s to {}s'.format(segment['start_time'], segment['end_time'])
             print('\tSegment {}: {}'.format(i, positions))
-            print('\tConfidence: {}'.format(confidence))
+            print('\tConfidence: {}'.format(segment['confidence']))
 
     # Process shot change detection
-    # to be re-used elsewhere
-    for shot in result.annotation_results[0].shot_annotations:
-        start_time = (shot.start_time_offset.seconds + shot.start_time_offset.microseconds / 1e6)
-        end_time = (shot.end_time_offset.seconds + shot.end_time_offset.microseconds / 1e6)
-        print('Shot change from {}s to {}s'.format(start_time, end_time))
+    for shot in result['shots']:
+        print('Shot change from {}s to {}s'.format(shot['start_time'], shot['end_time']))
+
+    return result
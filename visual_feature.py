@@ -1,36 +1,287 @@
+import os
 import cv2
+import queue
+import threading
+import numpy as np
 
-def analyze_visual_tempo(video_path):
-    cap = cv2.VideoCapture(video_path)
-    prev_frame = None
-    motion_frames = 0
+# Grey-level difference that counts a pixel as changed
+DIFF_THRESHOLD = 30
+
+# Changed pixels (at full resolution) that mark a frame as a motion frame
+MOTION_PIXELS = 1000
+
+# Hue/saturation histogram distance (Bhattacharyya, 0 to 1) that marks a cut
+SHOT_HIST_THRESHOLD = 0.4
+
+# Mean grey-level difference that must come with the histogram change
+SHOT_DIFF_THRESHOLD = 12
+
+# Shortest shot kept, so flashes do not split a shot
+MIN_SHOT_SECONDS = 0.5
+
+# Decoded bytes per frame block: blocks of large frames shrink to a few
+# frames, so each frame is still in cache when it is processed
+BLOCK_BYTES = 4 << 20
+
+# Most frames per block, reached by downscaled frames
+MAX_BLOCK_FRAMES = 16
+
+
+def _decode_blocks(cap, frame_stride, size, block_size, get_buffer, stop):
+    """Decode every frame_stride-th frame into block buffers from get_buffer"""
+    full_frame = None
+    if size != (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))):
+        full_frame = np.empty(
+            (int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), 3),
+            dtype=np.uint8
+        )
+
+    frames = get_buffer()
+    indices = []
+    index = 0
+    while frames is not None and not stop.is_set():
+        # Skipped frames are only grabbed, not decoded
+        if index % frame_stride:
+            if not cap.grab():
+                break
+            index += 1
+            continue
 
-    while cap.isOpened():
-        ret, frame = cap.read()
+        # Decode straight into the block, downscaling on the way if needed
+        slot = frames[len(indices)]
+        if full_frame is None:
+            ret, frame = cap.read(slot)
+            # OpenCV may hand back a new array instead of filling slot
+            if ret and frame is not slot:
+                slot[...] = frame
+        else:
+            ret, _ = cap.read(full_frame)
+            if ret:
+                cv2.resize(full_frame, size, dst=slot, interpolation=cv2.INTER_AREA)
         if not ret:
             break
+        indices.append(index)
+        index += 1
 
-        # Convert to grayscale for easier analysis
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        gray = cv2.GaussianBlur(gray, (5, 5), 0)
+        if len(indices) == block_size:
+            yield np.array(indices), frames
+            frames, indices = get_buffer(), []
 
-        if prev_frame is None:
-            prev_frame = gray
-            continue
+    if indices:
+        yield np.array(indices), frames[:len(indices)]
+
+
+def _open_video(video_path):
+    """VideoCapture of video_path, raising IOError when it cannot be opened"""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        cap.release()
+        raise IOError(f"Cannot open {video_path}")
+    return cap
+
+
+def iter_frame_blocks(video_path, frame_stride=1, scale=1.0, block_size=None, prefetch=2, overlap=None):
+    """Yield (frame_indices, frames) blocks of decoded BGR frames
+
+    frames is a uint8 array of shape (n, height, width, 3) at the given
+    scale; its buffer is reused once the next block is requested, so memory
+    stays bounded whatever the video length. block_size defaults to as many
+    frames as fit in BLOCK_BYTES, up to MAX_BLOCK_FRAMES. With overlap (the default on
+    multi-core machines) a producer thread decodes the next blocks while
+    the caller works on the current one.
+    """
+    if overlap is None:
+        overlap = (os.cpu_count() or 1) > 1
+
+    cap = _open_video(video_path)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    if block_size is None:
+        block_size = max(1, min(MAX_BLOCK_FRAMES, BLOCK_BYTES // (size[0] * size[1] * 3)))
+
+    def new_buffer():
+        return np.empty((block_size, size[1], size[0], 3), dtype=np.uint8)
+
+    stop = threading.Event()
+    if not overlap:
+        buffer = new_buffer()
+        try:
+            yield from _decode_blocks(cap, frame_stride, size, block_size, lambda: buffer, stop)
+        finally:
+            cap.release()
+        return
+
+    # prefetch blocks queued, one being filled and one held by the caller
+    free = queue.Queue()
+    for _ in range(prefetch + 2):
+        free.put(new_buffer())
+    blocks = queue.Queue(maxsize=prefetch)
+    errors = []
 
-        # Calculate the absolute difference between frames
-        diff = cv2.absdiff(prev_frame, gray)
-        _, thresh = cv2.threshold(diff, 30, 255, cv2.THRESH_BINARY)
+    def get_buffer():
+        while not stop.is_set():
+            try:
+                return free.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
 
-        # Count non-zero pixels (indicating motion)
-        motion = cv2.countNonZero(thresh)
-        if motion > 1000:  # Threshold for detecting significant motion
-            motion_frames += 1
+    def produce():
+        try:
+            for block in _decode_blocks(cap, frame_stride, size, block_size, get_buffer, stop):
+                blocks.put(block)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            cap.release()
+            blocks.put(None)
 
-        prev_frame = gray
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            block = blocks.get()
+            if block is None:
+                break
+            yield block
+            # The caller is done with this block: hand its buffer back
+            frames = block[1]
+            free.put(frames if frames.base is None else frames.base)
+    finally:
+        # Unblock and stop the producer if the caller stops early
+        stop.set()
+        while producer.is_alive():
+            try:
+                blocks.get_nowait()
+            except queue.Empty:
+                producer.join(timeout=0.1)
 
+    if errors:
+        raise errors[0]
+
+
+def analyze_visual_tempo(video_path, frame_stride=1, scale=1.0, block_size=None, overlap=None):
+    """Measure motion between sampled frames of a video
+
+    Returns a dict with the number of motion frames and a per-second motion
+    intensity series (mean share of changed pixels between sampled frames).
+    With the defaults every frame is compared at full resolution.
+    """
+    cap = _open_video(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
     cap.release()
+
+    # Changed-pixel counts shrink with the frame area
+    motion_pixels = MOTION_PIXELS * scale * scale
+
+    gray = blurred = prev = diff = None
+    seconds, intensities = [], []
+    motion_frames = 0
+
+    blocks = iter_frame_blocks(video_path, frame_stride, scale, block_size, overlap=overlap)
+    for indices, frames in blocks:
+        if gray is None:
+            gray = np.empty(frames.shape[1:3], dtype=np.uint8)
+            blurred, diff = np.empty_like(gray), np.empty_like(gray)
+
+        # Each frame is differenced against its predecessor as soon as it is
+        # blurred, in preallocated buffers, while it is still in cache
+        changed = []
+        for frame in frames:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray)
+            if prev is None:
+                # The very first frame has no predecessor to compare with
+                prev = np.empty_like(gray)
+                cv2.GaussianBlur(gray, (5, 5), 0, dst=prev)
+                indices = indices[1:]
+                continue
+            cv2.GaussianBlur(gray, (5, 5), 0, dst=blurred)
+            cv2.absdiff(prev, blurred, dst=diff)
+            cv2.threshold(diff, DIFF_THRESHOLD, 255, cv2.THRESH_BINARY, dst=diff)
+            changed.append(cv2.countNonZero(diff))
+            prev, blurred = blurred, prev
+
+        if changed:
+            changed = np.array(changed)
+            motion_frames += int(np.count_nonzero(changed > motion_pixels))
+            seconds.append((indices / fps).astype(np.int64))
+            intensities.append(changed / gray.size)
+
+    if seconds:
+        seconds = np.concatenate(seconds)
+        intensities = np.concatenate(intensities)
+        totals = np.bincount(seconds, weights=intensities)
+        counts = np.bincount(seconds)
+        motion_per_second = np.divide(totals, counts, out=np.zeros_like(totals), where=counts > 0)
+    else:
+        intensities = motion_per_second = np.zeros(0)
+
     print(f"Motion frames detected: {motion_frames}")
+    return {
+        'motion_frames': motion_frames,
+        'frames_compared': len(intensities),
+        'fps': fps,
+        'motion_per_second': motion_per_second.tolist()
+    }
+
+
+def detect_shots(video_path, frame_stride=1, scale=0.25, hist_threshold=SHOT_HIST_THRESHOLD,
+                 diff_threshold=SHOT_DIFF_THRESHOLD, min_shot_seconds=MIN_SHOT_SECONDS, overlap=None):
+    """Detect hard cuts from colour histograms and frame differences
+
+    A cut is placed where both the hue/saturation histogram and the grey
+    levels change sharply between sampled frames. Frames are streamed in
+    blocks, so the video is never held in memory. Returns the shots as
+    [{'start_time': s, 'end_time': s}, ...] covering the whole video.
+    """
+    cap = _open_video(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    min_gap = max(1, int(min_shot_seconds * fps))
+    cuts = [0]
+    prev_hist = prev_gray = hsv = gray = None
+    last_index = -1
+
+    blocks = iter_frame_blocks(video_path, frame_stride, scale, overlap=overlap)
+    for indices, frames in blocks:
+        if hsv is None:
+            hsv = np.empty_like(frames[0])
+            gray = np.empty(frames.shape[1:3], dtype=np.uint8)
+            prev_gray = np.empty_like(gray)
+        n_pixels = gray.size
+
+        for index, frame in zip(indices, frames):
+            cv2.cvtColor(frame, cv2.COLOR_BGR2HSV, dst=hsv)
+            hist = cv2.calcHist([hsv], [0, 1], None, [16, 16], [0, 180, 0, 256])
+            cv2.normalize(hist, hist)
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray)
+
+            if prev_hist is not None:
+                hist_distance = cv2.compareHist(prev_hist, hist, cv2.HISTCMP_BHATTACHARYYA)
+                mean_diff = cv2.norm(prev_gray, gray, cv2.NORM_L1) / n_pixels
+                if (hist_distance > hist_threshold and mean_diff > diff_threshold
+                        and index - cuts[-1] >= min_gap):
+                    cuts.append(int(index))
+
+            prev_hist = hist
+            gray, prev_gray = prev_gray, gray
+            last_index = index
+
+    if last_index < 0:
+        return []
+
+    # Streams without a reliable frame count end at the last sampled frame
+    end = max(frame_count, int(last_index) + 1)
+    bounds = cuts + [end]
+    return [
+        {'start_time': round(start / fps, 3), 'end_time': round(stop / fps, 3)}
+        for start, stop in zip(bounds[:-1], bounds[1:])
+    ]
+
 
-# Example usage
-analyze_visual_tempo('./greenery.mp4')
\ No newline at end of file
+if __name__ == '__main__':
+    # Example usage
+    analyze_visual_tempo('./greenery.mp4')